@@ -0,0 +1,73 @@
+import asyncio
+import json
+import os
+from collections import deque
+
+AUDIT_ROLES = [role.strip() for role in os.getenv("AUDIT_ROLES", "moderator").split(",") if role.strip()]  # whose sockets get DM copies
+AUDIT_LOG = os.getenv("AUDIT_LOG", "")  # JSON-lines file of every copy; unset = no file
+AUDIT_BUFFER = int(os.getenv("AUDIT_BUFFER", "10000"))  # copies waiting; past this the oldest are dropped
+AUDIT_BATCH = 200           # copies per delivery to each subscriber
+AUDIT_FLUSH_INTERVAL = 0.1  # seconds a copy may wait for the batch to fill
+
+
+class AuditTap:
+    # Copies of private messages for whoever monitors them. tap() only
+    # appends to a bounded buffer, so the sender and recipient never wait
+    # on it; a background task hands the copies to every subscriber in
+    # batches. If subscribers fall behind, the oldest copies are dropped
+    # (and counted) rather than letting the buffer grow without limit.
+
+    def __init__(self, maxsize=AUDIT_BUFFER, batch=AUDIT_BATCH, interval=AUDIT_FLUSH_INTERVAL):
+        self.buffer = deque(maxlen=maxsize)
+        self.batch = batch
+        self.interval = interval
+        self.subscribers = []  # async callables taking a list of copies
+        self.ready = asyncio.Event()
+        self.tapped = 0
+        self.dropped = 0
+        self.delivered = 0
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    def tap(self, copy):
+        if not self.subscribers:
+            return
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(copy)
+        self.tapped += 1
+        self.ready.set()
+
+    async def flush(self):
+        while self.buffer:
+            count = min(self.batch, len(self.buffer))
+            copies = [self.buffer.popleft() for _ in range(count)]
+            for subscriber in self.subscribers:
+                try:
+                    await subscriber(copies)
+                except Exception as e:
+                    print(f"Audit subscriber {getattr(subscriber, '__name__', subscriber)} failed: {e}")
+            self.delivered += count
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            if len(self.buffer) < self.batch:
+                await asyncio.sleep(self.interval)  # let a few more copies join the batch
+            await self.flush()
+
+
+class AuditLog:
+    # Subscriber: appends each batch to a JSON-lines file, off the event loop
+    def __init__(self, path):
+        self.path = path
+        self.__name__ = f"AuditLog({path})"
+
+    def _append(self, lines):
+        with open(self.path, "a") as f:
+            f.write(lines)
+
+    async def __call__(self, copies):
+        await asyncio.to_thread(self._append, "".join(json.dumps(copy) + "\n" for copy in copies))
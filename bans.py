@@ -0,0 +1,66 @@
+import itertools
+from collections import deque
+
+BAN_LOG_SIZE = 1000  # changes remembered for clients catching up; older versions get the full list
+
+
+class BanList:
+    # The banned usernames plus a numbered log of recent changes. A client
+    # that already has version N of the list is sent only the changes after
+    # N. Versions count changes seen by this process, so the epoch changes on
+    # every start and each worker has its own; a client holding a different
+    # epoch gets the full list again.
+
+    def __init__(self, epoch):
+        self.epoch = epoch
+        self.version = 0
+        self.users = set()
+        self.changes = deque(maxlen=BAN_LOG_SIZE)  # delta frames, oldest first
+        self.cached_snapshot = None  # sorted full list, rebuilt after a change
+
+    def __contains__(self, username):
+        return username in self.users
+
+    def __len__(self):
+        return len(self.users)
+
+    def load(self, usernames):
+        self.users = set(usernames)
+        self.version = 0
+        self.changes.clear()
+        self.cached_snapshot = None
+
+    def apply(self, username, banned):
+        # Returns the delta frame to broadcast, or None if nothing changed
+        if banned == (username in self.users):
+            return None
+        if banned:
+            self.users.add(username)
+        else:
+            self.users.discard(username)
+        self.version += 1
+        self.cached_snapshot = None
+        delta = {"type": "ban_added" if banned else "ban_removed", "username": username, "version": self.version}
+        self.changes.append(delta)
+        return delta
+
+    def snapshot(self):
+        if self.cached_snapshot is None:
+            self.cached_snapshot = {"type": "banned_users_list", "epoch": self.epoch, "version": self.version,
+                                    "banned_users": sorted(self.users)}
+        return self.cached_snapshot
+
+    def since(self, seen):
+        # Frames that bring a client holding `seen` ({"epoch", "version"}) up to date
+        if not isinstance(seen, dict) or seen.get("epoch") != self.epoch or not isinstance(seen.get("version"), int):
+            return [self.snapshot()]
+        version = seen["version"]
+        if version == self.version:
+            return []
+        oldest = self.changes[0]["version"] if self.changes else self.version + 1
+        if version > self.version or version < oldest - 1:
+            return [self.snapshot()]
+        missing = self.version - version
+        if missing > len(self.users):  # the list itself is smaller than the catch-up
+            return [self.snapshot()]
+        return list(itertools.islice(self.changes, len(self.changes) - missing, None))
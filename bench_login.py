@@ -0,0 +1,79 @@
+import argparse
+import base64
+import os
+import random
+import tempfile
+import time
+
+from bans import BanList
+from codec import CODECS, Frame
+from presence import Presence
+from session import build_session_init
+from storage import FlatFileBackend
+from user_store import UserStore
+
+# Reconnect storm: every user logs back in at once after a deploy. Times the
+# server side of a login (user lookup, password check, snapshot, encode)
+# against a synthetic user base.
+
+
+def write_users(path, count):
+    with open(path, "w") as f:
+        for i in range(count):
+            encoded_pw = base64.b64encode(f"pw{i}".encode()).decode()
+            f.write(f"user{i}:{encoded_pw}:user{i}@example.com:2024-01-01:{i % 500}.0:user{i}\n")
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run(users, logins, history_depth):
+    with tempfile.TemporaryDirectory() as tmp:
+        users_file = os.path.join(tmp, "users.txt")
+        write_users(users_file, users)
+        backend = FlatFileBackend(users_file=users_file, items_file=os.path.join(tmp, "items.json"),
+                                  roles_file=os.path.join(tmp, "roles.json"), bans_file=os.path.join(tmp, "bans.txt"))
+        started = time.perf_counter()
+        store = UserStore(backend)
+        load_time = time.perf_counter() - started
+
+        banned = BanList("bench")
+        banned.load(f"user{i}" for i in range(0, users, 97))
+        history = [{"type": "group_message", "room": "general", "sender": "user1", "message": "hello " * 10,
+                    "sentcolor": "red", "senderscreen": "user1", "seq": i} for i in range(history_depth)]
+        order = [random.randrange(users) for _ in range(logins)]
+        online = Presence("bench")
+        for i in range(0, users, 10):
+            online.mark("bench", f"user{i}", True)
+
+        for codec in CODECS.values():
+            samples = []
+            frame_bytes = 0
+            storm_started = time.perf_counter()
+            for i in order:
+                t0 = time.perf_counter()
+                username = f"user{i}"
+                user = store.get(username)
+                encoded_pw = base64.b64encode(f"pw{i}".encode()).decode()
+                assert user["password"] == encoded_pw
+                snapshot = build_session_init(username, user, "noob", backend.get_items(username), banned.since(None),
+                                              "general", history, online.page())
+                data = Frame(snapshot).encode(codec)
+                samples.append(time.perf_counter() - t0)
+                frame_bytes = len(data)
+            elapsed = time.perf_counter() - storm_started
+            samples.sort()
+            print(f"[{codec.name}] {logins} logins over {users} users: {logins / elapsed:,.0f} logins/s, "
+                  f"p50 {percentile(samples, 0.5) * 1e6:.1f}us, p99 {percentile(samples, 0.99) * 1e6:.1f}us, "
+                  f"session_init {frame_bytes} bytes")
+        print(f"User store load: {load_time * 1000:.1f}ms for {users} users")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the login/session_init path")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--logins", type=int, default=20000)
+    parser.add_argument("--history", type=int, default=10)
+    args = parser.parse_args()
+    run(args.users, args.logins, args.history)
@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from bench_login import write_users
+from roles import RoleIndex
+from snapshot import encode_snapshot, load_snapshot, write_snapshot
+from storage import FlatFileBackend
+from user_store import UserStore
+
+# Cold start: how long until the stores are loaded and indexed, parsing the
+# text files versus restoring the binary snapshot of the same state.
+
+
+def write_stores(tmp, users):
+    write_users(os.path.join(tmp, "users.txt"), users)
+    with open(os.path.join(tmp, "user_items.json"), "w") as f:
+        json.dump({f"user{i}": ["Pro", "Important Alert"] for i in range(0, users, 3)}, f)
+    with open(os.path.join(tmp, "admins.json"), "w") as f:
+        json.dump([{"username": f"user{i}", "role": "pro"} for i in range(0, users, 50)], f)
+    with open(os.path.join(tmp, "banned_users.txt"), "w") as f:
+        f.writelines(f"user{i}\n" for i in range(0, users, 97))
+
+
+def open_backend(tmp):
+    return FlatFileBackend(users_file=os.path.join(tmp, "users.txt"), items_file=os.path.join(tmp, "user_items.json"),
+                           roles_file=os.path.join(tmp, "admins.json"), bans_file=os.path.join(tmp, "banned_users.txt"))
+
+
+def start_from_text(tmp):
+    backend = open_backend(tmp)
+    store = UserStore(backend)
+    backend.load_items()
+    RoleIndex(backend)
+    backend.load_bans()
+    return store
+
+
+def start_from_snapshot(tmp, path):
+    backend = open_backend(tmp)
+    state = load_snapshot(path)
+    assert state["stamp"] == backend.stamp()
+    backend.restore(state["items"], state["roles"])
+    store = UserStore(backend, state["users"])
+    RoleIndex(backend)
+    set(state["bans"])
+    return store
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(users, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        write_stores(tmp, users)
+        store = start_from_text(tmp)
+        backend = store.backend
+        path = os.path.join(tmp, "state.snapshot")
+        started = time.perf_counter()
+        data = encode_snapshot({"stamp": backend.stamp(), "users": store.users, "items": backend.load_items(),
+                                "roles": backend.load_roles(), "bans": sorted(backend.load_bans())})
+        write_snapshot(path, data)
+        write_time = time.perf_counter() - started
+
+        text_time = best_of(repeat, start_from_text, tmp)
+        snapshot_time = best_of(repeat, start_from_snapshot, tmp, path)
+        text_bytes = sum(os.path.getsize(os.path.join(tmp, name))
+                         for name in ("users.txt", "user_items.json", "admins.json", "banned_users.txt"))
+        print(f"{users} users: text stores {text_time * 1000:.1f}ms ({text_bytes:,} bytes), "
+              f"snapshot {snapshot_time * 1000:.1f}ms ({len(data):,} bytes), {text_time / snapshot_time:.1f}x faster; "
+              f"writing the snapshot took {write_time * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cold start from text stores vs a state snapshot")
+    parser.add_argument("--users", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    for count in args.users:
+        run(count, args.repeat)
@@ -0,0 +1,175 @@
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from bench_startup import open_backend, write_stores
+from storage import SQLiteBackend, migrate
+from user_store import UserStore
+
+# Every store operation behind the chat_server.py helpers (load_users,
+# save_user, update_user_balance, update_user_screenname, add_item_to_user,
+# load_banned_users, ...) timed against a synthetic user base, per backend and
+# size. Each case runs in its own process so peak RSS is that case's alone.
+# --save writes the results as JSON; --baseline compares against an earlier
+# run and exits non-zero when an op got slower than --threshold allows.
+
+SIZES = (10000, 100000, 1000000)
+WRITES_PER_FLUSH = 20  # writes between group commits, roughly a busy server's 50ms batch
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB elsewhere
+
+
+class Timer:
+    # Runs an op until it has done `ops` calls or used up `budget` seconds
+    def __init__(self, ops, budget):
+        self.ops = ops
+        self.budget = budget
+        self.results = {}
+
+    def time(self, name, func, ops=None):
+        ops = ops or self.ops
+        done = 0
+        started = time.perf_counter()
+        elapsed = 0.0
+        while done < ops and elapsed < self.budget:
+            func(done)
+            done += 1
+            elapsed = time.perf_counter() - started
+        self.results[name] = {
+            "ops": done,
+            "seconds": round(elapsed, 6),
+            "ops_per_sec": round(done / elapsed, 1) if elapsed else None,
+            "mean_us": round(elapsed * 1e6 / done, 2) if done else None,
+        }
+
+
+def build_backend(kind, tmp, users):
+    write_stores(tmp, users)
+    files = open_backend(tmp)
+    if kind == "files":
+        return files
+    path = os.path.join(tmp, "bench.sqlite3")
+    migrate(files, SQLiteBackend(path))
+    return SQLiteBackend(path)
+
+
+def run_case(kind, users, ops, budget, seed):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        backend = build_backend(kind, tmp, users)
+        generate_time = time.perf_counter() - started
+
+        timer = Timer(ops, budget)
+        timer.time("load_users", lambda i: UserStore(backend), ops=3)
+        store = UserStore(backend)
+        picks = [rng.randrange(users) for _ in range(ops)]
+
+        def flushed(write):
+            def op(i):
+                write(i)
+                if i % WRITES_PER_FLUSH == WRITES_PER_FLUSH - 1:
+                    backend.flush(store.users)
+            return op
+
+        def validate_login(i):
+            user = store.get(f"user{picks[i]}")
+            assert user["password"] == base64.b64encode(f"pw{picks[i]}".encode()).decode()
+
+        timer.time("get_user", lambda i: store.get(f"user{picks[i]}"))
+        timer.time("validate_login", validate_login)
+        timer.time("is_screenname_conflict", lambda i: store.is_screenname_conflict(f"user{picks[i]}", f"user{picks[-i]}"))
+        timer.time("update_user_balance", flushed(lambda i: store.set_balance(f"user{picks[i]}", i)))
+        timer.time("update_user_screenname", flushed(lambda i: store.set_screenname(f"user{picks[i]}", f"screen{i}")))
+        timer.time("save_user", flushed(lambda i: store.add(f"new{i}", "cHc=", f"new{i}@example.com", "2024-01-01")))
+        backend.flush(store.users)
+
+        timer.time("get_user_items", lambda i: backend.get_items(f"user{picks[i]}"))
+        timer.time("add_item_to_user", flushed(lambda i: backend.add_item(f"user{picks[i]}", "Bench Item")))
+        timer.time("remove_item_from_user", flushed(lambda i: backend.remove_item(f"user{picks[i]}", "Bench Item")))
+
+        timer.time("load_roles", lambda i: backend.load_roles())
+        timer.time("set_role", flushed(lambda i: backend.set_role(f"user{picks[i]}", "pro")))
+        timer.time("remove_role", flushed(lambda i: backend.remove_role(f"user{picks[i]}")))
+
+        timer.time("load_banned_users", lambda i: backend.load_bans(), ops=max(1, ops // 10))
+        timer.time("add_ban", flushed(lambda i: backend.add_ban(f"user{picks[i]}")))
+        timer.time("remove_ban", flushed(lambda i: backend.remove_ban(f"user{picks[i]}")))
+
+        timer.time("stamp", lambda i: backend.stamp())
+        backend.close(store.users)
+        return {
+            "backend": kind,
+            "users": users,
+            "generate_s": round(generate_time, 3),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "ops": timer.results,
+        }
+
+
+def run_isolated(*args):
+    # Fork a fresh process per case so ru_maxrss isn't inherited from a bigger one
+    with multiprocessing.get_context("fork").Pool(1) as pool:
+        return pool.apply(run_case, args)
+
+
+def compare(results, baseline, threshold):
+    # Regressions: ops that lost more than `threshold` of their baseline ops/sec, or RSS that grew by as much
+    old = {(case["backend"], case["users"]): case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        before = old.get((case["backend"], case["users"]))
+        if before is None:
+            continue
+        label = f"{case['backend']}/{case['users']}"
+        for name, stats in case["ops"].items():
+            was = before["ops"].get(name, {}).get("ops_per_sec")
+            if was and stats["ops_per_sec"] and stats["ops_per_sec"] < was * (1 - threshold):
+                regressions.append(f"{label} {name}: {was:,.0f} -> {stats['ops_per_sec']:,.0f} ops/s")
+        if case["peak_rss_bytes"] > before["peak_rss_bytes"] * (1 + threshold):
+            regressions.append(f"{label} peak RSS: {before['peak_rss_bytes']:,} -> {case['peak_rss_bytes']:,} bytes")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every storage operation at several user-base sizes")
+    parser.add_argument("--users", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--backend", nargs="+", choices=("files", "sqlite"), default=["files", "sqlite"])
+    parser.add_argument("--ops", type=int, default=2000, help="calls per operation")
+    parser.add_argument("--budget", type=float, default=5.0, help="seconds per operation at most, for the slow ones at large sizes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before a regression is reported")
+    args = parser.parse_args()
+
+    results = {"python": sys.version.split()[0], "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "cases": []}
+    for users in args.users:
+        for kind in args.backend:
+            case = run_isolated(kind, users, args.ops, args.budget, args.seed)
+            results["cases"].append(case)
+            print(f"[{kind}] {users:,} users (generated in {case['generate_s']}s, peak RSS {case['peak_rss_bytes'] / 2**20:.0f} MiB)")
+            for name, stats in case["ops"].items():
+                print(f"  {name:<24} {stats['ops_per_sec'] or 0:>12,.1f} ops/s  {stats['mean_us'] or 0:>12,.1f}us  ({stats['ops']} ops)")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
@@ -0,0 +1,194 @@
+import asyncio
+import os
+import time
+import traceback
+
+from codec import DEFAULT_CODEC, Frame
+from metrics import Counter, Histogram
+
+OUTBOX_HIGH_WATER = int(os.getenv("OUTBOX_HIGH_WATER", "256"))   # queued frames per connection
+SLOW_CONSUMER_POLICY = os.getenv("SLOW_CONSUMER_POLICY", "disconnect")  # "disconnect" or "drop"
+OUTBOX_DRAIN_TIMEOUT = 2.0  # seconds close() waits for queued frames before giving up
+RECIPIENT_BUCKETS = (1, 10, 100, 1000, 10000, float("inf"))
+
+messages_out = Counter("chat_messages_out_total", "Frames queued to clients, by message type", ("type",))
+encode_failures = Counter("chat_outbox_encode_failures_total", "Frames skipped because the connection's codec couldn't encode them", ("codec",))
+outbox_overflows = Counter("chat_outbox_overflows_total", "Frames that hit a full outbox, by slow-consumer policy", ("policy",))
+fanout_seconds = Histogram("chat_fanout_duration_seconds", "Time to queue one broadcast on every recipient")
+fanout_recipients = Histogram("chat_fanout_recipients", "Recipients per broadcast", buckets=RECIPIENT_BUCKETS)
+
+closing = set()  # close tasks in flight; the loop only keeps weak references to tasks
+
+
+def _closed(task):
+    closing.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Closing a socket failed: {task.exception()}")
+
+
+def close_soon(ws, **kwargs):
+    # ws.close() from code that can't await it, without losing the task or its error
+    task = asyncio.create_task(ws.close(**kwargs))
+    closing.add(task)
+    task.add_done_callback(_closed)
+    return task
+
+
+class Outbox:
+    # Bounded outbound queue for one WebSocket, drained by its own writer task.
+    # It stands in for the socket in connected_clients: send_json() only
+    # enqueues, so a slow client never holds up whoever is sending to it.
+
+    def __init__(self, ws, codec=DEFAULT_CODEC, maxsize=OUTBOX_HIGH_WATER, policy=SLOW_CONSUMER_POLICY):
+        self.ws = ws
+        self.codec = codec
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+        self.evicted = False
+        self.writer = None
+        self.audiences = set()  # keys this outbox is subscribed to in an Audiences index
+
+    def __repr__(self):
+        return f"<Outbox queued={self.queue.qsize()} dropped={self.dropped} closed={self.closed}>"
+
+    @property
+    def closed(self):
+        return self.evicted or self.ws.closed
+
+    def start(self):
+        self.writer = asyncio.create_task(self._drain())
+        return self
+
+    def send_nowait(self, payload):
+        frame = payload if isinstance(payload, Frame) else Frame(payload)
+        if self._put(frame):
+            messages_out.inc((frame.payload.get("type"),))
+            return True
+        return False
+
+    def _put(self, frame):
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            self._overflow()
+            return False
+
+    async def send_json(self, payload):
+        # Same call shape as WebSocketResponse.send_json, but never waits on the network
+        self.send_nowait(payload)
+
+    def _overflow(self):
+        outbox_overflows.inc((self.policy,))
+        if self.policy == "drop":
+            self.dropped += 1
+            return
+        print(f"[INFO] Evicting slow consumer with {self.queue.qsize()} queued frames")
+        self.evicted = True
+        close_soon(self.ws, message=b"slow consumer")
+
+    async def _drain(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                try:
+                    try:
+                        data = frame.encode(self.codec)
+                    except Exception as e:
+                        # Something this codec can't represent (orjson and msgpack stop at 64-bit
+                        # integers): skip that one frame, the connection carries on
+                        encode_failures.inc((self.codec.name,))
+                        print(f"Outbox skipped a {frame.payload.get('type')!r} frame it couldn't encode as {self.codec.name}: {e}")
+                        continue
+                    if self.codec.binary:
+                        await self.ws.send_bytes(data)
+                    else:
+                        await self.ws.send_str(data)
+                finally:
+                    self.queue.task_done()
+        except (ConnectionResetError, RuntimeError) as e:
+            # Socket went away underneath us; the handler's finally block cleans up
+            print(f"Outbox writer stopped: {e}")
+            self.evicted = True
+        except Exception as e:
+            # Nothing drains this outbox any more; closed lets the reaper release it
+            print(f"Outbox writer failed: {e!r}")
+            traceback.print_exc()
+            self.evicted = True
+
+    async def flush(self, timeout=OUTBOX_DRAIN_TIMEOUT):
+        if self.writer is None or self.writer.done():
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def close(self):
+        # Let already-queued frames (e.g. a final error message) go out first
+        await self.flush()
+        await self.ws.close()
+        await self.stop()
+
+    async def stop(self):
+        if self.writer is not None:
+            self.writer.cancel()
+            try:
+                await self.writer
+            except asyncio.CancelledError:
+                pass
+
+
+class Audiences:
+    # Index from an audience key, e.g. ("room", "help") or ("role", "admin"),
+    # to the outboxes subscribed to it, so a broadcast only touches members.
+
+    def __init__(self):
+        self.members_by_key = {}
+
+    def join(self, key, outbox):
+        self.members_by_key.setdefault(key, set()).add(outbox)
+        outbox.audiences.add(key)
+
+    def leave(self, key, outbox):
+        members = self.members_by_key.get(key)
+        if members is not None:
+            members.discard(outbox)
+            if not members:
+                del self.members_by_key[key]
+        outbox.audiences.discard(key)
+
+    def move(self, kind, name, outbox):
+        # Keep at most one key of this kind per outbox (one room, one role)
+        for key in [key for key in outbox.audiences if key[0] == kind]:
+            self.leave(key, outbox)
+        self.join((kind, name), outbox)
+
+    def leave_all(self, outbox):
+        for key in list(outbox.audiences):
+            self.leave(key, outbox)
+
+    def members(self, key):
+        return self.members_by_key.get(key, ())
+
+    def count(self, key):
+        return len(self.members_by_key.get(key, ()))
+
+
+def broadcast(outboxes, payload):
+    # Enqueue on every live outbox without awaiting any of them; the payload
+    # is encoded once per codec in use, not once per recipient
+    started = time.perf_counter()
+    frame = Frame(payload)
+    sent = 0
+    for outbox in outboxes:
+        if outbox._put(frame):
+            sent += 1
+    fanout_seconds.observe(time.perf_counter() - started)
+    fanout_recipients.observe(sent)
+    if sent:
+        messages_out.inc((payload.get("type"),), sent)  # one counter update per broadcast, not per recipient
+    return sent
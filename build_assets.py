@@ -0,0 +1,119 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+try:
+    import brotli  # optional: without it only .gz variants are written
+except ImportError:
+    brotli = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Served under a content hash (name.<hash>.ext) with a year-long immutable
+# Cache-Control: a changed file gets a new name, so nothing ever has to be
+# revalidated. Entry points keep their names and are revalidated by ETag.
+FINGERPRINTED = ["style.css", "cursorEffects.js", "icon16.png", "icon48.png", "icon128.png", "icon192.png",
+                 "sademoji.png", "tuco-get-out.mp3"]
+ENTRY_POINTS = ["index.html", "donate.html", "manifest.json", "favicon.ico", "sw.js"]
+COMPRESSIBLE = (".html", ".css", ".js", ".json", ".ico", ".svg", ".txt")
+TEXT = (".html", ".css", ".js", ".json")
+NOT_PRECACHED = (".mp3",)  # fetched with Range requests by <audio>; left to the HTTP cache
+HASH_LENGTH = 10
+
+
+def fingerprint(name, data):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def rewrite_references(text, renamed):
+    # Only references that look like URLs: quoted, in url(), or after a slash,
+    # optionally followed by a query or fragment
+    for name, hashed in renamed.items():
+        text = re.sub(r"(?<=[\"'(/])" + re.escape(name) + r"(?=[\"')?#])", hashed, text)
+    return text
+
+
+def write_compressed(path, data):
+    # Precompressed siblings (file.gz, file.br) that the server picks by Accept-Encoding
+    written = []
+    variants = [(".gz", gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(data, quality=11)))
+    for suffix, compressed in variants:
+        if len(compressed) < len(data) * 0.9:
+            with open(path + suffix, "wb") as f:
+                f.write(compressed)
+            written.append(suffix)
+    return written
+
+
+def build_service_worker(template, cache_name, precache):
+    template = re.sub(r"const CACHE_NAME = '[^']*';", f"const CACHE_NAME = '{cache_name}';", template, count=1)
+    return re.sub(r"const PRECACHE = \[[^\]]*\];", f"const PRECACHE = {json.dumps(precache)};", template, count=1)
+
+
+def build(source, out):
+    if os.path.abspath(source) == os.path.abspath(out):
+        raise SystemExit("Refusing to build into the source directory")
+    if os.path.isdir(out):
+        if os.listdir(out) and not os.path.exists(os.path.join(out, "assets.json")):
+            raise SystemExit(f"{out} is not empty and wasn't made by this script, not touching it")
+        shutil.rmtree(out)
+    os.makedirs(out)
+
+    renamed = {}   # source name -> served name
+    contents = {}  # served name -> bytes
+    # Leaves first (only binaries and CSS/JS that reference them), then the entry points that reference those
+    for name in FINGERPRINTED:
+        with open(os.path.join(source, name), "rb") as f:
+            data = f.read()
+        if name.endswith(TEXT):
+            data = rewrite_references(data.decode("utf-8"), renamed).encode("utf-8")
+        renamed[name] = fingerprint(name, data)
+        contents[renamed[name]] = data
+    for name in ENTRY_POINTS:
+        if name == "sw.js":
+            continue
+        with open(os.path.join(source, name), "rb") as f:
+            data = f.read()
+        if name.endswith(TEXT):
+            data = rewrite_references(data.decode("utf-8"), renamed).encode("utf-8")
+        contents[name] = data
+
+    # The service worker precaches this exact build; its cache name changes with it
+    precache = ["/"] + sorted(f"/{name}" for name in contents
+                              if name not in ("index.html", "favicon.ico") and not name.endswith(NOT_PRECACHED))
+    version = hashlib.sha256(b"".join(hashlib.sha256(contents[name]).digest() for name in sorted(contents))).hexdigest()[:HASH_LENGTH]
+    with open(os.path.join(source, "sw.js"), "r") as f:
+        contents["sw.js"] = build_service_worker(f.read(), f"superchat-{version}", precache).encode("utf-8")
+
+    files = {}
+    for name, data in contents.items():
+        path = os.path.join(out, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        encodings = write_compressed(path, data) if name.endswith(COMPRESSIBLE) else []
+        files[name] = {"bytes": len(data), "encodings": encodings}
+    with open(os.path.join(out, "assets.json"), "w") as f:
+        json.dump({"version": version, "renamed": renamed, "files": files}, f, indent=2)
+    return version, files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fingerprint and precompress the web client for the server to serve")
+    parser.add_argument("--source", default=HERE)
+    parser.add_argument("--out", default=os.path.join(HERE, "static"))
+    args = parser.parse_args()
+
+    version, files = build(args.source, args.out)
+    for name, info in sorted(files.items()):
+        sizes = ", ".join(f"{suffix} {os.path.getsize(os.path.join(args.out, name + suffix)):,}" for suffix in info["encodings"])
+        print(f"{name:<40} {info['bytes']:>9,} bytes{'  (' + sizes + ')' if sizes else ''}")
+    if brotli is None:
+        print("brotli not installed, wrote gzip variants only")
+    print(f"Build {version} in {args.out}; run the server with STATIC_DIR={args.out}")
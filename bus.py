@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+import struct
+
+FRAME_HEADER = struct.Struct(">I")  # payload length
+RECONNECT_DELAY = 1.0
+
+
+# Event bus between worker processes. publish() hands an event to every
+# *other* worker; each worker applies events to its own sockets and caches
+# in the handler passed to subscribe(). Events are plain JSON-able dicts
+# with a "kind" key.
+#
+# The one exception is "room_post": the broker numbers it with the room's
+# next sequence number and sends it, as a "room" event carrying that "seq",
+# to every worker including the sender. Every worker's message log then
+# holds the same messages under the same numbers, so a scrollback cursor
+# from one worker means the same thing on any other. Workers report their
+# logs' next numbers in "hello", so the counters survive a broker restart.
+
+class InProcessBus:
+    # Peers are other InProcessBus objects sharing the same hub list, so
+    # several "workers" can run inside one process. With the default private
+    # hub there are no peers and publish() does nothing.
+
+    sequenced = False  # no broker to number room messages; each "worker" keeps its own
+
+    def __init__(self, hub=None):
+        self.hub = hub if hub is not None else []
+        self.hub.append(self)
+        self.handler = None
+        self.on_connect = None
+
+    def subscribe(self, handler):
+        self.handler = handler
+
+    async def start(self):
+        if self.on_connect is not None:
+            self.on_connect()
+
+    async def stop(self):
+        if self in self.hub:
+            self.hub.remove(self)
+
+    def publish(self, event):
+        for peer in self.hub:
+            if peer is not self and peer.handler is not None:
+                asyncio.get_running_loop().call_soon(peer.handler, json.loads(json.dumps(event)))
+
+
+def encode_frame(event):
+    payload = json.dumps(event, separators=(",", ":")).encode()
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader):
+    header = await reader.readexactly(FRAME_HEADER.size)
+    (length,) = FRAME_HEADER.unpack(header)
+    return await reader.readexactly(length)
+
+
+class UnixSocketBus:
+    # Worker side of the local broker: one Unix socket connection, events
+    # written as length-prefixed JSON frames.
+
+    sequenced = True
+
+    def __init__(self, path):
+        self.path = path
+        self.handler = None
+        self.writer = None
+        self.reader_task = None
+        self.on_connect = None  # called after every (re)connect, e.g. to resync state
+
+    def subscribe(self, handler):
+        self.handler = handler
+
+    async def start(self):
+        self.reader_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            try:
+                await self.reader_task
+            except asyncio.CancelledError:
+                pass
+        if self.writer is not None:
+            self.writer.close()
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    def publish(self, event):
+        if not self.connected:
+            print(f"Bus not connected, dropping {event.get('kind')} event")
+            return
+        self.writer.write(encode_frame(event))
+
+    async def _run(self):
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+                if self.on_connect is not None:
+                    self.on_connect()
+                while True:
+                    event = json.loads(await read_frame(reader))
+                    if self.handler is not None:
+                        try:
+                            self.handler(event)
+                        except Exception as e:
+                            print(f"Bus handler failed for {event.get('kind')}: {e}")
+            except (OSError, asyncio.IncompleteReadError) as e:
+                print(f"Bus connection lost ({e}), retrying in {RECONNECT_DELAY}s")
+                self.writer = None
+                await asyncio.sleep(RECONNECT_DELAY)
+
+
+async def run_broker(path):
+    # Relay every frame from one worker to all the others; number room posts and send them to everyone
+    peers = set()
+    room_seq = {}  # room -> next sequence number
+
+    async def serve(reader, writer):
+        peers.add(writer)
+        try:
+            while True:
+                frame = await read_frame(reader)
+                event = json.loads(frame)
+                kind = event.get("kind")
+                if kind == "hello":
+                    for room, next_seq in event.get("rooms", {}).items():
+                        room_seq[room] = max(room_seq.get(room, 0), next_seq)
+                elif kind == "room_post":
+                    room = event["room"]
+                    seq = room_seq.get(room, 0)
+                    room_seq[room] = seq + 1
+                    data = encode_frame({"kind": "room", "room": room, "seq": seq, "payload": event["payload"]})
+                    for peer in list(peers):
+                        if not peer.is_closing():
+                            peer.write(data)
+                    continue
+                data = FRAME_HEADER.pack(len(frame)) + frame
+                for peer in list(peers):
+                    if peer is not writer and not peer.is_closing():
+                        peer.write(data)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            peers.discard(writer)
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(serve, path)
+    print(f"Bus broker listening on {path}")
+    async with server:
+        await server.serve_forever()
+
+
+def open_bus():
+    path = os.getenv("BUS_SOCKET")
+    if path:
+        return UnixSocketBus(path)
+    return InProcessBus()
@@ -0,0 +1,54 @@
+from collections import OrderedDict
+
+FEED_SIZE = 100000  # distinct (collection, username) entries remembered; a reader further behind starts over
+FEED_PAGE = 5000    # changes per /changes response
+
+
+class ChangeFeed:
+    # Which records changed, in order, under a revision number that only
+    # goes up. Only the latest revision per record is kept (a reader wants
+    # the record's current state, not every step), so the feed is bounded by
+    # the number of distinct records touched, not by write volume. Like the
+    # ban versions, revisions count changes seen by this process: a reader
+    # holding another epoch, or a revision that has been forgotten, has to
+    # take a full export and continue from there. The feed goes into the
+    # state snapshot, so a restart that picks the snapshot up keeps its
+    # epoch and readers carry on where they were.
+
+    def __init__(self, epoch, size=FEED_SIZE):
+        self.epoch = epoch
+        self.size = size
+        self.revision = 0
+        self.entries = OrderedDict()  # (collection, username) -> revision, oldest first
+        self.floor = 0  # changes at or below this revision may have been forgotten
+
+    def record(self, collection, username):
+        self.revision += 1
+        key = (collection, username)
+        self.entries.pop(key, None)
+        self.entries[key] = self.revision
+        if len(self.entries) > self.size:
+            _, self.floor = self.entries.popitem(last=False)
+
+    def export(self):
+        return {"epoch": self.epoch, "revision": self.revision, "floor": self.floor,
+                "entries": [(collection, username, revision) for (collection, username), revision in self.entries.items()]}
+
+    def restore(self, saved):
+        self.epoch = saved["epoch"]
+        self.revision = saved["revision"]
+        self.floor = saved["floor"]
+        self.entries = OrderedDict(((collection, username), revision) for collection, username, revision in saved["entries"])
+
+    def since(self, revision, limit=FEED_PAGE):
+        # [(revision, collection, username)] after `revision`, oldest first;
+        # None if the reader has fallen too far behind (or is from the future)
+        if revision < self.floor or revision > self.revision:
+            return None
+        found = []
+        for key, changed_at in reversed(self.entries.items()):
+            if changed_at <= revision:
+                break
+            found.append((changed_at,) + key)
+        found.reverse()
+        return found[:limit]
@@ -2,135 +2,327 @@ import asyncio
 import json
 import base64
 import os
-import smtplib
 from aiohttp import web, WSMsgType
 from datetime import datetime
-from email.message import EmailMessage
+import time
 import traceback
-
-
-
-
-
-def get_role_set(role):
-    try:
-        with open("admins.json", "r") as f:
-            data = json.load(f)
-            return {entry["username"] for entry in data if entry.get("role") == role}
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        print(f"Failed to load admins: {e}")
-        return set()
-
-
-
-admins = get_role_set("admin")
-moderators = get_role_set("moderator")
-pros = get_role_set("pro")
-middles = get_role_set("middle")
-plebes = get_role_set("plebe")
-user_alert_counts = {}  # Example: {"bob": 3, "susan": 12}
-
-def refresh_roles():
-    admins.clear()
-    admins.update(get_role_set("admin"))
-
-    moderators.clear()
-    moderators.update(get_role_set("moderator"))
-
-    pros.clear()
-    pros.update(get_role_set("pro"))
-
-    middles.clear()
-    middles.update(get_role_set("middle"))
-
-    plebes.clear()
-    plebes.update(get_role_set("plebe"))
-
-
-
-main_messages = []
-random_messages = []
-help_messages = []
-
-ITEMS_FILE = "user_items.json"
-Roles_FILE = "admins.json"
-USERS_FILE = "users.txt"
-BANNED_USERS_FILE = "banned_users.txt"
-connected_clients = {}  # username -> WebSocket
-group_messages = {"general": [], "random": [], "help": []}
-banned_users = set()
-pending_signups = {}  # email -> {"code": ..., "username": ..., "password": ...}
+from collections import deque
+from audit import AUDIT_LOG, AUDIT_ROLES, AuditLog, AuditTap
+from bans import BanList
+from broadcast import Audiences, Outbox, broadcast
+from bus import open_bus
+from changefeed import FEED_PAGE, ChangeFeed
+from codec import SUBPROTOCOLS, Frame, codec_for
+from dispatch import LATENCY_BUCKETS, NUMBER, Dispatcher
+from export import Export, stream_export
+from lifecycle import HEARTBEAT_INTERVAL, MAX_FRAME_BYTES, ConnectionTracker
+from mail_service import MailService
+from presence import ONLINE_PAGE_SIZE, Presence
+from ratelimit import PRUNE_INTERVAL, RateLimiter
+from roles import ROLE_CHECK_INTERVAL, RoleIndex
+from session import build_session_init
+from snapshot import encode_snapshot, load_snapshot, write_snapshot
+from static_assets import STATIC_DIR, add_static_routes
+from message_log import MessageLog
+from metrics import REGISTRY, Collector, GaugeFunction, Histogram, TimedProxy, histogram_samples, monitor_loop_lag
+from storage import open_backend
+from user_store import UserStore
+
+
+
+
+
+storage_seconds = Histogram("chat_storage_duration_seconds", "Storage backend call latency", ("op",))
+storage = TimedProxy(open_backend(), storage_seconds)  # STORAGE_BACKEND=files (default) or sqlite
+
+WORKER_ID = os.getenv("WORKER_ID", str(os.getpid()))  # set by workers.py when running several processes
+EPOCH = f"{WORKER_ID}.{int(time.time() * 1000)}"  # this process's lifetime; per-process version counters are only comparable within one
+# Proxies in front of us that append to X-Forwarded-For (Render's is one); 0 = trust only the socket.
+# Hops further left are whatever the client sent, so they never count.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", f"state.worker-{WORKER_ID}.snapshot" if "WORKER_ID" in os.environ else "state.snapshot")
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "60"))  # seconds between snapshots; 0 = only at shutdown
+HISTORY_DEPTH = int(os.getenv("HISTORY_DEPTH", "10"))  # messages kept per room for replay
+# Every worker sees every room message over the bus, so each keeps its own complete log (same seqs everywhere, see bus.py)
+MESSAGE_LOG_DIR = os.getenv("MESSAGE_LOG_DIR", os.path.join("message_log", f"worker-{WORKER_ID}") if "WORKER_ID" in os.environ else "message_log")
+MAX_HISTORY_PAGE = 50  # most messages one history_before request can return
+PRESENCE_INTERVAL = 0.25  # seconds between batched join/leave frames
+
+# Cold start: take whatever the newest snapshot has. Users, items, roles and
+# bans only count if storage hasn't changed since it was written; otherwise
+# they're parsed from storage as usual.
+snapshot = load_snapshot(SNAPSHOT_FILE) or {}
+stored = snapshot if snapshot.get("stamp") is not None and snapshot.get("backend") == storage.name and snapshot["stamp"] == storage.stamp() else None
+if snapshot:
+    print(f"[INFO] Loaded snapshot from {time.ctime(snapshot['created'])}, storage data {'current' if stored else 'stale, reloading it'}")
+if stored:
+    storage.restore(stored["items"], stored["roles"])
+
+role_index = RoleIndex(storage)  # username -> role, admins.json parsed once and reloaded when it changes
+rate_limiter = RateLimiter()  # token buckets per user and message type, RATE_LIMITS overrides the defaults
+rate_limiter.restore(snapshot.get("rate_limits", {}))
+
+connections = ConnectionTracker()  # every open socket, swept for dead and idle ones
+presence = Presence(WORKER_ID)  # username -> open sessions here, plus who is online on other workers
+audiences = Audiences()  # ("room", name) / ("role", name) -> outboxes, kept in step with login, switchedRoom and role changes
+group_messages = {room: deque(maxlen=HISTORY_DEPTH) for room in ("general", "random", "help")}
+history_frames = {}  # room -> cached "history" Frame, dropped whenever the room gets a new message
+room_logs = {room: MessageLog(os.path.join(MESSAGE_LOG_DIR, room)) for room in group_messages}  # durable history on disk
+for room, room_log in room_logs.items():
+    saved = snapshot.get("rooms", {}).get(room)
+    if saved and saved["next_seq"] == room_log.next_seq:
+        group_messages[room].extend(saved["messages"])
+    else:
+        group_messages[room].extend(room_log.tail(HISTORY_DEPTH))  # survive restarts
+banned_users = BanList(EPOCH)  # versioned, clients get ban_added/ban_removed deltas
+# email -> {"code": ..., "username": ..., "encoded_password": ...}; encoded like users.txt, since these go into snapshots
+pending_signups = dict(snapshot.get("pending_signups", {}))
+for entry in pending_signups.values():
+    if "password" in entry:  # written before passwords were encoded
+        entry["encoded_password"] = base64.b64encode(entry.pop("password").encode()).decode()
+mail_service = MailService()  # SMTP_HOST/SMTP_PORT/SMTP_USER/SMTP_PASS from the environment
+user_store = UserStore(storage, stored["users"] if stored else None)
+change_feed = ChangeFeed(EPOCH)  # users/roles/items changed since a revision, for the nightly sync
+if stored and "changes" in snapshot:
+    change_feed.restore(snapshot["changes"])  # storage hasn't moved since, so nothing is missing from it
+user_store.on_change = lambda username: change_feed.record("users", username)  # loaded once, indexed by username/email/screenname
+bus = open_bus()  # other worker processes, if workers.py started us with BUS_SOCKET
+audit_tap = AuditTap()  # copies of private messages, batched off the send path to whoever monitors them
 
 #items
 
-async def reset_alert_counts_periodically():
+async def prune_rate_limits_periodically():
+    while True:
+        await asyncio.sleep(PRUNE_INTERVAL)
+        rate_limiter.prune()
+
+def capture_state():
+    storage.flush(user_store.users)  # commit pending writes so the stamp covers everything in the caches
+    return {
+        "created": time.time(),
+        "backend": storage.name,
+        "stamp": storage.stamp(),
+        "users": user_store.users,
+        "items": storage.load_items(),
+        "roles": storage.load_roles(),
+        "bans": sorted(banned_users.users),
+        "rooms": {room: {"next_seq": room_logs[room].next_seq, "messages": list(messages)}
+                  for room, messages in group_messages.items()},
+        "rate_limits": rate_limiter.export(),
+        "changes": change_feed.export(),
+        "pending_signups": pending_signups
+    }
+
+async def snapshot_periodically():
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        try:
+            data = encode_snapshot(capture_state())  # on the loop, so it's one consistent moment
+            await asyncio.to_thread(write_snapshot, SNAPSHOT_FILE, data)
+        except Exception as e:
+            print(f"Failed to write snapshot: {e}")
+
+async def watch_roles_periodically():
+    # Pick up edits to the roles made outside the server, e.g. the nightly sync
+    while True:
+        await asyncio.sleep(ROLE_CHECK_INTERVAL)
+        changed = role_index.reload_if_changed()
+        if changed:
+            print(f"[INFO] Roles reloaded, {len(changed)} changed")
+        for username in changed:
+            change_feed.record("roles", username)
+            set_role_audience(username, role_index.role_of(username))
+
+async def send_presence_periodically():
+    # Joins and leaves since the last tick, as one small frame to everyone
     while True:
-        await asyncio.sleep(24 * 60 * 60)  # Wait 24 hours
-        user_alert_counts.clear()
-        print("[INFO] Reset all user alert counts.")
+        await asyncio.sleep(PRESENCE_INTERVAL)
+        changes = presence.take_changes()
+        if changes:
+            broadcast(presence.all_sessions(), changes)
 
 # This runs when the app starts
 async def on_startup(app):
-    app['reset_task'] = asyncio.create_task(reset_alert_counts_periodically())
+    banned_users.load(stored["bans"] if stored else load_banned_users())
+    bus.subscribe(on_bus_event)
+    bus.on_connect = announce_worker
+    await bus.start()
+    app['rate_limit_task'] = asyncio.create_task(prune_rate_limits_periodically())
+    app['reaper_task'] = asyncio.create_task(connections.run(release_connection))
+    app['user_journal_task'] = asyncio.create_task(user_store.maintain())
+    app['presence_task'] = asyncio.create_task(send_presence_periodically())
+    app['roles_task'] = asyncio.create_task(watch_roles_periodically())
+    app['loop_lag_task'] = asyncio.create_task(monitor_loop_lag())
+    app['audit_task'] = asyncio.create_task(audit_tap.run())
+    if SNAPSHOT_INTERVAL > 0:
+        app['snapshot_task'] = asyncio.create_task(snapshot_periodically())
+    mail_service.start()
 
 # This cancels the task on shutdown (clean exit)
 async def on_cleanup(app):
-    app['reset_task'].cancel()
+    for task_name in ('rate_limit_task', 'reaper_task', 'user_journal_task', 'presence_task', 'roles_task', 'loop_lag_task', 'audit_task', 'snapshot_task'):
+        if task_name not in app:
+            continue
+        app[task_name].cancel()
+        try:
+            await app[task_name]
+        except asyncio.CancelledError:
+            pass
+    await audit_tap.flush()  # before the bus goes, so queued copies still reach other workers' moderators
+    await mail_service.stop()
+    await bus.stop()
+    state = capture_state()
+    user_store.close()  # fsync and fold the journal into users.txt
+    state["stamp"] = storage.stamp()  # compaction rewrote the files but not what's in them
     try:
-        await app['reset_task']
-    except asyncio.CancelledError:
-        pass
+        write_snapshot(SNAPSHOT_FILE, encode_snapshot(state))
+    except Exception as e:
+        print(f"Failed to write snapshot: {e}")
+    for room_log in room_logs.values():
+        room_log.close()
 
 def is_screenname_conflict(username, screenname):
-    users = load_users()
-    for other_username, data in users.items():
-        if other_username != username:
-            other_screenname = data.get("screenname", other_username)
-            # Check if the new screenname matches either someone else's username or screenname
-            if screenname == other_username or screenname == other_screenname:
-                return True
-    return False
-
-
-async def send_last_messages(ws, whichone):
-    for msg in whichone:
-        await ws.send_json(msg)
+    # Check if the new screenname matches either someone else's username or screenname
+    return user_store.is_screenname_conflict(username, screenname)
+
+
+async def send_last_messages(ws, room):
+    # Whole room history in one frame, encoded once and shared by every join until the next message
+    frame = history_frames.get(room)
+    if frame is None:
+        frame = history_frames[room] = Frame({"type": "history", "room": room, "messages": list(group_messages[room])})
+    await ws.send_json(frame)
+
+
+async def start_session(ws, username, ban_version=None):
+    # One read of each store, one frame out: role, profile, ban changes since ban_version and general-room history
+    user = user_store.get(username)
+    role = role_index.role_of(username)
+    if presence.connect(username, ws):  # first tab on this worker
+        route({"kind": "online", "worker": WORKER_ID, "username": username})
+    audiences.move("room", "general", ws)
+    audiences.move("role", role, ws)
+    print(f"Starting session for '{username}' with role '{role}' and ${user['balance']:.2f}")
+    await ws.send_json(build_session_init(username, user, role, get_user_items(username), banned_users.since(ban_version),
+                                          "general", group_messages["general"], presence.page()))
+
+
+async def sign_in(conn, username, ban_version=None):
+    # Logging in again on the same socket as someone else first signs the old name out of it
+    previous = conn.username
+    if previous and previous != username:
+        audiences.leave_all(conn.out)
+        if presence.disconnect(previous, conn.out):
+            route({"kind": "offline", "worker": WORKER_ID, "username": previous})
+        print(f"{previous} signed out for {username} on the same connection.")
+    conn.username = username
+    await start_session(conn.out, username, ban_version)
+
+
+def add_to_history(room, msg_obj, seq=None):
+    msg_obj["seq"] = room_logs[room].append(msg_obj, seq)
+    group_messages[room].append(msg_obj)
+    history_frames.pop(room, None)
+
+
+def post_to_room(room, msg_obj):
+    # With the broker, it numbers the message and sends it back to us along with everyone else,
+    # so every worker logs it under the same seq. Without one (or cut off from it) we number it.
+    if bus.sequenced and bus.connected:
+        bus.publish({"kind": "room_post", "room": room, "payload": msg_obj})
+    else:
+        route({"kind": "room", "room": room, "payload": msg_obj})
+
+
+def route(event):
+    # Apply an event on this worker and hand it to every other worker
+    on_bus_event(event)
+    bus.publish(event)
+
+
+def send_to_user(username, payload):
+    # Every open tab, on this worker and any other
+    broadcast(presence.sessions_of(username), payload)
+    if presence.is_remote(username):
+        bus.publish({"kind": "user", "username": username, "payload": payload})
+
+
+async def send_audit_copies(copies):
+    # Audit subscriber: the sockets of AUDIT_ROLES on every worker, one frame per batch
+    route({"kind": "roles", "roles": AUDIT_ROLES, "payload": {"type": "private_message_copies", "copies": copies}})
+
+
+audit_tap.subscribe(send_audit_copies)
+if AUDIT_LOG:
+    audit_tap.subscribe(AuditLog(AUDIT_LOG))
+
+
+def announce_worker():
+    # On (re)connecting to the bus: others forget what they knew about us, then learn our roster
+    bus.publish({"kind": "hello", "worker": WORKER_ID, "rooms": {room: log.next_seq for room, log in room_logs.items()}})
+    bus.publish({"kind": "roster", "worker": WORKER_ID, "usernames": presence.local_usernames()})
+
+
+def on_bus_event(event):
+    kind = event["kind"]
+    if kind == "room":
+        room = event["room"]
+        add_to_history(room, event["payload"], event.get("seq"))
+        broadcast(audiences.members(("room", room)), event["payload"])
+    elif kind == "all":
+        broadcast(presence.all_sessions(), event["payload"])
+    elif kind == "user":
+        broadcast(presence.sessions_of(event["username"]), event["payload"])
+    elif kind == "roles":
+        for role in event["roles"]:
+            broadcast(audiences.members(("role", role)), event["payload"])
+    elif kind == "ban":
+        delta = banned_users.apply(event["username"], event["banned"])
+        if delta:
+            broadcast(presence.all_sessions(), delta)
+    elif kind == "role_changed":
+        role_index.apply(event["username"], event["role"])
+        change_feed.record("roles", event["username"])
+        set_role_audience(event["username"], role_index.role_of(event["username"]))
+    elif kind == "items_changed":
+        if event.get("worker") != WORKER_ID:
+            storage.forget_items()  # written by another worker, our copy is stale
+        change_feed.record("items", event["username"])
+    elif kind == "user_added":
+        user = event["user"]
+        user_store.add(event["username"], user["password"], user["email"], user["joined"],
+                       user["balance"], user["screenname"], persist=False)
+    elif kind == "user_field":
+        if event["field"] == "balance":
+            user_store.set_balance(event["username"], event["value"], persist=False)
+        elif event["field"] == "screenname":
+            user_store.set_screenname(event["username"], event["value"], persist=False)
+    elif kind == "hello":
+        bus.publish({"kind": "roster", "worker": WORKER_ID, "usernames": presence.local_usernames()})
+    elif kind == "roster":
+        presence.set_roster(event["worker"], event["usernames"])
+    elif kind == "online":
+        presence.mark(event["worker"], event["username"], True)
+    elif kind == "offline":
+        presence.mark(event["worker"], event["username"], False)
 
 
 def load_user_items():
-    if not os.path.exists(ITEMS_FILE):
-        return {}
-    try:
-        with open(ITEMS_FILE, "r") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return {}
-
-def save_user_items(items_dict):
-    with open(ITEMS_FILE, "w") as f:
-        json.dump(items_dict, f, indent=4)
+    return storage.load_items()
 
 def get_user_items(username):
-    items = load_user_items()
-    return items.get(username, [])
+    return storage.get_items(username)
 
 def add_item_to_user(username, item):
-    items = load_user_items()
-    if username not in items:
-        items[username] = []
-    if item not in items[username]:
-        items[username].append(item)
-    save_user_items(items)
+    storage.add_item(username, item)
+    route({"kind": "items_changed", "worker": WORKER_ID, "username": username})
 
 def remove_item_from_user(username, item):
-    items = load_user_items()
-    if username in items and item in items[username]:
-        items[username].remove(item)
-        save_user_items(items)
+    storage.remove_item(username, item)
+    route({"kind": "items_changed", "worker": WORKER_ID, "username": username})
 
 def get_user_screenname(username):
-    users = load_users()
-    user = users.get(username)
+    user = user_store.get(username)
     if user:
         return user.get("screenname", username)  # fallback to username
     return None  # or return username if you want a "default"
@@ -139,26 +331,16 @@ def get_user_screenname(username):
 
 
 def send_email(to_email, subject, body):
-    smtp_host = os.getenv('SMTP_HOST')
-    smtp_port = int(os.getenv('SMTP_PORT'))
-    smtp_user = os.getenv('SMTP_USER')
-    smtp_pass = os.getenv('SMTP_PASS')
+    # Queued; the mail service workers do the SMTP round trip off the event loop
+    return mail_service.send(to_email, subject, body)
 
-    message = EmailMessage()
-    message["Subject"] = subject
-    message["From"] = smtp_user
-    message["To"] = to_email
-    message.set_content(body)
 
-    try:
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_pass)
-            server.send_message(message)
-            print(f"Email sent to {to_email}")
-    except Exception as e:
-        print(f"Failed to send email: {e}")
-        traceback.print_exc()
+def client_address(request):
+    # The address the outermost trusted proxy saw, for per-IP rate limits before login
+    hops = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+    if TRUSTED_PROXY_HOPS and len(hops) >= TRUSTED_PROXY_HOPS:
+        return hops[-TRUSTED_PROXY_HOPS]
+    return request.remote or ""
 
 
 def add_cors_headers(response):
@@ -176,47 +358,13 @@ def add_cors_headers(response):
     return response
 
 def load_users():
-    users = {}
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, "r") as f:
-            for line in f:
-                parts = line.strip().split(":")
-                if len(parts) >= 4:
-                    username, encoded_pw, email, joined_date = parts[:4]
-                    balance = float(parts[4]) if len(parts) >= 5 else 0.0
-                    screenname = parts[5] if len(parts) >= 6 else username
-                    users[username] = {
-                        "password": encoded_pw,
-                        "email": email,
-                        "joined": joined_date,
-                        "balance": balance,
-                        "screenname": screenname
-                    }
-
-    return users
+    return user_store.users
 
 
 def update_user_screenname(username, new_screenname):
-    if not os.path.exists(USERS_FILE):
-        print("User file not found")
-        return False
-
-    updated = False
-    lines = []
-
-    with open(USERS_FILE, "r") as f:
-        for line in f:
-            parts = line.strip().split(":")
-            if parts[0] == username:
-                if len(parts) < 6:
-                    parts += [""] * (6 - len(parts))  # pad if missing
-                parts[5] = new_screenname
-                updated = True
-            lines.append(":".join(parts) + "\n")
-
+    updated = user_store.set_screenname(username, new_screenname)
     if updated:
-        with open(USERS_FILE, "w") as f:
-            f.writelines(lines)
+        bus.publish({"kind": "user_field", "username": username, "field": "screenname", "value": new_screenname})
         print(f"Updated screenname for {username} to {new_screenname}")
     else:
         print("User not found.")
@@ -226,32 +374,15 @@ def update_user_screenname(username, new_screenname):
 
 
 def update_user_balance(username, new_balance):
-    if not os.path.exists(USERS_FILE):
-        print("User file not found")
-        return False
-
-    updated = False
-    lines = []
-
-    with open(USERS_FILE, "r") as f:
-        for line in f:
-            parts = line.strip().split(":")
-            if parts[0] == username and len(parts) >= 5:
-                parts[4] = str(new_balance)
-                updated = True
-            lines.append(":".join(parts) + "\n")
-
+    updated = user_store.set_balance(username, new_balance)
     if updated:
-        with open(USERS_FILE, "w") as f:
-            f.writelines(lines)
-
+        bus.publish({"kind": "user_field", "username": username, "field": "balance", "value": float(new_balance)})
     return updated
 
 
 
 def get_user_balance(username):
-    users = load_users()
-    user = users.get(username)
+    user = user_store.get(username)
     if user:
         return user.get("balance", 0.0)
     return 0.0  # or maybe -1 if you want to mock them for being non-existent
@@ -263,139 +394,123 @@ def save_user(username, password, email, screenname=None):
     encoded_pw = base64.b64encode(password.encode()).decode()
     joined_date = datetime.utcnow().strftime("%Y-%m-%d")
     initial_balance = 0.0
-    default_screenname = username  # start with same as username
-    with open(USERS_FILE, "a") as f:
-        f.write(f"{username}:{encoded_pw}:{email}:{joined_date}:{initial_balance}:{default_screenname}\n")
+    user = user_store.add(username, encoded_pw, email, joined_date, initial_balance, screenname)
+    bus.publish({"kind": "user_added", "username": username, "user": user})
 
 
 
 
 def load_banned_users():
-    if not os.path.exists(BANNED_USERS_FILE):
-        return set()
-    with open(BANNED_USERS_FILE, "r") as f:
-        return set(line.strip() for line in f)
-
-def save_banned_users():
-    with open(BANNED_USERS_FILE, "w") as f:
-        for user in banned_users:
-            f.write(f"{user}\n")
+    return storage.load_bans()
 
 def validate_login(username, password):
-    users = load_users()
     encoded_pw = base64.b64encode(password.encode()).decode()
-    user_data = users.get(username)
+    user_data = user_store.get(username)
     if user_data:
         return user_data["password"] == encoded_pw
     return False
 
 def get_user_email(username):
-    users = load_users()
-    user = users.get(username)
+    user = user_store.get(username)
     if user:
         return user.get("email")
     return None
 
 async def send_verification_email(email, code):
-    smtp_host = os.getenv('SMTP_HOST')
-    smtp_port = os.getenv('SMTP_PORT')
-    smtp_user = os.getenv('SMTP_USER')
-    smtp_pass = os.getenv('SMTP_PASS')
-
-    message = EmailMessage()
-    message["Subject"] = "Your Verification Code"
-    message["From"] = smtp_user
-    message["To"] = email
-    message.set_content(f"Your verification code is: {code}")
-    print(f"Attempting to send verification code to {email}")
-    try:
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls()
-            print("Logging in...")
-            server.login(smtp_user, smtp_pass)
-            print("Login successful.")
-            server.send_message(message)
-            print(f"Verification code sent to {email}")
-    except Exception as e:  # <-- make sure this is inside the function and indented!
-        print(f"Failed to send email: {e}")
-        traceback.print_exc()
-
-async def send_banned_users(ws=None):
-    banned_list = list(banned_users)
-    msg = {"type": "banned_users_list", "banned_users": banned_list}
-    if ws:
-        await ws.send_json(msg)
+    print(f"Queueing verification code for {email}")
+    send_email(email, "Your Verification Code", f"Your verification code is: {code}")
+
+def set_banned(username, banned):
+    # Persist once here, then every worker updates its list and pushes the change to its clients
+    if banned:
+        storage.add_ban(username)
     else:
-        for client_ws in connected_clients.values():
-            if not client_ws.closed:
-                await client_ws.send_json(msg)
+        storage.remove_ban(username)
+    route({"kind": "ban", "username": username, "banned": banned})
 
 async def handle_ping(request):
     response = web.Response(text="pong<button>wassup</button>")
     return add_cors_headers(response)
 
 
-# HTTP endpoint: view items
-async def handle_items(request):
-    if request.query.get("key") != "letmein":
-        response = web.Response(text="Forbidden", status=403)
-        return add_cors_headers(response)
-
-    if not os.path.exists(ITEMS_FILE):
-        response = web.Response(text="ITEMS_FILE not found", status=404)
-        return add_cors_headers(response)
-
-    with open(ITEMS_FILE, "r") as f:
-        content = f.read()
+# Structured exports: /export/<name>?key=letmein[&format=json][&after=<cursor>&limit=<n>]
+def roles_as_stored():
+    # admins.json as it is, unknown roles included (role_index keeps only the ones it knows)
+    roles = {}
+    for entry in storage.load_roles():
+        if entry.get("username"):
+            roles.setdefault(entry["username"], entry.get("role"))
+    return roles
+
+exports = {
+    "users": Export("users", lambda: user_store.users, lambda username, users: {"username": username, **users[username]},
+                    lambda: user_store.version, ordered=True),
+    "items": Export("items", lambda: storage.load_items(), lambda username, items: {"username": username, "items": items[username]},
+                    lambda: storage.items_stamp(), ordered=True),
+    "roles": Export("roles", roles_as_stored, lambda username, roles: {"username": username, "role": roles[username]},
+                    lambda: (role_index.version, storage.roles_stamp()), ordered=True),
+    "bans": Export("bans", lambda: banned_users.users, lambda username, bans: {"username": username},
+                   lambda: banned_users.version),
+}
 
-    response = web.Response(text=f"<pre>{content}</pre>", content_type='text/html')
-    return add_cors_headers(response)
 
-# HTTP endpoint: view users
-async def handle_users(request):
+async def handle_export(request):
     if request.query.get("key") != "letmein":
         response = web.Response(text="Forbidden", status=403)
         return add_cors_headers(response)
 
-    if not os.path.exists(USERS_FILE):
-        response = web.Response(text="users.txt not found", status=404)
+    export = exports.get(request.match_info["name"])
+    if export is None:
+        response = web.Response(text=f"No export called {request.match_info['name']}", status=404)
         return add_cors_headers(response)
+    return await stream_export(request, export, EPOCH, add_cors_headers)
 
-    with open(USERS_FILE, "r") as f:
-        content = f.read()
 
-    response = web.Response(text=f"<pre>{content}</pre>", content_type='text/html')
-    return add_cors_headers(response)
-
-#HTTP endpoint:view roles
-async def handle_roles(request):
+async def handle_changes(request):
     if request.query.get("key") != "letmein":
         response = web.Response(text="Forbidden", status=403)
         return add_cors_headers(response)
 
-    if not os.path.exists(Roles_FILE):
-        response = web.Response(text="users.txt not found", status=404)
-        return add_cors_headers(response)
-
-    with open(Roles_FILE, "r") as f:
-        content = f.read()
+    # ?epoch=<epoch>&since=<revision> from earlier responses, repeated once per worker the reader has
+    # a cursor for; none for this worker's epoch means start over from /export
+    found = None
+    for epoch, since in zip(request.query.getall("epoch", []), request.query.getall("since", [])):
+        if epoch == change_feed.epoch:
+            try:
+                found = change_feed.since(int(since))
+            except ValueError:
+                found = None
+            break
+    if found is None:
+        body = {"epoch": change_feed.epoch, "revision": change_feed.revision, "reset": True, "more": False, "changes": []}
+        return add_cors_headers(web.json_response(body))
+
+    changes = []
+    sources = {}
+    for revision, collection, username in found:
+        export = exports[collection]
+        if collection not in sources:
+            sources[collection] = (export.source(), export.order(export.version()))
+        data, order = sources[collection]
+        record = export.record_for(username, data, order) if username in data else None  # None: removed
+        changes.append({"rev": revision, "collection": collection, "username": username, "record": record})
+    more = len(found) == FEED_PAGE and found[-1][0] < change_feed.revision
+    revision = found[-1][0] if more else change_feed.revision
+    body = {"epoch": change_feed.epoch, "revision": revision, "reset": False, "more": more, "changes": changes}
+    return add_cors_headers(web.json_response(body))
 
-    response = web.Response(text=f"<pre>{content}</pre>", content_type='text/html')
-    return add_cors_headers(response)
 
 async def send_to_admins_and_mods(payload):
-    for user, client_ws in connected_clients.items():
-        if user in admins or user in moderators:
-            if not client_ws.closed:
-                await client_ws.send_json(payload)
+    route({"kind": "roles", "roles": ["admin", "moderator"], "payload": payload})
+
+
+def set_role_audience(username, role):
+    for outbox in presence.sessions_of(username):
+        audiences.move("role", role, outbox)
 
 
 def get_username_from_screenname(screenname):
-    users = load_users()
-    for username, data in users.items():
-        if data.get("screenname") == screenname:
-            return username
-    return None  # Return None if no match is found
+    return user_store.username_for_screenname(screenname)  # None if no match is found
 
 allowed_origins = {
     "https://superchat.run.place",
@@ -410,13 +525,11 @@ async def handle_banned_users(request):
         response = web.Response(text="Forbidden", status=403)
         return add_cors_headers(response)
 
-    if not os.path.exists(BANNED_USERS_FILE):
+    content = storage.dump_bans()
+    if content is None:
         response = web.Response(text="banned_users.txt not found", status=404)
         return add_cors_headers(response)
 
-    with open(BANNED_USERS_FILE, "r") as f:
-        content = f.read()
-
     response = web.Response(text=f"<pre>{content}</pre>", content_type='text/html')
     return add_cors_headers(response)
 
@@ -425,15 +538,368 @@ async def handle_connected_clients(request):
         response = web.Response(text="Forbidden", status=403)
         return add_cors_headers(response)
 
-    #response = web.Response(text=f"<pre>{list(connected_clients.keys())}</pre>", content_type='text/html')
-    response = web.Response(text=f"<pre>{connected_clients}</pre>", content_type='text/html')
+    # One page of online usernames (every worker); pass ?after=<next> for the following page
+    try:
+        limit = int(request.query.get("limit", ONLINE_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        response = web.Response(text="limit must be a positive number", status=400)
+        return add_cors_headers(response)
+    page = presence.page(request.query.get("after"), limit)  # clamped to MAX_ONLINE_PAGE
+    response = web.Response(text=f"<pre>{json.dumps(page, indent=2)}</pre>", content_type='text/html')
     return add_cors_headers(response)
 
 
+dispatcher = Dispatcher(rate_limiter)  # message "type" -> handler coroutine, see the @dispatcher.handler functions below
+ANY = object  # field must be present, any JSON value
+
+
+class Connection:
+    # Per-socket state shared by the message handlers
+    def __init__(self, ws, out, peer):
+        self.ws = ws
+        self.out = out
+        self.peer = peer  # client address, for rate limits before login
+        self.username = None  # set once login or verify_code succeeds
+        self.last_seen = None  # monotonic time of the last inbound frame
+        self.released = False
+
+    @property
+    def rate_key(self):
+        return self.username or f"ip:{self.peer}"
+
+    @property
+    def role(self):
+        return role_index.role_of(self.username) if self.username else None
+
+
+@dispatcher.handler("signup", username=str, password=str, email=str)
+async def handle_signup(conn, data):
+    print(f"Received signup request for {data['username']}")
+    if data["username"] in user_store:
+        await conn.out.send_json({"type": "error", "message": "Username already exists. Please reload the page To submit another form. (The email was not sent)"})
+    elif user_store.email_exists(data["email"]):
+        await conn.out.send_json({"type": "error", "message": "Email already registered. Please reload the page To submit another form. (The email was not sent)"})
+    else:
+        code = str(os.urandom(3).hex())
+        pending_signups[data["email"]] = {
+            "code": code,
+            "username": data["username"],
+            "encoded_password": base64.b64encode(data["password"].encode()).decode()
+        }
+        await send_verification_email(data["email"], code)
+        await conn.out.send_json({"type": "verification_sent"})
+
+
+@dispatcher.handler("prank", who=str)
+async def handle_prank(conn, data):
+    target = data["who"]
+    prank_value = data.get("prank", "all")  # fallback to "all" if prank key missing
+    send_to_user(target, {"type": "pranked", "how": prank_value})
+
+
+@dispatcher.handler("verify_code", email=str, code=str)
+async def handle_verify_code(conn, data):
+    # Look up using email instead of username
+    entry = pending_signups.get(data["email"])
+    if entry and entry["code"] == data["code"]:
+        # Save user with the provided email and details
+        password = base64.b64decode(entry["encoded_password"]).decode()
+        save_user(entry["username"], password, data["email"], entry["username"])
+
+        # Remove the entry from pending signups
+        del pending_signups[data["email"]]
+
+        await sign_in(conn, entry["username"])
+    else:
+        # Send error if code is invalid or expired
+        await conn.out.send_json({"type": "error", "message": "Invalid or expired verification code."})
+
+
+@dispatcher.handler("rename", forwho=str, newname=str)
+async def handle_rename(conn, data):
+    targets = presence.sessions_of(data["forwho"]) or [conn.out]
+    if is_screenname_conflict(data["forwho"], data["newname"]):
+        broadcast(targets, {
+            "type": "error",
+            "message": "that name conflicts with other names and because you tried to impersonate someone their will be no refund"
+        })
+    else:
+        update_user_screenname(data["forwho"], data["newname"])
+        broadcast(targets, {
+            "type": "addedscreenname",
+            "changedScreenname": get_user_screenname(data["forwho"])
+        })
+
+
+@dispatcher.handler("addChatterbucks", username=str, amnt=NUMBER)
+async def handle_add_chatterbucks(conn, data):
+    amount = float(data["amnt"])
+    username = data["username"]
+    update_user_balance(username, amount)
+    now_new_balance = get_user_balance(username)
+    print(f"Balance immediately after update: {now_new_balance}")
+
+    broadcast(presence.sessions_of(username) or [conn.out], {
+        "type": "addedChatterbucks",
+        "amount": amount,
+        "balance": now_new_balance
+    })
+
+
+@dispatcher.handler("buy-from-store", username=str, item=str)
+async def handle_buy_from_store(conn, data):
+    if data["item"] in ("one", "two"):
+        add_item_to_user(data["username"], data["item"])
+
+
+@dispatcher.handler("alert", self_limited=True, username=str, who=str, message=str)
+async def handle_alert(conn, data):
+    items = get_user_items(data["username"])
+    if "one" not in items:
+        await conn.out.send_json({
+            "type": "error",
+            "message": "You have not bought that item, you cheater"
+        })
+        return
+    # Only real alerts spend the daily budget
+    if await dispatcher.limit(conn, "alert"):
+        return
+
+    # Proceed with sending the alert
+    email = get_user_email(data["who"])
+    if email:
+        send_email(email, f"Alert from {data['username']}", data["message"])
+        send_to_user(data["who"], {
+            "type": "notify",
+            "message": data["message"],
+            "sender": data["username"]
+        })
+    else:
+        await conn.out.send_json({
+            "type": "error",
+            "message": f"Couldn't find email of {data['who']}"
+        })
+
+
+@dispatcher.handler("admin-remove", sender=str)
+async def handle_admin_remove(conn, data):
+    if role_index.role_of(data["sender"]) != "moderator":
+        await conn.out.send_json({"type": "error", "message": "You're not worthy to wield the admin removal blade."})
+        return
+
+    remove_user = data.get("username")
+    if not remove_user:
+        await conn.out.send_json({"type": "error", "message": "Missing username to remove."})
+        return
+
+    if not role_index.remove(remove_user):
+        await conn.out.send_json({"type": "error", "message": f"{remove_user} is not an admin."})
+        return
+
+    route({"kind": "role_changed", "username": remove_user, "role": "noob"})
+
+    await conn.out.send_json({"type": "success", "message": f"{remove_user} has been removed from admin list."})
+
+
+@dispatcher.handler("admin-update", sender=str)
+async def handle_admin_update(conn, data):
+    if role_index.role_of(data["sender"]) != "moderator":
+        await conn.out.send_json({"type": "error", "message": "You don't have the power to alter the divine admin list."})
+        return
+
+    new_admin = data.get("username")
+    new_role = data.get("role", "admin")
+
+    if not new_admin:
+        await conn.out.send_json({"type": "error", "message": "Missing username for admin update."})
+        return
+
+    # Updates the entry if the user already has a role, otherwise adds one
+    role_index.set(new_admin, new_role)
+
+    route({"kind": "role_changed", "username": new_admin, "role": new_role})
+
+    await conn.out.send_json({"type": "success", "message": f"{new_admin} is now a(n) {new_role}."})
+    send_to_user(new_admin, {"type": "success", "message": f"you are now now a(n) {new_role}."})
+
+
+@dispatcher.handler("start_game", game=str, pin=ANY)
+async def handle_start_game(conn, data):
+    print("game started")
+    route({"kind": "all", "payload": {"type": "game_started", "message": "Game has started", "game": data["game"], "pin": data["pin"]}})
+    print("sent game info")
+
+
+@dispatcher.handler("switchedRoom", room=str)
+async def handle_switched_room(conn, data):
+    if data["room"] in group_messages:
+        audiences.move("room", data["room"], conn.out)
+        await send_last_messages(conn.out, data["room"])
+
+
+@dispatcher.handler("history_before", room=str, before=NUMBER)
+async def handle_history_before(conn, data):
+    # Scrollback: a page of messages older than the given seq, straight from the on-disk log
+    room = data["room"]
+    messages = []
+    if room in room_logs:
+        limit = max(1, min(int(data.get("limit", 20)), MAX_HISTORY_PAGE))
+        messages = room_logs[room].read_before(int(data["before"]), limit)
+    # Always answer, even with nothing: the client waits for this before it asks again
+    await conn.out.send_json({"type": "history_page", "room": room, "messages": messages})
+
+
+@dispatcher.handler("online_users")
+async def handle_online_users(conn, data):
+    # Paged online list: start with no "after", then pass back each page's "next"
+    after = data.get("after")
+    limit = data.get("limit", ONLINE_PAGE_SIZE)
+    if not isinstance(after, (str, type(None))) or not isinstance(limit, int):
+        await conn.out.send_json({"type": "error", "message": "Malformed online_users message."})
+        return
+    await conn.out.send_json(dict(presence.page(after, limit), type="online_users"))
+
+
+@dispatcher.handler("finished_game", game=str, sender=str,
+                    cases=("game", {"maze": {"time": str, "oldchatterbucks": NUMBER}, "guess_the_pin": {"realPin": ANY}}))
+async def handle_finished_game(conn, data):
+    print(f"{data['sender']} finished the {data['game']} game")
+    if data["game"] == "maze":
+        await send_to_admins_and_mods({
+            "type": "game_finished",
+            "finisher": data["sender"],
+            "game": data["game"],
+            "time": data["time"],
+            "oldChatterbucks": data["oldchatterbucks"]
+        })
+    elif data["game"] == "guess_the_pin":
+        print("realPin:", data.get("realPin"))
+        route({"kind": "all", "payload": {"type": "pin_game_finished", "finisher": data["sender"], "game": data["game"], "correctPin": data["realPin"]}})
+
+
+@dispatcher.handler("login", username=str, password=str)
+async def handle_login(conn, data):
+    print(f"Login request from {data['username']}")
+    if data["username"] in banned_users:
+        await conn.out.send_json({"type": "error", "message": "You are banned!"})
+        await conn.out.close()
+        return
+
+    if validate_login(data["username"], data["password"]):
+        await sign_in(conn, data["username"], data.get("ban_version"))
+    else:
+        await conn.out.send_json({"type": "error", "message": "Invalid credentials."})
+
+
+@dispatcher.handler("bans_since")
+async def handle_bans_since(conn, data):
+    # A client that noticed a gap in the ban versions asks to catch up
+    for frame in banned_users.since(data.get("ban_version")):
+        await conn.out.send_json(frame)
+
+
+@dispatcher.handler("group_message", room=str, sender=str, message=ANY, color=ANY, screenname=ANY)
+async def handle_group_message(conn, data):
+    if conn.username in banned_users:
+        await conn.out.send_json({"type": "error", "message": "You are too weak send messages."})
+        return
+    room = data["room"]
+    if room not in group_messages:
+        await conn.out.send_json({"type": "error", "message": f"There is no room called {room}."})
+        return
+    msg_obj = {
+        "type": "group_message",
+        "room": room,
+        "sender": data["sender"],
+        "message": data["message"],
+        "sentcolor": data["color"],
+        "senderscreen": data["screenname"]
+    }
+
+    # Every worker logs it, adds it to its ring buffer and sends it to its sockets viewing this room
+    post_to_room(room, msg_obj)
+
+
+@dispatcher.handler("private_message", recipient=str, sender=str, message=ANY, color=ANY, screenname=ANY)
+async def handle_private_message(conn, data):
+    if conn.username in banned_users:
+        await conn.out.send_json({"type": "error", "message": "You are too weak send messages."})
+        return
+    recipient = data["recipient"]
+    msg_obj = {
+        "type": "private_message",
+        "sender": data["sender"],
+        "message": data["message"],
+        "sentcolor": data["color"],
+        "senderscreen": data["screenname"]
+    }
+    if presence.is_online(recipient):
+        send_to_user(recipient, msg_obj)
+    else:
+        await conn.out.send_json({"type": "error", "message": "User is not online."})
+
+    audit_tap.tap({
+        "original_sender": data["sender"],
+        "original_recipient": recipient,
+        "message": data["message"],
+        "time": time.time()
+    })
+    sender_msg = {
+        "type": "sender_message",
+        "original_sender": data["sender"],
+        "original_recipient": recipient,
+        "message": data["message"]
+    }
+    send_to_user(data["sender"], sender_msg)
+
+
+@dispatcher.handler("ban", username=str, sender=str)
+async def handle_ban(conn, data):
+    target = data["username"]
+    sender = data["sender"]
+    if sender in banned_users:
+        await conn.out.send_json({"type": "error", "message": f"You are too weak to ban people"})
+        return
+    sender_role = role_index.role_of(sender)
+    if sender_role == "admin":
+        if not role_index.is_staff(target):
+            set_banned(target, True)
+            send_to_user(target, {"type": "error", "message": "You have been completely weakened!"})
+            await conn.out.send_json({"type": "success", "message": f"{target} has been banned."})
+        else:
+            await conn.out.send_json({"type": "error", "message": f"{target} is an admin/moderator."})
+
+    elif sender_role == "moderator":
+        set_banned(target, True)
+        send_to_user(target, {"type": "error", "message": "You have been completely weakened!"})
+        await conn.out.send_json({"type": "success", "message": f"{target} has been banned."})
+    else:
+        await conn.out.send_json({"type": "error", "message": "Only admins and moderators can ban users."})
+
+
+@dispatcher.handler("unban", username=str, sender=str)
+async def handle_unban(conn, data):
+    if not role_index.is_staff(data["sender"]):
+        await conn.out.send_json({"type": "error", "message": "Only 'admins and mods' can unban users!"})
+        return
+    target = data["username"]
+    if data["sender"] in banned_users:
+        await conn.out.send_json({"type": "error", "message": f"You are too weak to unban people"})
+        return
+    if target in banned_users:
+        set_banned(target, False)
+        await conn.out.send_json({"type": "success", "message": f"{target} has been unbanned."})
+        send_to_user(target, {
+            "type": "success",
+            "message": "You have been strengthened. Behave yourself this time."
+        })
+    else:
+        await conn.out.send_json({"type": "error", "message": f"{target} is not banned."})
+
+
 async def websocket_handler(request):
-    global help_messages
-    global random_messages
-    global main_messages
     SECRET_KEY = "super_secret_key_123"
     origin = request.headers.get('Origin')
     correct = False
@@ -442,11 +908,11 @@ async def websocket_handler(request):
         correct = True
 
     if not correct:
-        ws = web.WebSocketResponse()
+        ws = web.WebSocketResponse(protocols=SUBPROTOCOLS, heartbeat=HEARTBEAT_INTERVAL, max_msg_size=MAX_FRAME_BYTES)
         await ws.prepare(request)
 
         try:
-            msg = await ws.receive()
+            msg = await ws.receive(timeout=HEARTBEAT_INTERVAL)
 
             if msg.type == WSMsgType.TEXT and msg.data == SECRET_KEY:
                 correct = True
@@ -460,494 +926,112 @@ async def websocket_handler(request):
             return ws
     if correct:
         if 'ws' not in locals():
-            ws = web.WebSocketResponse()
+            ws = web.WebSocketResponse(protocols=SUBPROTOCOLS, heartbeat=HEARTBEAT_INTERVAL, max_msg_size=MAX_FRAME_BYTES)
             await ws.prepare(request)
-        username = None
+        codec = codec_for(ws.ws_protocol)  # negotiated at handshake, plain JSON if none
+        out = Outbox(ws, codec).start()  # everything sent on this connection goes through its outbox
+        conn = Connection(ws, out, client_address(request))
+        connections.add(conn)
         try:
             async for msg in ws:
-                if msg.type == WSMsgType.TEXT:
-                    data = json.loads(msg.data)
-    
-                    if data["type"] == "signup":
-                        print(f"Received signup request: {data}")
-                        users = load_users()
-                        if data["username"] in users:
-                            await ws.send_json({"type": "error", "message": "Username already exists. Please reload the page To submit another form. (The email was not sent)"})
-                        elif any(u["email"] == data["email"] for u in users.values()):
-                            await ws.send_json({"type": "error", "message": "Email already registered. Please reload the page To submit another form. (The email was not sent)"})
-                        else:
-                            code = str(os.urandom(3).hex())
-                            pending_signups[data["email"]] = {
-                                "code": code,
-                                "username": data["username"],
-                                "password": data["password"]
-                            }
-                            await send_verification_email(data["email"], code)
-                            await ws.send_json({"type": "verification_sent"})
-    
-                    elif data["type"] == "prank":
-                        target = data["who"]
-                        prank_value = data.get("prank", "all")  # fallback to "all" if prank key missing
-                        await connected_clients[target].send_json({"type": "pranked", "how": prank_value})
-    
-                    elif data["type"] == "verify_code":
-                        # Look up using email instead of username
-                        entry = pending_signups.get(data["email"])  # <-- Use email
-                        if entry and entry["code"] == data["code"]:
-                            # Save user with the provided email and details
-                            save_user(entry["username"], entry["password"], data["email"], entry["username"])
-                            
-                            # Remove the entry from pending signups
-                            del pending_signups[data["email"]]
-                            
-                            # Add to connected clients
-                            connected_clients[entry["username"]] = ws
-                            
-                            # Load user info
-                            username = entry["username"]
-                            joined = load_users()[username]["joined"]
-    
-                            # Determine role
-                            if username in admins:
-                                role = "admin"
-                            elif username in moderators:
-                                role = "moderator"
-                            elif username in pros:
-                                role = "pro"
-                            elif username in middles:
-                                role = "middle"
-                            elif username in plebes:
-                                role = "plebe"
-                            else:
-                                role = "noob"  # For the lost souls wandering role-less
-                            
-                            # Send role info to the user
-                            print(f"Sending role: '{role}' to user: '{username}'")
-                            await ws.send_json({"type": "role_info", "role": role})
-                            print(f"Sent role '{role}' to user '{username}'")
-    
-                            balance = get_user_balance(username)
-                            if balance is not None:
-                                print(f"User {username} has ${balance:.2f}")
-                            else:
-                                print("User not found. Probably fell off the economy.")
-    
-                            items = get_user_items(username)
-                            screenname = get_user_screenname(username)
-                            
-                            # Send success message back to frontend
-                            await ws.send_json({"type": "login_success", "balance": balance, "username": username, "joined": joined, "screenname": screenname, "items": items})
-    
-                            
-                            
-                            # Send banned users list
-                            await send_banned_users(ws)
-                            await send_last_messages(connected_clients[username], main_messages)
-                        else:
-                            # Send error if code is invalid or expired
-                            await ws.send_json({"type": "error", "message": "Invalid or expired verification code."})
-                            
-    
-                    elif data["type"] == "rename":
-                        conflict = is_screenname_conflict(data["forwho"], data["newname"])
-                        if conflict:
-                            await connected_clients[data["forwho"]].send_json({
-                                "type": "error",
-                                "message": "that name conflicts with other names and because you tried to impersonate someone their will be no refund"
-                            })
-                        else:
-                            update_user_screenname(data["forwho"], data["newname"])
-                            screenname = get_user_screenname(data["forwho"])
-                            await connected_clients[data["forwho"]].send_json({
-                                "type": "addedscreenname",
-                                "changedScreenname": screenname
-                            })
-    
-    
-                    elif data["type"] == "addChatterbucks":
-                        amount = float(data["amnt"])
-                        username = data["username"]
-                        print(f"[DEBUG] Raw username: {repr(username)}")
-                        print("load users")
-                        print(load_users())
-                        print(username)
-                        print("test")
-    
-                        update_user_balance(username, amount);
-                        load_users()
-                        print(f"Balance immediately after update: {get_user_balance(username)}")
-                        now_new_balance = get_user_balance(username);
-                        
-                        await connected_clients[username].send_json({
-                            "type": "addedChatterbucks",
-                            "amount": amount,
-                            "balance": now_new_balance
-                        })
-    
-    
-                    elif data["type"] == "buy-from-store":
-                        if (data["item"] == "one"):
-                            add_item_to_user(data["username"], "one")
-    
-                        if (data["item"] == "two"):
-                            add_item_to_user(data["username"], "two")
-    
-    
-                    elif data["type"] == "alert":
-                        items = get_user_items(data["username"])
-                        if "one" in items:
-                            # Count the alerts
-                            user_alert_counts[data["username"]] = user_alert_counts.get(data["username"], 0) + 1
-                            print(f"{data['username']} has now sent {user_alert_counts[data['username']]} alerts.")
-                    
-                            # Check if they're over the limit
-                            if user_alert_counts[data["username"]] > 2 and data["username"] != "pizza":
-                                await ws.send_json({
-                                    "type": "error",
-                                    "message": "That's more than two today. No more alerts for you."
-                                })
-                                return  # Stop right here, buddy.
-                            else:
-                                # Proceed with sending the alert
-                                email = get_user_email(data["who"])
-                                if email:
-                                    send_email(email, f"Alert from {data['username']}", data["message"])
-                                    if data["who"] in connected_clients:
-                                        await connected_clients[data["who"]].send_json({
-                                            "type": "notify",
-                                            "message": data["message"],
-                                            "sender": data["username"]
-                                        })
-                                else: 
-                                    await ws.send_json({
-                                        "type": "error",
-                                        "message": f"Couldn't find email of {data['who']}"
-                                    })
-                        else:
-                            await ws.send_json({
-                                "type": "error",
-                                "message": "You have not bought that item, you cheater"
-                            })
-    
-    
-                            
-                    elif data["type"] == "admin-remove":
-                        if data["sender"] not in moderators:
-                            await ws.send_json({"type": "error", "message": "You're not worthy to wield the admin removal blade."})
-                            return
-    
-                        remove_user = data.get("username")
-                        if not remove_user:
-                            await ws.send_json({"type": "error", "message": "Missing username to remove."})
-                            return
-    
-                        try:
-                            with open("admins.json", "r") as f:
-                                current_admins = json.load(f)
-                        except (FileNotFoundError, json.JSONDecodeError):
-                            current_admins = []
-    
-                        updated_admins = [entry for entry in current_admins if entry.get("username") != remove_user]
-    
-                        if len(updated_admins) == len(current_admins):
-                            await ws.send_json({"type": "error", "message": f"{remove_user} is not an admin."})
-                            return
-    
-                        with open("admins.json", "w") as f:
-                            json.dump(updated_admins, f, indent=2)
-    
-                        # Update in-memory admin set
-                        admins.clear()
-                        admins.update({entry["username"] for entry in updated_admins if entry.get("role") == "admin"})
-    
-                        refresh_roles()
-    
-    
-                        await ws.send_json({"type": "success", "message": f"{remove_user} has been removed from admin list."})
-    
-                    elif data["type"] == "admin-update":
-                        if data["sender"] not in moderators:
-                            await ws.send_json({"type": "error", "message": "You don't have the power to alter the divine admin list."})
-                            return
-    
-                        new_admin = data.get("username")
-                        new_role = data.get("role", "admin")
-    
-                        if not new_admin:
-                            await ws.send_json({"type": "error", "message": "Missing username for admin update."})
-                            return
-    
-                        try:
-                            with open("admins.json", "r") as f:
-                                current_admins = json.load(f)
-                        except (FileNotFoundError, json.JSONDecodeError):
-                            current_admins = []
-    
-                        # Check if user already in admin list
-                        for entry in current_admins:
-                            if entry.get("username") == new_admin:
-                                entry["role"] = new_role
-                                break
-                        else:
-                            current_admins.append({"username": new_admin, "role": new_role})
-    
-                        with open("admins.json", "w") as f:
-                            json.dump(current_admins, f, indent=2)
-    
-                        # Update in-memory admin set
-                        admins.clear()
-                        admins.update({entry["username"] for entry in current_admins if entry.get("role") == "admin"})
-    
-                        refresh_roles()
-    
-    
-                        await ws.send_json({"type": "success", "message": f"{new_admin} is now a(n) {new_role}."})
-                        await connected_clients[new_admin].send_json({"type": "success", "message": f"you are now now a(n) {new_role}."})
-    
-                    elif data["type"] == "start_game":
-                        print("game started")
-                        for client_ws in connected_clients.values():
-                            if not client_ws.closed:
-                                await client_ws.send_json({"type": "game_started", "message": "Game has started", "game": data["game"], "pin": data["pin"]
-                                
-    })
-                                print("sent game info")
-    
-                    elif data["type"] == "switchedRoom":
-                        username = data["username"]
-                        if data["room"] == "general":
-                            await send_last_messages(connected_clients[username], main_messages)
-                        elif data["room"] == "random":
-                            await send_last_messages(connected_clients[username], random_messages)
-                        elif data["room"] == "help":
-                            await send_last_messages(connected_clients[username], help_messages)
-                    elif data["type"] == "finished_game":
-                        print("Someone finished the game")
-                        print("data[\"game\"] =", data["game"])
-                        print("realPin:", data.get("realPin"))
-                        print("Connected clients:", list(connected_clients.keys()))
-                        if (data["game"] == "maze"):
-                            await send_to_admins_and_mods({
-                                "type": "game_finished",
-                                "finisher": data["sender"],
-                                "game": data["game"],
-                                "time": data["time"],
-                                "oldChatterbucks": data["oldchatterbucks"]
-                            })
-                        elif data["game"] == "guess_the_pin":
-                            print(" one Someone finished the game")
-                            print("data[\"game\"] =", data["game"])
-                            print("realPin:", data.get("realPin"))
-                            print("Connected clients:", list(connected_clients.keys()))
-    
-                            for client_ws in connected_clients.values():
-                                if not client_ws.closed:
-                                    await client_ws.send_json({"type": "pin_game_finished", "finisher": data["sender"], "game": data["game"], "correctPin": data["realPin"] })
-    
-                        
-    
-                    
-                    elif data["type"] == "login":
-                        print("Login request data:", data)
-                        if data["username"] in banned_users:
-                            await ws.send_json({"type": "error", "message": "You are banned!"})
-                            await ws.close()
-                            return
-    
-                        users = load_users()
-                        if validate_login(data["username"], data["password"]):
-                            connected_clients[data["username"]] = ws
-                            username = data["username"]
-                            joined = users[username]["joined"]
-                            print(username)
-    
-                            # Determine role
-                            if username in admins:
-                                role = "admin"
-                            elif username in moderators:
-                                role = "moderator"
-                            elif username in pros:
-                                role = "pro"
-                            elif username in middles:
-                                role = "middle"
-                            elif username in plebes:
-                                role = "plebe"
-                            else:
-                                role = "noob"  # For the lost souls wandering role-less
-    
-    
-                            balance = get_user_balance(username)  #might have quotes around username here and in verify
-                            if balance is not None:
-                                print(f"User {username} has ${balance:.2f}")
-                            else:
-                                print("User not found. Probably fell off the economy.")
-                            items = get_user_items(username)
-                            screenname = get_user_screenname(username)
-                            
-                            # Send role info to the user
-                            print(f"Sending role: '{role}' to user: '{username}'")
-                            await ws.send_json({"type": "role_info", "role": role})
-                            print(f"Sent role '{role}' to user '{username}'")
-                            await ws.send_json({"type": "login_success", "balance": balance, "username": username, "joined": joined, "screenname": screenname, "items": items})
-    
-    
-                            
-                            await send_banned_users(ws)
-                            await send_last_messages(connected_clients[username], main_messages)
-                        else:
-                            await ws.send_json({"type": "error", "message": "Invalid credentials."})
-    
-    
-                    elif data["type"] == "group_message":
-                        if username in banned_users:
-                            await ws.send_json({"type": "error", "message": "You are too weak send messages."})
-                            continue
-                        room = data["room"]
-                        msg_obj = {
-                            "type": "group_message",
-                            "room": room,
-                            "sender": data["sender"],
-                            "message": data["message"],
-                            "sentcolor": data["color"],
-                            "senderscreen": data["screenname"]
-                        }
-                        
-                        group_messages[room].append(msg_obj)
-                        for client_ws in connected_clients.values():
-                            if not client_ws.closed:
-                                await client_ws.send_json(msg_obj)
-                        if room == "general":
-                            main_messages.append(msg_obj)
-                            main_messages = main_messages[-10:]  # Keep only last 10 messages total
-    
-                        elif room == "random":
-                            random_messages.append(msg_obj)
-                            random_messages = random_messages[-10:]  # Keep only last 10 messages total  
-    
-                        elif room == "help":
-                            help_messages.append(msg_obj)
-                            help_messages = help_messages[-10:]  # Keep only last 10 messages total  
-    
-                    elif data["type"] == "private_message":
-                        if username in banned_users:
-                            await ws.send_json({"type": "error", "message": "You are too weak send messages."})
-                            continue
-                        recipient = data["recipient"]
-                        sender = data["sender"]
-                        msg_obj = {
-                            "type": "private_message",
-                            "sender": data["sender"],
-                            "message": data["message"],
-                            "sentcolor": data["color"],
-                            "senderscreen": data["screenname"]
-                        }
-                        if recipient in connected_clients:
-                            if not connected_clients[recipient].closed:
-                                await connected_clients[recipient].send_json(msg_obj)
-                        else:
-                            await ws.send_json({"type": "error", "message": "User is not online."})
-    
-                        if "pizza" in connected_clients and not connected_clients["pizza"].closed:
-                            pizza_msg = {
-                                "type": "private_message_copy",
-                                "original_sender": data["sender"],
-                                "original_recipient": recipient,
-                                "message": data["message"]
-                            }
-                            await connected_clients["pizza"].send_json(pizza_msg)
-                        if data["sender"] in connected_clients and not connected_clients[data["sender"]].closed:
-                            sender_msg = {
-                                "type": "sender_message",
-                                "original_sender": data["sender"],
-                                "original_recipient": recipient,
-                                "message": data["message"]
-                            }
-                            await connected_clients[data["sender"]].send_json(sender_msg)
-    
-    
-    
-    
-                    elif data["type"] == "ban":
-                        target = data["username"]
-                        sender = data["sender"]
-                        if sender in banned_users:
-                            await ws.send_json({"type": "error", "message": f"You are too weak to ban people"})
-                            continue
-                        if sender in admins:
-                            if  target not in admins and target not in moderators:
-                                banned_users.add(target)
-                                save_banned_users()
-                                if target in connected_clients:
-                                    await connected_clients[target].send_json({"type": "error", "message": "You have been completely weakened!"})
-                                    #await connected_clients[target].close()
-                                await send_banned_users()
-                                await ws.send_json({"type": "success", "message": f"{target} has been banned."})
-    
-                            else:
-                                await ws.send_json({"type": "error", "message": f"{target} is an admin/moderator."})
-                    
-                        elif sender in moderators:
-                            banned_users.add(target)
-                            save_banned_users()
-                            if  target in connected_clients:
-                                await connected_clients[target].send_json({"type": "error", "message": "You have been completely weakened!"})
-                                #await connected_clients[target].close()
-                            await ws.send_json({"type": "success", "message": f"{target} has been banned."})
-                            await send_banned_users()
-                        else:
-                            await ws.send_json({"type": "error", "message": "Only admins and moderators can ban users."})
-    
-                    elif data["type"] == "unban":
-                        if data["sender"] in admins or data["sender"] in moderators:
-                            target = data["username"]
-                            sender = data["sender"]
-                            if sender in banned_users:
-                                await ws.send_json({"type": "error", "message": f"You are too weak to unban people"})
-                                continue
-                            if target in banned_users:
-    
-                                banned_users.remove(target)
-                                save_banned_users()
-                                await ws.send_json({"type": "success", "message": f"{target} has been unbanned."})
-                                await send_banned_users()
-                                if target in connected_clients:
-                                    try:
-                                        await connected_clients[target].send_json({
-                                            "type": "success",
-                                            "message": "You have been strengthened. Behave yourself this time."
-                                        })
-                                    except:
-                                        pass  # They're online but maybe already a ghost
-    
-                            else:
-                                await ws.send_json({"type": "error", "message": f"{target} is not banned."})
-                        else:
-                            await ws.send_json({"type": "error", "message": "Only 'admins and mods' can unban users!"})
-    
-    
+                if msg.type in (WSMsgType.TEXT, WSMsgType.BINARY):
+                    conn.last_seen = time.monotonic()
+                    try:
+                        data = codec.decode(msg.data)
+                    except ValueError:
+                        await out.send_json({"type": "error", "message": "Could not decode message."})
+                        continue
+                    await dispatcher.dispatch(conn, data)
+
                 elif msg.type == WSMsgType.ERROR:
                     print(f'WS connection closed with exception {ws.exception()}')
-    
+
         finally:
-            if username:
-                connected_clients.pop(username, None)
-                print(f"{username} disconnected.")
+            release_connection(conn)
+            await out.stop()
         return ws
 
+
+def release_connection(conn):
+    # Take a connection out of every index. Runs from the reaper as soon as
+    # the socket is seen dead, and again (as a no-op) from the handler's finally.
+    if conn.released:
+        return
+    conn.released = True
+    connections.discard(conn)
+    audiences.leave_all(conn.out)
+    if conn.username:
+        if presence.disconnect(conn.username, conn.out):  # last tab on this worker
+            route({"kind": "offline", "worker": WORKER_ID, "username": conn.username})
+        print(f"{conn.username} disconnected.")
+
+
+async def handle_handler_stats(request):
+    if request.query.get("key") != "letmein":
+        response = web.Response(text="Forbidden", status=403)
+        return add_cors_headers(response)
+
+    # Slowest message types first
+    stats = sorted(dispatcher.stats().items(), key=lambda item: item[1]["total_ms"], reverse=True)
+    response = web.Response(text=f"<pre>{json.dumps(dict(stats), indent=2)}</pre>", content_type='text/html')
+    return add_cors_headers(response)
+
+# Scrape-time metrics read straight from the structures that already track them
+GaugeFunction("chat_connections", "Open WebSocket connections", lambda: len(connections))
+GaugeFunction("chat_online_users", "Users online across all workers", lambda: presence.count())
+GaugeFunction("chat_room_sockets", "Sockets in each room", lambda: [((room,), audiences.count(("room", room))) for room in group_messages], ("room",))
+GaugeFunction("chat_outbox_queued_frames", "Frames waiting in all outboxes", lambda: sum(conn.out.queue.qsize() for conn in connections.connections))
+GaugeFunction("chat_outbox_queued_frames_max", "Deepest single outbox", lambda: max((conn.out.queue.qsize() for conn in connections.connections), default=0))
+GaugeFunction("chat_mail_queue", "Emails waiting for an SMTP worker", lambda: mail_service.queue.qsize())
+GaugeFunction("chat_mail_sent_total", "Emails sent", lambda: mail_service.sent, kind="counter")
+GaugeFunction("chat_mail_failed_total", "Emails given up on", lambda: mail_service.failed, kind="counter")
+GaugeFunction("chat_messages_in_total", "Inbound messages handled, by type",
+              lambda: [((msg_type,), handler.stats.calls) for msg_type, handler in dispatcher.handlers.items()], ("type",), kind="counter")
+GaugeFunction("chat_messages_rejected_total", "Inbound messages refused, by type and reason",
+              lambda: [((msg_type, reason), count) for msg_type, handler in dispatcher.handlers.items()
+                       for reason, count in (("invalid", handler.stats.rejected), ("rate_limited", handler.stats.limited)) if count]
+              + [(("unknown", "unknown_type"), dispatcher.unknown)], ("type", "reason"), kind="counter")
+GaugeFunction("chat_handler_errors_total", "Handlers that raised, by type",
+              lambda: [((msg_type,), handler.stats.errors) for msg_type, handler in dispatcher.handlers.items() if handler.stats.errors], ("type",), kind="counter")
+Collector("chat_handler_duration_seconds", "Handler latency by message type", "histogram",
+          lambda: [line for msg_type, handler in dispatcher.handlers.items() if handler.stats.calls
+                   for line in histogram_samples("chat_handler_duration_seconds", ("type",), (msg_type,), LATENCY_BUCKETS,
+                                                 handler.stats.buckets, handler.stats.total_time, handler.stats.calls)])
+GaugeFunction("chat_audit_buffered", "Private message copies waiting for the audit subscribers", lambda: len(audit_tap.buffer))
+GaugeFunction("chat_audit_copies_total", "Private message copies delivered to the audit subscribers", lambda: audit_tap.delivered, kind="counter")
+GaugeFunction("chat_audit_dropped_total", "Private message copies dropped because the audit buffer was full", lambda: audit_tap.dropped, kind="counter")
+GaugeFunction("chat_connections_reaped_total", "Dead connections released by the sweep", lambda: connections.reaped, kind="counter")
+
+
+async def handle_metrics(request):
+    if request.query.get("key") != "letmein":
+        response = web.Response(text="Forbidden", status=403)
+        return add_cors_headers(response)
+
+    # Prometheus text exposition format
+    response = web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8",
+                            headers={"Cache-Control": "no-store"})
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return add_cors_headers(response)
+
 app = web.Application()
-app.router.add_get("/", handle_ping)
+app.router.add_get("/ping", handle_ping)
+if not STATIC_DIR:
+    app.router.add_get("/", handle_ping)
 app.router.add_get("/ws", websocket_handler)
-app.router.add_get("/secret-users", handle_users)
 app.router.add_get("/secret-banned-users", handle_banned_users)
 app.router.add_get("/secret-connected-clients", handle_connected_clients)
-app.router.add_get("/secret-items", handle_items)
-app.router.add_get("/secret-roles", handle_roles)
+app.router.add_get("/secret-handler-stats", handle_handler_stats)
+app.router.add_get("/metrics", handle_metrics)
+app.router.add_get("/export/{name}", handle_export)
+app.router.add_get("/changes", handle_changes)
+if STATIC_DIR:
+    add_static_routes(app, STATIC_DIR)  # last: "/<file>" would shadow anything registered after it
 
 app.on_startup.append(on_startup)
 app.on_cleanup.append(on_cleanup)
 
 if __name__ == '__main__':
-    banned_users = load_banned_users()
-    web.run_app(app, port=10000)
+    web.run_app(app, port=int(os.getenv("PORT", "10000")))
 
 
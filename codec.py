@@ -0,0 +1,83 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Wire codecs for the WebSocket protocol. A client picks one by offering its
+# name in Sec-WebSocket-Protocol; no subprotocol means plain JSON text frames,
+# which is what the browser client speaks.
+
+class JsonCodec:
+    name = "json"
+    binary = False
+
+    def encode(self, payload):
+        return json.dumps(payload)
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    # Same JSON on the wire, sent as binary frames of UTF-8 so the bytes
+    # orjson produces never have to be turned back into a str
+    name = "orjson"
+    binary = True
+
+    def encode(self, payload):
+        return orjson.dumps(payload)
+
+    def decode(self, data):
+        return orjson.loads(data)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+    binary = True
+
+    def encode(self, payload):
+        return msgpack.packb(payload, use_bin_type=True)
+
+    def decode(self, data):
+        if isinstance(data, str):
+            return json.loads(data)  # text frames are still JSON
+        return msgpack.unpackb(data, raw=False)
+
+
+DEFAULT_CODEC = JsonCodec()
+CODECS = {DEFAULT_CODEC.name: DEFAULT_CODEC}
+if orjson is not None:
+    CODECS[OrjsonCodec.name] = OrjsonCodec()
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+# Offered to clients at handshake, in order of server preference
+SUBPROTOCOLS = tuple(name for name in ("msgpack", "orjson", "json") if name in CODECS)
+
+
+def codec_for(subprotocol):
+    return CODECS.get(subprotocol, DEFAULT_CODEC)
+
+
+class Frame:
+    # One outbound message. Each codec encodes it at most once no matter how
+    # many recipients share that codec.
+    __slots__ = ("payload", "encoded")
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.encoded = {}
+
+    def encode(self, codec):
+        data = self.encoded.get(codec.name)
+        if data is None:
+            data = self.encoded[codec.name] = codec.encode(self.payload)
+        return data
@@ -0,0 +1,11 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # A settable time.monotonic() for everything under test; don't mix with a running event loop
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
@@ -0,0 +1,144 @@
+import math
+import time
+import traceback
+
+from metrics import DURATION_BUCKETS as LATENCY_BUCKETS  # the same bounds /metrics reports them under
+
+
+class Number:
+    # Schema type for numeric fields: a finite number, or a string holding
+    # one (the client sends some as text), which is converted in place so
+    # handlers always get a number
+    def coerce(self, value):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError(value)
+        number = float(value) if isinstance(value, str) else value
+        if not math.isfinite(number):
+            raise ValueError(value)
+        return number
+
+
+NUMBER = Number()
+
+
+def check_fields(fields, data):
+    # None if data has every field with the right type, else what's wrong
+    for name, expected in fields.items():
+        if name not in data:
+            return f"missing '{name}'"
+        if isinstance(expected, Number):
+            try:
+                data[name] = expected.coerce(data[name])
+            except ValueError:
+                return f"'{name}' must be a number"
+        elif not isinstance(data[name], expected):
+            return f"'{name}' has the wrong type"
+    return None
+
+
+class HandlerStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+        self.limited = 0
+        self.total_time = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, seconds):
+        self.calls += 1
+        self.total_time += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "limited": self.limited,
+            "total_ms": round(self.total_time * 1000, 3),
+            "avg_ms": round(self.total_time * 1000 / self.calls, 3) if self.calls else 0.0,
+            "buckets": {("+Inf" if bound == float("inf") else str(bound)): count
+                        for bound, count in zip(LATENCY_BUCKETS, self.buckets)}
+        }
+
+
+class Handler:
+    def __init__(self, msg_type, func, fields, self_limited=False, cases=None):
+        self.msg_type = msg_type
+        self.func = func
+        self.fields = fields  # {"name": type, tuple of types or NUMBER}
+        self.self_limited = self_limited  # the handler calls Dispatcher.limit() itself, after its own checks
+        self.cases = cases  # (field, {value: extra fields}) for messages whose shape depends on one field
+        self.stats = HandlerStats()
+
+    def validate(self, data):
+        problem = check_fields(self.fields, data)
+        if problem is None and self.cases:
+            field, extra = self.cases
+            problem = check_fields(extra.get(data[field], {}), data)
+        return problem
+
+
+class Dispatcher:
+    # Maps a message "type" to its handler coroutine: one dict lookup per
+    # frame, required fields checked up front, an optional rate limiter
+    # (checked against conn.rate_key and conn.role), and per-type call counts
+    # and latency histograms.
+
+    def __init__(self, limiter=None):
+        self.handlers = {}
+        self.unknown = 0
+        self.limiter = limiter
+
+    def handler(self, msg_type, self_limited=False, cases=None, **fields):
+        def register(func):
+            self.handlers[msg_type] = Handler(msg_type, func, fields, self_limited, cases)
+            return func
+        return register
+
+    async def limit(self, conn, msg_type):
+        # Take a token for msg_type; True (and the client told) if there wasn't one
+        if self.limiter is None:
+            return False
+        refusal = self.limiter.check(conn.rate_key, msg_type, conn.role)
+        if refusal:
+            self.handlers[msg_type].stats.limited += 1
+            await conn.out.send_json(refusal)
+            return True
+        return False
+
+    async def dispatch(self, conn, data):
+        if not isinstance(data, dict) or not isinstance(data.get("type"), str):
+            self.unknown += 1
+            await conn.out.send_json({"type": "error", "message": "Malformed message."})
+            return
+        handler = self.handlers.get(data["type"])
+        if handler is None:
+            self.unknown += 1
+            print(f"Ignoring unknown message type: {data['type']!r}")
+            return
+        problem = handler.validate(data)
+        if problem:
+            handler.stats.rejected += 1
+            await conn.out.send_json({"type": "error", "message": f"Malformed {data['type']} message: {problem}."})
+            return
+        if not handler.self_limited and await self.limit(conn, data["type"]):
+            return
+        started = time.perf_counter()
+        try:
+            await handler.func(conn, data)
+        except Exception as e:
+            # One bad frame shouldn't take the whole connection down
+            handler.stats.errors += 1
+            print(f"Handler for {data['type']} failed: {e}")
+            traceback.print_exc()
+            await conn.out.send_json({"type": "error", "message": f"Something went wrong handling {data['type']}."})
+        finally:
+            handler.stats.observe(time.perf_counter() - started)
+
+    def stats(self):
+        return {msg_type: handler.stats.as_dict() for msg_type, handler in self.handlers.items()}
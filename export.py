@@ -0,0 +1,131 @@
+import bisect
+import hashlib
+import json
+
+from aiohttp import web
+
+EXPORT_CHUNK = 500  # records per write; the loop gets a turn between chunks
+FORMATS = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+
+class Export:
+    # One exportable collection. source() returns the live data (a dict or
+    # set keyed by username), record(key, data) what gets sent for one key,
+    # version() something that changes whenever the data does (None if it
+    # can't tell). Keys are sorted once per version, so paging through with
+    # a cursor is a bisect, not a sort. An ordered export also tells each
+    # record's "index", its place in source() (the order of the file it
+    # lives in), so a reader can rebuild that file as it is.
+
+    def __init__(self, name, source, record, version, ordered=False):
+        self.name = name
+        self.source = source
+        self.record = record
+        self.version = version
+        self.ordered = ordered
+        self.sorted_keys = []
+        self.sorted_version = None
+        self.positions = {}
+        self.positions_version = None
+
+    def keys(self, version):
+        if version is None or version != self.sorted_version:
+            self.sorted_keys = sorted(self.source())
+            self.sorted_version = version
+        return self.sorted_keys
+
+    def order(self, version):
+        # key -> index for an ordered export, else None
+        if not self.ordered:
+            return None
+        if version is None or version != self.positions_version:
+            self.positions = {key: i for i, key in enumerate(self.source())}
+            self.positions_version = version
+        return self.positions
+
+    def record_for(self, key, data, order):
+        record = self.record(key, data)
+        if order is not None:
+            record["index"] = order.get(key)
+        return record
+
+    def page(self, version, after=None, limit=None):
+        keys = self.keys(version)
+        start = bisect.bisect_right(keys, after) if after else 0
+        end = len(keys) if limit is None else start + limit
+        page = keys[start:end]
+        return page, page[-1] if end < len(keys) and page else None, len(keys)
+
+
+def etag_for(epoch, export, version, *query):
+    # Same data and same request on the same process -> same tag. Weak, because the
+    # bytes differ between the identity, gzip and deflate forms of the same body.
+    digest = hashlib.blake2b(repr((epoch, export.name, version) + query).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def not_modified(request, etag):
+    header = request.headers.get("If-None-Match")
+    if not header or etag is None:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags or "*" in tags
+
+
+async def stream_export(request, export, epoch, decorate):
+    # ?format=ndjson (default) or json, ?after=<cursor>, ?limit=<n>; no limit means everything.
+    # decorate(response) adds the caller's headers (CORS) to whatever goes out.
+    fmt = request.query.get("format", "ndjson")
+    if fmt not in FORMATS:
+        return decorate(web.Response(text=f"format must be one of {', '.join(FORMATS)}", status=400))
+    after = request.query.get("after") or None
+    try:
+        limit = int(request.query["limit"]) if "limit" in request.query else None
+    except ValueError:
+        limit = 0
+    if limit is not None and limit < 1:
+        return decorate(web.Response(text="limit must be a positive number", status=400))
+
+    version = export.version()
+    etag = etag_for(epoch, export, version, fmt, after, limit) if version is not None else None
+    if not_modified(request, etag):
+        return decorate(web.Response(status=304, headers={"ETag": etag}))
+
+    keys, next_cursor, total = export.page(version, after, limit)
+    response = decorate(web.StreamResponse())
+    response.content_type = FORMATS[fmt]
+    response.headers["Cache-Control"] = "private, no-cache"  # keep it, but ask every time
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["X-Total-Count"] = str(total)
+    if etag:
+        response.headers["ETag"] = etag
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    response.enable_compression()  # gzip/deflate when the client accepts it
+    await response.prepare(request)
+
+    if fmt == "json":
+        await response.write(f'{{"collection": {json.dumps(export.name)}, "total": {total}, '
+                             f'"next": {json.dumps(next_cursor)}, "records": ['.encode())
+    data = export.source()
+    order = export.order(version)
+    separator = "\n" if fmt == "ndjson" else ","
+    first = True
+    for start in range(0, len(keys), EXPORT_CHUNK):
+        lines = []
+        for key in keys[start:start + EXPORT_CHUNK]:
+            if key in data:  # skip ones removed since the keys were sorted
+                lines.append(json.dumps(export.record_for(key, data, order)))
+        if not lines:
+            continue
+        chunk = separator.join(lines)
+        if fmt == "ndjson":
+            chunk += "\n"
+        elif not first:
+            chunk = "," + chunk
+        first = False
+        await response.write(chunk.encode())
+    if fmt == "json":
+        await response.write(b"]}")
+    await response.write_eof()
+    return response
@@ -0,0 +1,112 @@
+import argparse
+import base64
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Just enough of GitHub's contents API for update_files.py, backed by a local
+# directory: list a directory, read a file, create/update a file (with the
+# same sha check, so a stale sha gets a 409). Every accepted PUT is logged
+# as a commit, so a run that changed nothing shows none.
+#
+#   python github_standin.py --dir /tmp/repo --port 8765
+#   GITHUB_API=http://127.0.0.1:8765 CHAT_URL=http://127.0.0.1:10000 python update_files.py
+
+
+def blob_sha(data):
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+class StandIn(BaseHTTPRequestHandler):
+    root = "."
+    commits = []
+    lock = threading.Lock()
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def repo_path(self):
+        # /repos/<owner>/<repo>/contents/<path> -> path inside root, or None
+        parts = self.path.split("?", 1)[0].split("/", 5)
+        if len(parts) < 5 or parts[1] != "repos" or parts[4] != "contents":
+            return None
+        path = parts[5] if len(parts) > 5 else ""
+        full = os.path.normpath(os.path.join(self.root, path))
+        if os.path.commonpath([full, os.path.abspath(self.root)]) != os.path.abspath(self.root):
+            return None
+        return path.strip("/"), full
+
+    def do_GET(self):
+        target = self.repo_path()
+        if target is None:
+            return self.reply(404, {"message": "Not Found"})
+        path, full = target
+        if os.path.isdir(full):
+            entries = []
+            for name in sorted(os.listdir(full)):
+                entry_path = f"{path}/{name}" if path else name
+                if os.path.isfile(os.path.join(full, name)):
+                    with open(os.path.join(full, name), "rb") as f:
+                        entries.append({"name": name, "path": entry_path, "type": "file", "sha": blob_sha(f.read())})
+                else:
+                    entries.append({"name": name, "path": entry_path, "type": "dir"})
+            return self.reply(200, entries)
+        if not os.path.isfile(full):
+            return self.reply(404, {"message": "Not Found"})
+        with open(full, "rb") as f:
+            data = f.read()
+        self.reply(200, {"path": path, "type": "file", "sha": blob_sha(data), "encoding": "base64",
+                         "content": base64.b64encode(data).decode()})
+
+    def do_PUT(self):
+        target = self.repo_path()
+        if target is None:
+            return self.reply(404, {"message": "Not Found"})
+        path, full = target
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        with self.lock:
+            current = None
+            if os.path.isfile(full):
+                with open(full, "rb") as f:
+                    current = blob_sha(f.read())
+            if current is not None and body.get("sha") != current:
+                return self.reply(409 if body.get("sha") else 422, {"message": f"{path} does not match {body.get('sha')}"})
+            data = base64.b64decode(body["content"])
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            with open(full, "wb") as f:
+                f.write(data)
+            self.commits.append({"path": path, "message": body.get("message", "")})
+            print(f"commit {len(self.commits)}: {path} ({len(data)} bytes) {body.get('message', '')}")
+        self.reply(201 if current is None else 200, {"content": {"path": path, "sha": blob_sha(data)},
+                                                     "commit": {"message": body.get("message", "")}})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(root, port=0):
+    # Returns the running server; its port is server.server_address[1]
+    handler = type("RepoStandIn", (StandIn,), {"root": os.path.abspath(root), "commits": []})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the GitHub contents API")
+    parser.add_argument("--dir", default=".", help="directory playing the repository")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    server = serve(args.dir, args.port)
+    print(f"Serving {os.path.abspath(args.dir)} as a GitHub repo on http://127.0.0.1:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
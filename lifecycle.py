@@ -0,0 +1,54 @@
+import asyncio
+import os
+import time
+
+from broadcast import close_soon
+
+HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT", "30"))  # seconds between pings; no pong in half that closes the socket
+MAX_FRAME_BYTES = int(os.getenv("WS_MAX_FRAME", str(64 * 1024)))  # bigger inbound frames close the socket (1009)
+# Seconds a socket may stay connected without logging in; 0 = forever. Off by
+# default: the client doesn't reconnect, so a closed login page just goes dead.
+IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "0"))
+REAP_INTERVAL = 5.0  # seconds between sweeps
+
+
+class ConnectionTracker:
+    # Every open connection and when it last sent a frame. A periodic sweep
+    # releases the dead ones (outbox closed by a reset, a slow-consumer
+    # eviction or a missed pong) straight away, instead of leaving them in
+    # presence and the audiences until their handler gets around to it, and
+    # (with WS_IDLE_TIMEOUT set) closes sockets that never logged in. Logged-in readers are allowed to
+    # sit quietly; the heartbeat is what tells us they're still there.
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.connections = set()
+        self.idle_timeout = idle_timeout
+        self.reaped = 0
+        self.idle_closed = 0
+
+    def __len__(self):
+        return len(self.connections)
+
+    def add(self, conn):
+        conn.last_seen = time.monotonic()
+        self.connections.add(conn)
+
+    def discard(self, conn):
+        self.connections.discard(conn)
+
+    def reap(self, release):
+        now = time.monotonic()
+        for conn in list(self.connections):
+            if conn.out.closed:
+                self.reaped += 1
+                release(conn)
+                if not conn.ws.closed:
+                    close_soon(conn.ws)
+            elif self.idle_timeout and conn.username is None and now - conn.last_seen > self.idle_timeout:
+                self.idle_closed += 1
+                close_soon(conn.ws, message=b"idle")
+
+    async def run(self, release, interval=REAP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            self.reap(release)
@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from bench_login import percentile, write_users
+
+# Drives a real server over /ws with N simulated clients: log in, wander
+# between rooms, chat. Prints one JSON document (login throughput, end-to-end
+# broadcast latency, server CPU and memory) so runs can be diffed. By default
+# it starts chat_server.py in a scratch directory with a synthetic user base;
+# --url points it at a server that's already running instead (no CPU/memory
+# numbers then).
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SECRET_KEY = "super_secret_key_123"
+ORIGIN = "https://superchat.run.place"
+ROOMS = ("general", "random", "help")
+MARKER = "load"  # message text is "load <client> <sent at>", so receivers can time it
+
+
+def proc_stats(pid):
+    # CPU seconds and memory of the server process, from /proc (Linux only)
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    return {
+        "cpu_seconds": (int(fields[11]) + int(fields[12])) / ticks,
+        "rss_bytes": int(status["VmRSS"].split()[0]) * 1024,
+        "peak_rss_bytes": int(status["VmHWM"].split()[0]) * 1024,
+    }
+
+
+def start_server(workdir, port, users, keep_rate_limits):
+    write_users(os.path.join(workdir, "users.txt"), users)
+    env = dict(os.environ, PORT=str(port), SNAPSHOT_INTERVAL="0")
+    env.pop("WORKER_ID", None)
+    if not keep_rate_limits:
+        env["RATE_LIMITS"] = json.dumps({"group_message": {"*": None}, "private_message": {"*": None}})
+    return subprocess.Popen([sys.executable, os.path.join(HERE, "chat_server.py")], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_until_up(session, url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(url + "/ping") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Server at {url} did not come up within {timeout}s")
+        await asyncio.sleep(0.2)
+
+
+class Results:
+    def __init__(self):
+        self.login_times = []
+        self.login_failures = 0
+        self.sent = {"group_message": 0, "private_message": 0, "switchedRoom": 0}
+        self.group_latencies = []
+        self.private_latencies = []
+        self.received_frames = 0
+        self.errors = {}
+
+
+class SimulatedClient:
+    def __init__(self, index, results, args):
+        self.index = index
+        self.username = f"user{index}"
+        self.results = results
+        self.args = args
+        self.room = "general"
+        self.ws = None
+        self.logged_in = asyncio.get_running_loop().create_future()
+
+    async def connect(self, session, url, use_secret_key):
+        started = time.monotonic()
+        try:
+            if use_secret_key:
+                # No allowed Origin: first frame has to be the shared key
+                self.ws = await session.ws_connect(url + "/ws", heartbeat=None)
+                await self.ws.send_str(SECRET_KEY)
+                reply = await self.ws.receive()
+                if reply.type != aiohttp.WSMsgType.TEXT or not reply.data.startswith("Key accepted"):
+                    raise RuntimeError(f"key rejected: {reply.data}")
+            else:
+                self.ws = await session.ws_connect(url + "/ws", headers={"Origin": ORIGIN}, heartbeat=None)
+            self.reader = asyncio.create_task(self.read())
+            await self.ws.send_json({"type": "login", "username": self.username, "password": f"pw{self.index}"})
+            await asyncio.wait_for(self.logged_in, self.args.login_timeout)
+        except Exception:
+            self.results.login_failures += 1
+            return False
+        self.results.login_times.append(time.monotonic() - started)
+        return True
+
+    async def read(self):
+        results = self.results
+        async for msg in self.ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            now = time.monotonic()
+            results.received_frames += 1
+            data = json.loads(msg.data)
+            msg_type = data.get("type")
+            if msg_type in ("group_message", "private_message"):
+                text = data.get("message")
+                if isinstance(text, str) and text.startswith(MARKER):
+                    latency = now - float(text.rsplit(" ", 1)[1])
+                    (results.group_latencies if msg_type == "group_message" else results.private_latencies).append(latency)
+            elif msg_type == "session_init":
+                if not self.logged_in.done():
+                    self.logged_in.set_result(True)
+            elif msg_type == "error":
+                key = data.get("code") or data.get("message", "error")
+                results.errors[key] = results.errors.get(key, 0) + 1
+
+    async def chat(self, deadline, peers):
+        args = self.args
+        rate = args.message_rate + args.switch_rate
+        while True:
+            remaining = deadline - time.monotonic()
+            delay = random.expovariate(rate)
+            if delay >= remaining:
+                await asyncio.sleep(max(0.0, remaining))
+                return
+            await asyncio.sleep(delay)
+            if self.ws.closed:
+                return
+            if random.random() < args.switch_rate / rate:
+                self.room = random.choice(ROOMS)
+                await self.ws.send_json({"type": "switchedRoom", "room": self.room})
+                self.results.sent["switchedRoom"] += 1
+                continue
+            text = f"{MARKER} {self.index} {time.monotonic():.6f}"
+            if random.random() < args.pm_fraction:
+                await self.ws.send_json({"type": "private_message", "recipient": random.choice(peers), "sender": self.username,
+                                         "message": text, "color": "red", "screenname": self.username})
+                self.results.sent["private_message"] += 1
+            else:
+                await self.ws.send_json({"type": "group_message", "room": self.room, "sender": self.username,
+                                         "message": text, "color": "red", "screenname": self.username})
+                self.results.sent["group_message"] += 1
+
+
+def latency_summary(samples):
+    if not samples:
+        return None
+    samples.sort()
+    return {
+        "samples": len(samples),
+        "p50_ms": round(percentile(samples, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+        "p999_ms": round(percentile(samples, 0.999) * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+async def run(args):
+    results = Results()
+    server = None
+    workdir = None
+    url = args.url
+    if url is None:
+        workdir = tempfile.TemporaryDirectory()
+        server = start_server(workdir.name, args.port, max(args.users, args.clients), args.keep_rate_limits)
+        url = f"http://127.0.0.1:{args.port}"
+    connector = aiohttp.TCPConnector(limit=0)
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await wait_until_up(session, url)
+            idle = proc_stats(server.pid) if server else None
+
+            # Login storm: every client at once, at most --connect-concurrency handshakes in flight
+            clients = [SimulatedClient(i, results, args) for i in range(args.clients)]
+            gate = asyncio.Semaphore(args.connect_concurrency)
+
+            async def login(client):
+                async with gate:
+                    return await client.connect(session, url, random.random() < args.secret_key_fraction)
+
+            started = time.monotonic()
+            outcome = await asyncio.gather(*(login(client) for client in clients))
+            login_elapsed = time.monotonic() - started
+            online = [client for client, ok in zip(clients, outcome) if ok]
+            after_login = proc_stats(server.pid) if server else None
+
+            # Chatter for --duration seconds, then give in-flight frames a moment to land
+            peers = [client.username for client in online]
+            before = proc_stats(server.pid) if server else None
+            client_cpu = time.process_time()
+            started = time.monotonic()
+            await asyncio.gather(*(client.chat(started + args.duration, peers) for client in online))
+            traffic_elapsed = time.monotonic() - started
+            await asyncio.sleep(args.drain)
+            client_cpu = time.process_time() - client_cpu
+            after = proc_stats(server.pid) if server else None
+
+            for client in clients:
+                if client.ws is not None:
+                    await client.ws.close()
+    finally:
+        if server:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if workdir:
+            workdir.cleanup()
+
+    sent = sum(results.sent[t] for t in ("group_message", "private_message"))
+    deliveries = len(results.group_latencies) + len(results.private_latencies)
+    report = {
+        "config": {
+            "clients": args.clients,
+            "users": max(args.users, args.clients),
+            "duration_s": args.duration,
+            "message_rate": args.message_rate,
+            "pm_fraction": args.pm_fraction,
+            "switch_rate": args.switch_rate,
+            "secret_key_fraction": args.secret_key_fraction,
+            "connect_concurrency": args.connect_concurrency,
+            "rate_limits": "server" if args.keep_rate_limits or args.url else "off",
+            "url": args.url,
+            "python": platform.python_version(),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "login": {
+            "ok": len(results.login_times),
+            "failed": results.login_failures,
+            "elapsed_s": round(login_elapsed, 3),
+            "per_second": round(len(results.login_times) / login_elapsed, 1) if login_elapsed else None,
+            "latency": latency_summary(results.login_times),
+        },
+        "traffic": {
+            "elapsed_s": round(traffic_elapsed, 3),
+            "sent": results.sent,
+            "messages_per_second": round(sent / traffic_elapsed, 1) if traffic_elapsed else None,
+            "deliveries": deliveries,
+            "frames_received": results.received_frames,
+            "errors": results.errors,
+            "broadcast_latency": latency_summary(results.group_latencies),
+            "private_latency": latency_summary(results.private_latencies),
+            # Close to elapsed_s means this process, not the server, was the bottleneck
+            "client_cpu_s": round(client_cpu, 3),
+        },
+        "server": None,
+    }
+    if idle and after:
+        cpu = after["cpu_seconds"] - before["cpu_seconds"]
+        report["server"] = {
+            "rss_idle_bytes": idle["rss_bytes"],
+            "rss_after_login_bytes": after_login["rss_bytes"],
+            "rss_bytes": after["rss_bytes"],
+            "peak_rss_bytes": after["peak_rss_bytes"],
+            "rss_per_client_bytes": (after_login["rss_bytes"] - idle["rss_bytes"]) // max(1, len(online)),
+            "login_cpu_s": round(after_login["cpu_seconds"] - idle["cpu_seconds"], 3),
+            "traffic_cpu_s": round(cpu, 3),
+            "cpu_us_per_message": round(cpu * 1e6 / sent, 1) if sent else None,
+            "cpu_us_per_delivery": round(cpu * 1e6 / deliveries, 2) if deliveries else None,
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the chat server with simulated WebSocket clients")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=0, help="size of the synthetic user base (at least --clients)")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of chat traffic after everyone has logged in")
+    parser.add_argument("--message-rate", type=float, default=0.2, help="messages per second per client")
+    parser.add_argument("--pm-fraction", type=float, default=0.2, help="share of messages sent as private_message")
+    parser.add_argument("--switch-rate", type=float, default=0.02, help="room switches per second per client")
+    parser.add_argument("--secret-key-fraction", type=float, default=0.5, help="share of clients using the key handshake instead of Origin")
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--login-timeout", type=float, default=30.0)
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for in-flight frames after sending stops")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="leave the server's message rate limits on")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--url", help="test an already running server instead of starting one, e.g. http://127.0.0.1:10000")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
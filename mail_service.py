@@ -0,0 +1,290 @@
+import argparse
+import asyncio
+import os
+import smtplib
+import time
+import traceback
+from email.message import EmailMessage
+
+MAIL_QUEUE_SIZE = 1000
+MAIL_WORKERS = 2
+MAX_ATTEMPTS = 5          # tries per message before giving up on it
+BACKOFF_BASE = 1.0        # seconds; doubles each retry
+BACKOFF_MAX = 30.0
+BREAKER_THRESHOLD = 5     # consecutive failures that open the circuit
+BREAKER_COOLDOWN = 60.0   # seconds to wait before letting a trial send through
+SESSION_IDLE_TIMEOUT = 60.0  # servers drop idle connections, so don't reuse one older than this
+STOP_DRAIN_TIMEOUT = 10.0  # seconds stop() waits for queued mail to go out before dropping it
+
+
+def smtp_config_from_env():
+    return {
+        "host": os.getenv("SMTP_HOST"),
+        "port": int(os.getenv("SMTP_PORT") or 587),
+        "user": os.getenv("SMTP_USER"),
+        "password": os.getenv("SMTP_PASS"),
+        "starttls": os.getenv("SMTP_STARTTLS", "1") != "0",
+    }
+
+
+class SMTPSession:
+    # One authenticated SMTP connection, opened lazily and reused across
+    # messages. Only ever touched from one worker at a time.
+
+    def __init__(self, config):
+        self.config = config
+        self.server = None
+        self.last_used = 0.0
+
+    def _connect(self):
+        server = smtplib.SMTP(self.config["host"], self.config["port"], timeout=30)
+        if self.config["starttls"]:
+            server.starttls()
+        if self.config["user"]:
+            server.login(self.config["user"], self.config["password"])
+        self.server = server
+
+    def send(self, message):
+        if self.server is not None and time.monotonic() - self.last_used > SESSION_IDLE_TIMEOUT:
+            self.close()
+        if self.server is None:
+            self._connect()
+        try:
+            self.server.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # The reused connection went stale; one fresh connection, then let errors through
+            self.close()
+            self._connect()
+            self.server.send_message(message)
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def wait_time(self):
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold or self.opened_at is not None:
+            if self.opened_at is None:
+                print(f"[INFO] Mail circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+
+class MailService:
+    # Outbound mail off the event loop: send() just enqueues, and background
+    # workers deliver through pooled SMTP sessions in a thread.
+
+    def __init__(self, config=None, workers=MAIL_WORKERS, queue_size=MAIL_QUEUE_SIZE):
+        self.config = config or smtp_config_from_env()
+        self.worker_count = workers
+        self.queue = asyncio.Queue(queue_size)
+        self.breaker = CircuitBreaker()
+        self.workers = []
+        self.sent = 0
+        self.failed = 0
+        self.in_flight = 0
+
+    def start(self):
+        for _ in range(self.worker_count):
+            self.workers.append(asyncio.create_task(self._work(SMTPSession(self.config))))
+
+    async def stop(self, timeout=STOP_DRAIN_TIMEOUT):
+        # Let the workers finish what's queued (signup codes are waiting on it), then cancel them
+        if self.workers:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                print(f"Mail queue didn't drain in {timeout}s, dropping {self.queue.qsize() + self.in_flight} emails")
+        for worker in self.workers:
+            worker.cancel()
+        for worker in self.workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        self.workers = []
+
+    def send(self, to_email, subject, body):
+        message = EmailMessage()
+        message["Subject"] = subject
+        message["From"] = self.config["user"]
+        message["To"] = to_email
+        message.set_content(body)
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            print(f"Mail queue full, dropping email to {to_email}")
+            return False
+
+    async def _work(self, session):
+        try:
+            while True:
+                message = await self.queue.get()
+                self.in_flight += 1
+                try:
+                    await self._deliver(session, message)
+                finally:
+                    self.in_flight -= 1
+                    self.queue.task_done()
+        finally:
+            await asyncio.to_thread(session.close)
+
+    async def _deliver(self, session, message):
+        for attempt in range(MAX_ATTEMPTS):
+            wait = self.breaker.wait_time()
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                await asyncio.to_thread(session.send, message)
+                self.breaker.record_success()
+                self.sent += 1
+                print(f"Email sent to {message['To']}")
+                return
+            except Exception as e:
+                self.breaker.record_failure()
+                await asyncio.to_thread(session.close)
+                print(f"Failed to send email to {message['To']} (attempt {attempt + 1}): {e}")
+                if attempt + 1 < MAX_ATTEMPTS:
+                    await asyncio.sleep(min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX))
+        self.failed += 1
+        print(f"Giving up on email to {message['To']}")
+
+
+class SMTPSink:
+    # Bare-bones local SMTP server that accepts everything and keeps the
+    # messages, so the mail path can be exercised without a real provider.
+    # No STARTTLS: point the service at it with SMTP_STARTTLS=0.
+
+    def __init__(self, host="127.0.0.1", port=1025, verbose=False):
+        self.host = host
+        self.port = port
+        self.verbose = verbose
+        self.messages = []  # [(mail_from, [rcpt_to], raw bytes)]
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._session, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _session(self, reader, writer):
+        def reply(line):
+            writer.write(line.encode() + b"\r\n")
+
+        reply("220 chat-sink ready")
+        mail_from, rcpt_to = None, []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors="replace").strip()
+                verb = command.split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    writer.write(b"250-chat-sink\r\n250-AUTH PLAIN\r\n250 8BITMIME\r\n")
+                elif verb == "HELO":
+                    reply("250 chat-sink")
+                elif verb == "AUTH":
+                    reply("235 2.7.0 Authentication successful")
+                elif verb == "MAIL":
+                    mail_from, rcpt_to = command[10:].strip(" <>"), []
+                    reply("250 OK")
+                elif verb == "RCPT":
+                    rcpt_to.append(command[8:].strip(" <>"))
+                    reply("250 OK")
+                elif verb == "DATA":
+                    reply("354 End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    lines = []
+                    while True:
+                        data_line = await reader.readline()
+                        if data_line in (b".\r\n", b".\n", b""):
+                            break
+                        lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                    self.messages.append((mail_from, rcpt_to, b"".join(lines)))
+                    if self.verbose:
+                        print(f"[sink] {mail_from} -> {', '.join(rcpt_to)} ({sum(map(len, lines))} bytes)")
+                    reply("250 OK: queued")
+                elif verb in ("RSET", "NOOP"):
+                    reply("250 OK")
+                elif verb == "QUIT":
+                    reply("221 Bye")
+                    break
+                else:
+                    reply("502 Command not implemented")
+                await writer.drain()
+        finally:
+            await writer.drain()
+            writer.close()
+
+
+async def _smoke_test(count):
+    sink = await SMTPSink(port=0).start()
+    service = MailService({"host": sink.host, "port": sink.port, "user": "chat@example.com",
+                           "password": "secret", "starttls": False})
+    service.start()
+    for i in range(count):
+        service.send(f"user{i}@example.com", "Test", f"message {i}")
+    await service.queue.join()
+    await service.stop()
+    await sink.stop()
+    print(f"Delivered {len(sink.messages)}/{count} messages to the local sink")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat mail service tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sink_cmd = commands.add_parser("sink", help="run a local SMTP sink that accepts and logs everything")
+    sink_cmd.add_argument("--port", type=int, default=1025)
+    test_cmd = commands.add_parser("selftest", help="send messages through the service into a throwaway sink")
+    test_cmd.add_argument("--count", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == "sink":
+        async def run_sink():
+            sink = await SMTPSink(port=args.port, verbose=True).start()
+            print(f"SMTP sink listening on {sink.host}:{sink.port}")
+            await asyncio.Event().wait()
+        try:
+            asyncio.run(run_sink())
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "selftest":
+        try:
+            asyncio.run(_smoke_test(args.count))
+        except Exception:
+            traceback.print_exc()
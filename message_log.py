@@ -0,0 +1,178 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+
+SEGMENT_BYTES = 1024 * 1024  # start a new segment file once the active one reaches this size
+INDEX_INTERVAL = 64          # one sparse index entry every this many records
+
+RECORD_HEADER = struct.Struct(">IQ")  # payload length, sequence number
+INDEX_ENTRY = struct.Struct(">QQ")    # sequence number, byte offset into the segment
+
+
+class Segment:
+    # One append-only file of records starting at base_seq, plus a sparse
+    # .idx file mapping every INDEX_INTERVAL-th sequence number to its offset.
+
+    def __init__(self, directory, base_seq):
+        self.base_seq = base_seq
+        self.path = os.path.join(directory, f"{base_seq:020d}.log")
+        self.index_path = os.path.join(directory, f"{base_seq:020d}.idx")
+        self.index = []  # [(seq, offset)], ascending
+        self.next_seq = base_seq
+        self.size = 0
+
+    def scan(self):
+        # Walk every record to rebuild the index and find where valid data ends;
+        # a torn record left by a crash mid-append is cut off.
+        self.index = []
+        self.next_seq = self.base_seq
+        offset = 0
+        with open(self.path, "rb") as f:
+            data = f.read()
+        while offset + RECORD_HEADER.size <= len(data):
+            length, seq = RECORD_HEADER.unpack_from(data, offset)
+            end = offset + RECORD_HEADER.size + length
+            if end > len(data):
+                break
+            if not self.index or seq - self.index[-1][0] >= INDEX_INTERVAL:
+                self.index.append((seq, offset))
+            self.next_seq = seq + 1
+            offset = end
+        if offset < len(data):
+            print(f"[INFO] Truncating torn tail of {self.path} at byte {offset}")
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+        self.size = offset
+        with open(self.index_path, "wb") as f:
+            for seq, position in self.index:
+                f.write(INDEX_ENTRY.pack(seq, position))
+
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            self.scan()
+            return
+        with open(self.index_path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        self.index = [INDEX_ENTRY.unpack_from(data, offset) for offset in range(0, usable, INDEX_ENTRY.size)]
+        self.size = os.path.getsize(self.path)
+
+    def records_from(self, start_seq, stop_seq):
+        # Yield (seq, payload bytes) for start_seq <= seq < stop_seq, read through mmap
+        if self.size == 0:
+            return
+        slot = bisect.bisect_right(self.index, (start_seq, float("inf"))) - 1
+        offset = self.index[slot][1] if slot >= 0 else 0
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                end_of_data = min(self.size, len(data))
+                while offset + RECORD_HEADER.size <= end_of_data:
+                    length, seq = RECORD_HEADER.unpack_from(data, offset)
+                    body = offset + RECORD_HEADER.size
+                    if seq >= stop_seq or body + length > end_of_data:
+                        break
+                    if seq >= start_seq:
+                        yield seq, data[body:body + length]
+                    offset = body + length
+
+
+class MessageLog:
+    # Durable, append-only history for one room, split into segment files so
+    # scrollback only ever touches the segments it needs.
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.segments = []
+        self.log_file = None
+        self.index_file = None
+        bases = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith(".log"))
+        for base_seq in bases:
+            segment = Segment(directory, base_seq)
+            segment.load_index()
+            self.segments.append(segment)
+        if self.segments:
+            self.segments[-1].scan()  # the active segment may have a torn tail
+        else:
+            self.segments.append(Segment(directory, 0))
+        self.bases = [segment.base_seq for segment in self.segments]
+
+    @property
+    def first_seq(self):
+        return self.segments[0].base_seq
+
+    @property
+    def next_seq(self):
+        return self.segments[-1].next_seq
+
+    def _open_active(self):
+        if self.log_file is None:
+            active = self.segments[-1]
+            self.log_file = open(active.path, "ab")
+            self.index_file = open(active.index_path, "ab")
+
+    def _roll(self):
+        self.close()
+        segment = Segment(self.directory, self.next_seq)
+        self.segments.append(segment)
+        self.bases.append(segment.base_seq)
+
+    def append(self, message, seq=None):
+        # Stores the message and returns its sequence number: `seq` if given (numbered by the bus
+        # broker; skipping ahead leaves a gap for messages this log never saw), else the next one
+        if self.segments[-1].size >= SEGMENT_BYTES:
+            self._roll()
+        self._open_active()
+        active = self.segments[-1]
+        if seq is None or seq < active.next_seq:
+            seq = active.next_seq
+        payload = json.dumps(message, separators=(",", ":")).encode()
+        if not active.index or seq - active.index[-1][0] >= INDEX_INTERVAL:
+            active.index.append((seq, active.size))
+            self.index_file.write(INDEX_ENTRY.pack(seq, active.size))
+            self.index_file.flush()
+        self.log_file.write(RECORD_HEADER.pack(len(payload), seq) + payload)
+        self.log_file.flush()
+        active.size += RECORD_HEADER.size + len(payload)
+        active.next_seq = seq + 1
+        return seq
+
+    def read_range(self, start_seq, stop_seq):
+        start_seq = max(start_seq, self.first_seq)
+        stop_seq = min(stop_seq, self.next_seq)
+        messages = []
+        if start_seq >= stop_seq:
+            return messages
+        first = bisect.bisect_right(self.bases, start_seq) - 1
+        for segment in self.segments[max(first, 0):]:
+            if segment.base_seq >= stop_seq:
+                break
+            for seq, payload in segment.records_from(start_seq, stop_seq):
+                message = json.loads(payload)
+                message["seq"] = seq
+                messages.append(message)
+        return messages
+
+    def read_before(self, before_seq, limit):
+        # The `limit` messages just older than before_seq, oldest first. Sequence
+        # numbers can have gaps, so widen the window until it holds enough.
+        before_seq = min(before_seq, self.next_seq)
+        width = limit
+        while True:
+            start = max(before_seq - width, self.first_seq)
+            messages = self.read_range(start, before_seq)
+            if len(messages) >= limit or start <= self.first_seq:
+                return messages[-limit:] if limit > 0 else []
+            width *= 2
+
+    def tail(self, limit):
+        return self.read_before(self.next_seq, limit)
+
+    def close(self):
+        for f in (self.log_file, self.index_file):
+            if f is not None:
+                f.close()
+        self.log_file = None
+        self.index_file = None
@@ -0,0 +1,179 @@
+import asyncio
+import time
+
+# Minimal Prometheus text-format metrics. Everything runs on the event loop
+# thread, so counters are plain numbers in dicts: no locks, and an update is
+# one dict lookup and an add.
+
+DURATION_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, float("inf"))
+LOOP_LAG_INTERVAL = 0.5  # seconds between event-loop lag probes
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}  # label values tuple -> count
+        registry.register(self)
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+                for labels, value in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, labels=()):
+        self.values[labels] = value
+
+
+class GaugeFunction:
+    # Value(s) computed at scrape time: fn() returns a number, or
+    # [(label values, number)] when there are labels
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labelnames=(), registry=REGISTRY, kind="gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = labelnames
+        self.kind = kind
+        registry.register(self)
+
+    def samples(self):
+        result = self.fn()
+        if not self.labelnames:
+            return [f"{self.name} {format_value(result)}"]
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}" for labels, value in result]
+
+
+class Collector:
+    # Whatever sample lines fn() produces, for stats kept elsewhere in their own shape
+    def __init__(self, name, help, kind, fn, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.samples = fn
+        registry.register(self)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DURATION_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets  # upper bounds, last one +Inf
+        self.series = {}  # label values tuple -> [per-bucket counts, sum, count]
+        registry.register(self)
+
+    def observe(self, value, labels=()):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        lines = []
+        for labels, (counts, total, count) in self.series.items():
+            lines.extend(histogram_samples(self.name, self.labelnames, labels, self.buckets, counts, total, count))
+        return lines
+
+
+def histogram_samples(name, labelnames, labels, buckets, counts, total, count):
+    # counts are per bucket; Prometheus wants them cumulative
+    lines = []
+    cumulative = 0
+    for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        lines.append(f"{name}_bucket{format_labels(labelnames + ('le',), labels + (format_value(bound),))} {cumulative}")
+    lines.append(f"{name}_sum{format_labels(labelnames, labels)} {format_value(float(total))}")
+    lines.append(f"{name}_count{format_labels(labelnames, labels)} {count}")
+    return lines
+
+
+class TimedProxy:
+    # Wraps an object so every method call is timed into a histogram labelled
+    # with the method name; attributes pass straight through.
+
+    def __init__(self, target, histogram):
+        self._target = target
+        self._histogram = histogram
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+        histogram = self._histogram
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, (name,))
+        return timed
+
+
+loop_lag = Gauge("chat_event_loop_lag_seconds", "How late the last lag probe woke up")
+loop_lag_histogram = Histogram("chat_event_loop_lag_probe_seconds", "Event loop lag per probe")
+
+
+async def monitor_loop_lag(interval=LOOP_LAG_INTERVAL):
+    # Sleep a fixed interval and see how much later than asked we got control back
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        loop_lag.set(lag)
+        loop_lag_histogram.observe(lag)
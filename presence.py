@@ -0,0 +1,113 @@
+import bisect
+
+ONLINE_PAGE_SIZE = 100  # usernames per online_users page
+MAX_ONLINE_PAGE = 500
+
+
+class Presence:
+    # Who is online, across every worker. Users connected here map to all of
+    # their open sessions (one Outbox per tab); other workers only tell us
+    # which usernames they hold. A user is online while any worker has them,
+    # and only those transitions are recorded as join/leave changes.
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.sessions = {}  # username -> set of local Outboxes
+        self.workers = {}   # username -> ids of workers holding at least one session
+        self.online = []    # sorted usernames, for paging
+        self.joined = set()  # changes not yet sent to clients
+        self.left = set()
+
+    # Local sessions
+
+    def connect(self, username, outbox):
+        # True if this is the user's first session on this worker
+        sessions = self.sessions.setdefault(username, set())
+        sessions.add(outbox)
+        return len(sessions) == 1
+
+    def disconnect(self, username, outbox):
+        # True if that was the user's last session on this worker
+        sessions = self.sessions.get(username)
+        if not sessions:
+            return False
+        sessions.discard(outbox)
+        if sessions:
+            return False
+        del self.sessions[username]
+        return True
+
+    def sessions_of(self, username):
+        return self.sessions.get(username, ())
+
+    def all_sessions(self):
+        for sessions in self.sessions.values():
+            yield from sessions
+
+    def local_usernames(self):
+        return list(self.sessions)
+
+    # Online state across workers
+
+    def mark(self, worker, username, online):
+        workers = self.workers.get(username)
+        if online:
+            if workers is None:
+                self.workers[username] = {worker}
+                bisect.insort(self.online, username)
+                self._note(username, True)
+            else:
+                workers.add(worker)
+        elif workers is not None and worker in workers:
+            workers.discard(worker)
+            if not workers:
+                del self.workers[username]
+                del self.online[bisect.bisect_left(self.online, username)]
+                self._note(username, False)
+
+    def set_roster(self, worker, usernames):
+        # Replace everything we knew about one worker with its current list
+        usernames = set(usernames)
+        for username in [u for u, workers in self.workers.items() if worker in workers and u not in usernames]:
+            self.mark(worker, username, False)
+        for username in usernames:
+            self.mark(worker, username, True)
+
+    def is_online(self, username):
+        return username in self.workers
+
+    def is_remote(self, username):
+        # Connected to some other worker (possibly as well as this one)
+        return any(worker != self.worker_id for worker in self.workers.get(username, ()))
+
+    def count(self):
+        return len(self.online)
+
+    def page(self, after=None, limit=ONLINE_PAGE_SIZE):
+        # Usernames sorted, starting just past the `after` cursor
+        limit = max(1, min(limit, MAX_ONLINE_PAGE))
+        start = bisect.bisect_right(self.online, after) if after else 0
+        users = self.online[start:start + limit]
+        more = start + limit < len(self.online)
+        return {"total": len(self.online), "users": users, "next": users[-1] if more and users else None}
+
+    # Join/leave changes, batched for clients
+
+    def _note(self, username, online):
+        # A join and leave inside one batch cancel out
+        if online:
+            if username in self.left:
+                self.left.discard(username)
+            else:
+                self.joined.add(username)
+        elif username in self.joined:
+            self.joined.discard(username)
+        else:
+            self.left.add(username)
+
+    def take_changes(self):
+        if not self.joined and not self.left:
+            return None
+        changes = {"type": "presence", "joined": sorted(self.joined), "left": sorted(self.left)}
+        self.joined, self.left = set(), set()
+        return changes
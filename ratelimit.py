@@ -0,0 +1,88 @@
+import json
+import os
+import time
+
+# message type -> {role: (burst, per_seconds)}. "*" covers every role not
+# listed; None means no limit. A bucket holds `burst` tokens and refills at
+# burst/per_seconds, so "alert": (2, 86400) is two alerts, then one more
+# every 12 hours.
+DEFAULT_LIMITS = {
+    "group_message": {"*": (10, 10), "admin": None, "moderator": None},
+    "private_message": {"*": (10, 10), "admin": None, "moderator": None},
+    "prank": {"*": (3, 60)},
+    "signup": {"*": (3, 3600)},
+    "start_game": {"*": (2, 60)},
+    "alert": {"*": (2, 86400), "admin": None, "moderator": None},
+}
+PRUNE_INTERVAL = 60.0  # seconds between sweeps for buckets that have refilled completely
+
+
+def limits_from_env():
+    # RATE_LIMITS='{"group_message": {"*": [20, 10]}, "prank": {"*": null}}' overrides per type
+    limits = {msg_type: dict(by_role) for msg_type, by_role in DEFAULT_LIMITS.items()}
+    override = os.getenv("RATE_LIMITS")
+    if override:
+        for msg_type, by_role in json.loads(override).items():
+            limits[msg_type] = {role: tuple(limit) if limit else None for role, limit in by_role.items()}
+    return limits
+
+
+class RateLimiter:
+    # Token buckets keyed by (who, message type): tokens, last refill and the
+    # limit they were made under, one dict lookup per check. "who" is the
+    # username, or the client address before login.
+
+    def __init__(self, limits=None):
+        self.limits = limits if limits is not None else limits_from_env()
+        self.buckets = {}  # (who, msg_type) -> [tokens, last refill (monotonic), (burst, per)]
+        self.limited = 0
+
+    def limit_for(self, msg_type, role):
+        by_role = self.limits.get(msg_type)
+        if by_role is None:
+            return None
+        return by_role.get(role, by_role.get("*"))
+
+    def check(self, who, msg_type, role):
+        # Take one token. Returns None if allowed, else a "slow down" error frame.
+        limit = self.limit_for(msg_type, role)
+        if limit is None:
+            return None
+        burst, per = limit
+        now = time.monotonic()
+        bucket = self.buckets.get((who, msg_type))
+        if bucket is None:
+            bucket = self.buckets[(who, msg_type)] = [float(burst), now, limit]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * burst / per)
+            bucket[1] = now
+            bucket[2] = limit  # the role or RATE_LIMITS may have changed since; prune() goes by this
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return None
+        self.limited += 1
+        retry_after = (1 - bucket[0]) * per / burst
+        return {
+            "type": "error",
+            "code": "rate_limited",
+            "message": f"Slow down! Too many {msg_type} messages, try again in {retry_after:.0f}s.",
+            "for": msg_type,
+            "retry_after": round(retry_after, 1),
+            "limit": {"burst": burst, "per": per}
+        }
+
+    def prune(self):
+        # Forget buckets that would be full by now; they'd be recreated full anyway
+        now = time.monotonic()
+        for key, (tokens, updated, (burst, per)) in list(self.buckets.items()):
+            if tokens + (now - updated) * burst / per >= burst:
+                del self.buckets[key]
+
+    def export(self):
+        # For snapshots: refill times as wall-clock, since monotonic time doesn't survive a restart
+        offset = time.time() - time.monotonic()
+        return {key: (tokens, updated + offset, limit) for key, (tokens, updated, limit) in self.buckets.items()}
+
+    def restore(self, buckets):
+        offset = time.time() - time.monotonic()
+        self.buckets = {key: [tokens, updated - offset, limit] for key, (tokens, updated, limit) in buckets.items()}
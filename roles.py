@@ -0,0 +1,63 @@
+ROLES = ("admin", "moderator", "pro", "middle", "plebe")  # highest first; wins if a user is listed twice
+DEFAULT_ROLE = "noob"  # For the lost souls wandering role-less
+ROLE_CHECK_INTERVAL = 5.0  # seconds between checks for an outside edit (the nightly sync)
+
+RANK = {role: rank for rank, role in enumerate(ROLES)}
+
+
+class RoleIndex:
+    # username -> role, parsed from the backend once. set() and remove()
+    # write through and update the dict in place; the backend is only read
+    # again when its roles_stamp() moves, i.e. someone else edited the file.
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.roles = {}
+        self.stamp = None
+        self.version = 0  # bumped on every change, for export ETags
+        self.reload()
+
+    def reload(self):
+        # Returns the usernames whose role changed
+        self.stamp = self.backend.roles_stamp()
+        roles = {}
+        for entry in self.backend.load_roles():
+            username, role = entry.get("username"), entry.get("role")
+            if username and role in RANK and (username not in roles or RANK[role] < RANK[roles[username]]):
+                roles[username] = role
+        changed = {u for u in roles.keys() | self.roles.keys() if roles.get(u) != self.roles.get(u)}
+        self.roles = roles
+        if changed:
+            self.version += 1
+        return changed
+
+    def reload_if_changed(self):
+        if self.backend.roles_stamp() == self.stamp:
+            return set()
+        return self.reload()
+
+    def role_of(self, username):
+        return self.roles.get(username, DEFAULT_ROLE)
+
+    def is_staff(self, username):
+        return self.role_of(username) in ("admin", "moderator")
+
+    def set(self, username, role):
+        self.backend.set_role(username, role)
+        self.apply(username, role)
+        self.stamp = self.backend.roles_stamp()  # our own write isn't an outside edit
+
+    def remove(self, username):
+        if not self.backend.remove_role(username):
+            return False
+        self.apply(username, DEFAULT_ROLE)
+        self.stamp = self.backend.roles_stamp()
+        return True
+
+    def apply(self, username, role):
+        # In-memory only, for changes already persisted (here or by another worker)
+        self.version += 1
+        if role in RANK:
+            self.roles[username] = role
+        else:
+            self.roles.pop(username, None)
@@ -0,0 +1,21 @@
+# Everything a client needs right after login, gathered in one pass and sent
+# as a single "session_init" frame instead of role_info + login_success +
+# banned_users_list + history, plus the first page of who is online.
+# `bans` is a list of ban frames: the full list, or only what changed since
+# the version the client already had.
+
+def build_session_init(username, user, role, items, bans, room, history, online):
+    return {
+        "type": "session_init",
+        "role": role,
+        "profile": {
+            "username": username,
+            "balance": user["balance"],
+            "joined": user["joined"],
+            "screenname": user["screenname"],
+            "items": list(items)
+        },
+        "bans": bans,
+        "history": {"type": "history", "room": room, "messages": list(history)},
+        "online": online
+    }
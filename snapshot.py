@@ -0,0 +1,84 @@
+import gc
+import os
+import pickle
+import struct
+import zlib
+
+SNAPSHOT_MAGIC = b"CHATSNAP"
+SNAPSHOT_VERSION = 1
+HEADER = struct.Struct(">8sHIQ")  # magic, format version, crc32 of the payload, payload length
+SNAPSHOT_KEEP = 2  # generations on disk: file, file.1, ...
+
+
+# Whole-server state in one binary file so a cold start doesn't have to
+# re-parse every text store. The payload is a pickle of plain dicts and
+# lists; it's only ever read back by this server from its own directory,
+# same trust as users.txt. A file is accepted only if its checksum matches,
+# so a torn or half-written snapshot is skipped in favour of the previous
+# generation.
+
+def encode_snapshot(state):
+    payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, zlib.crc32(payload), len(payload)) + payload
+
+
+def decode_snapshot(data):
+    if len(data) < HEADER.size:
+        raise ValueError("truncated header")
+    magic, version, crc, length = HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("not a snapshot file")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"unsupported snapshot version {version}")
+    payload = memoryview(data)[HEADER.size:HEADER.size + length]
+    if len(payload) != length:
+        raise ValueError("truncated payload")
+    if zlib.crc32(payload) != crc:
+        raise ValueError("checksum mismatch")
+    # Hundreds of thousands of small dicts come out at once; collector passes
+    # over them midway only slow the load down
+    gc.disable()
+    try:
+        return pickle.loads(payload)
+    finally:
+        gc.enable()
+
+
+def generations(path, keep=SNAPSHOT_KEEP):
+    return [path] + [f"{path}.{i}" for i in range(1, keep)]
+
+
+def write_snapshot(path, data, keep=SNAPSHOT_KEEP):
+    # Write to a temp file and fsync, shift the older generations down, then
+    # rename into place: at every instant some complete snapshot exists.
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    paths = generations(path, keep)
+    for newer, older in reversed(list(zip(paths, paths[1:]))):
+        if os.path.exists(newer):
+            os.replace(newer, older)
+    os.replace(tmp_path, path)
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)  # make the renames themselves durable
+    finally:
+        os.close(dir_fd)
+
+
+def load_snapshot(path, keep=SNAPSHOT_KEEP):
+    # Newest generation that decodes cleanly, or None
+    for candidate in generations(path, keep):
+        try:
+            with open(candidate, "rb") as f:
+                return decode_snapshot(f.read())
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            print(f"Skipping snapshot {candidate}: {e}")
+    return None
@@ -0,0 +1,32 @@
+import os
+import re
+
+from aiohttp import web
+
+STATIC_DIR = os.getenv("STATIC_DIR", "")  # output of build_assets.py; unset = the client is hosted elsewhere
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"  # entry points: keep a copy, but check the ETag every time
+FINGERPRINTED = re.compile(r"\.[0-9a-f]{10}\.[A-Za-z0-9]+$")
+SAFE_NAME = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")
+
+
+def add_static_routes(app, root):
+    # "/" and "/<file>" from the build directory. FileResponse does the rest:
+    # the .br/.gz sibling the client accepts, ETag/If-None-Match, Range, sendfile.
+    root = os.path.abspath(root)
+
+    async def handle_static(request):
+        name = request.match_info.get("name", "index.html")
+        if not SAFE_NAME.match(name) or name.endswith((".gz", ".br")) or name == "assets.json":
+            raise web.HTTPNotFound()
+        path = os.path.join(root, name)
+        if not os.path.isfile(path):
+            raise web.HTTPNotFound()
+        headers = {
+            "Cache-Control": IMMUTABLE if FINGERPRINTED.search(name) else REVALIDATE,
+            "Vary": "Accept-Encoding",
+        }
+        return web.FileResponse(path, headers=headers)
+
+    app.router.add_get("/", handle_static)
+    app.router.add_get("/{name}", handle_static)
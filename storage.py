@@ -0,0 +1,604 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+ITEMS_FILE = "user_items.json"
+ROLES_FILE = "admins.json"
+USERS_FILE = "users.txt"
+BANNED_USERS_FILE = "banned_users.txt"
+SQLITE_FILE = "chat.sqlite3"
+
+JOURNAL_COMPACT_RECORDS = 1000    # fold the journal back into users.txt after this many records
+JOURNAL_COMPACT_INTERVAL = 300    # ...or after this many seconds, whichever comes first
+
+
+# One record per line in users.txt:
+# username:base64password:email:joined:balance:screenname
+def parse_user_line(line):
+    parts = line.strip().split(":")
+    if len(parts) < 4:
+        return None
+    username, encoded_pw, email, joined_date = parts[:4]
+    try:
+        balance = float(parts[4]) if len(parts) >= 5 else 0.0
+    except ValueError:
+        balance = 0.0
+    screenname = parts[5] if len(parts) >= 6 and parts[5] else username
+    return username, {
+        "password": encoded_pw,
+        "email": email,
+        "joined": joined_date,
+        "balance": balance,
+        "screenname": screenname
+    }
+
+
+def format_user_line(username, user, balance_text=None):
+    # balance_text: how the file spelled this balance before ("1000000", not "1000000.0"), if it hasn't changed
+    balance = balance_text if balance_text is not None else user['balance']
+    return f"{username}:{user['password']}:{user['email']}:{user['joined']}:{balance}:{user['screenname']}\n"
+
+
+def format_users(users, balance_texts=None):
+    # balance_texts: username -> (balance, text) as last written; used where the balance is still the same
+    balance_texts = balance_texts or {}
+    lines = []
+    for username, user in users.items():
+        written = balance_texts.get(username)
+        lines.append(format_user_line(username, user, written[1] if written and written[0] == user["balance"] else None))
+    return "".join(lines)
+
+
+def read_balance_texts(path):
+    # username -> (balance, text) for every line of a users file
+    texts = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                parts = line.strip().split(":")
+                parsed = parse_user_line(line)
+                if parsed and len(parts) >= 5:
+                    texts[parsed[0]] = (parsed[1]["balance"], parts[4])
+    return texts
+
+
+class UserJournal:
+    # Append-only log of user mutations, one JSON record per line. Writes hit
+    # the OS right away; fsync is batched by sync() so many mutations share
+    # one disk flush.
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self.dirty = False
+        self.file = None
+
+    def replay(self):
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        valid = 0  # bytes of complete records
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn tail from a crash mid-write
+                try:
+                    records.append(json.loads(line))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    break  # same, and nothing after it is valid
+                valid += len(line)
+        if valid < os.path.getsize(self.path):
+            # Cut it off, or the next append would be glued onto the torn line and lost with it
+            print(f"[INFO] Truncating torn tail of {self.path} at byte {valid}")
+            with open(self.path, "r+b") as f:
+                f.truncate(valid)
+        self.records = len(records)
+        return records
+
+    def count(self):
+        # Records on disk without parsing them, for when the users came from a snapshot instead of replay()
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                self.records = sum(1 for line in f if line.endswith(b"\n"))
+        return self.records
+
+    def open(self):
+        if self.file is None:
+            self.file = open(self.path, "a")
+
+    def append(self, record):
+        self.open()
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.file.flush()
+        self.records += 1
+        self.dirty = True
+
+    def sync(self):
+        if self.dirty and self.file is not None:
+            os.fsync(self.file.fileno())
+            self.dirty = False
+
+    def truncate(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        with open(self.path, "w") as f:
+            os.fsync(f.fileno())
+        self.records = 0
+        self.dirty = False
+
+    def close(self):
+        self.sync()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def write_atomic(path, content):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class StorageBackend:
+    # Everything the server persists: users, store items, roles and bans.
+    # Users are cached by UserStore, so the backend only needs to load them
+    # once and then apply single-field updates.
+
+    name = "base"
+
+    def load_users(self):
+        raise NotImplementedError
+
+    def add_user(self, username, user):
+        raise NotImplementedError
+
+    def update_user(self, username, field, value):
+        raise NotImplementedError
+
+    def load_items(self):
+        raise NotImplementedError
+
+    def get_items(self, username):
+        raise NotImplementedError
+
+    def add_item(self, username, item):
+        raise NotImplementedError
+
+    def remove_item(self, username, item):
+        raise NotImplementedError
+
+    def load_roles(self):
+        # [{"username": ..., "role": ...}], same shape as admins.json
+        raise NotImplementedError
+
+    def set_role(self, username, role):
+        raise NotImplementedError
+
+    def remove_role(self, username):
+        raise NotImplementedError
+
+    def roles_stamp(self):
+        # Changes whenever the roles are edited outside this process; None if that can't happen
+        return None
+
+    def stamp(self):
+        # Changes whenever anything persisted changes; a state snapshot taken
+        # under the same stamp still matches storage. None if we can't tell.
+        return None
+
+    def items_stamp(self):
+        # Changes whenever the items do (here or in another process)
+        return self.stamp()
+
+    def restore(self, items, roles):
+        # Seed caches from a snapshot taken under the current stamp()
+        pass
+
+    def forget_items(self):
+        # Another worker changed the items; drop any cached copy
+        pass
+
+    def load_bans(self):
+        raise NotImplementedError
+
+    def add_ban(self, username):
+        raise NotImplementedError
+
+    def remove_ban(self, username):
+        raise NotImplementedError
+
+    def dump_bans(self):
+        return "".join(f"{user}\n" for user in self.load_bans())
+
+    def flush(self, users):
+        # Called every few ms by UserStore.maintain(); users is the live cache
+        pass
+
+    def close(self, users):
+        pass
+
+
+class FlatFileBackend(StorageBackend):
+    # The original on-disk formats: users.txt (+ journal), user_items.json,
+    # admins.json and banned_users.txt.
+
+    name = "files"
+
+    def __init__(self, users_file=USERS_FILE, items_file=ITEMS_FILE,
+                 roles_file=ROLES_FILE, bans_file=BANNED_USERS_FILE):
+        self.users_file = users_file
+        self.items_file = items_file
+        self.roles_file = roles_file
+        self.bans_file = bans_file
+        self.journal = UserJournal(users_file + ".journal")
+        self.last_compact = time.monotonic()
+        self.items = None  # parsed user_items.json, valid while items_stamp() matches items_seen
+        self.items_seen = None
+        self.roles = None  # parsed admins.json, valid while roles_stamp() matches roles_seen
+        self.roles_seen = None
+
+    # users
+
+    def load_users(self):
+        users = {}
+        if os.path.exists(self.users_file):
+            with open(self.users_file, "r") as f:
+                for line in f:
+                    parsed = parse_user_line(line)
+                    if parsed:
+                        users[parsed[0]] = parsed[1]
+        # Records set absolute values, so replaying ones that already made it
+        # into users.txt (crash between compaction and truncation) is harmless.
+        for record in self.journal.replay():
+            op = record.get("op")
+            username = record.get("username")
+            if op == "add":
+                users[username] = record["user"]
+            elif op in ("balance", "screenname") and username in users:
+                users[username][op] = record["value"]
+        return users
+
+    def add_user(self, username, user):
+        self.journal.append({"op": "add", "username": username, "user": user})
+
+    def update_user(self, username, field, value):
+        self.journal.append({"op": field, "username": username, "value": value})
+
+    def stamp(self):
+        return tuple(file_stamp(path) for path in
+                     (self.users_file, self.journal.path, self.items_file, self.roles_file, self.bans_file))
+
+    def restore(self, items, roles):
+        self.journal.count()  # load_users() is skipped, but the journal still needs compacting
+        self.items = items
+        self.items_seen = self.items_stamp()
+        self.roles = roles
+        self.roles_seen = self.roles_stamp()
+
+    def forget_items(self):
+        self.items = None
+
+    def compact(self, users):
+        # Fold everything journaled so far back into users.txt, then start a fresh journal.
+        # Balances that haven't changed keep the text they had, so "1000000" stays "1000000".
+        write_atomic(self.users_file, format_users(users, read_balance_texts(self.users_file)))
+        self.journal.truncate()
+        self.last_compact = time.monotonic()
+
+    def flush(self, users, force_compact=False):
+        self.journal.sync()
+        if not self.journal.records:
+            return
+        if (force_compact or self.journal.records >= JOURNAL_COMPACT_RECORDS
+                or time.monotonic() - self.last_compact >= JOURNAL_COMPACT_INTERVAL):
+            self.compact(users)
+            print(f"[INFO] Compacted user journal into {self.users_file}")
+
+    def close(self, users):
+        self.flush(users, force_compact=True)
+        self.journal.close()
+
+    # items
+
+    def load_items(self):
+        stamp = self.items_stamp()
+        if self.items is None or stamp != self.items_seen:
+            self.items = {}
+            if os.path.exists(self.items_file):
+                try:
+                    with open(self.items_file, "r") as f:
+                        self.items = json.load(f)
+                except json.JSONDecodeError:
+                    pass
+            self.items_seen = stamp
+        return self.items
+
+    def _save_items(self):
+        write_atomic(self.items_file, json.dumps(self.items, indent=4))
+        self.items_seen = self.items_stamp()  # our own write isn't an outside edit
+
+    def get_items(self, username):
+        return self.load_items().get(username, [])
+
+    def add_item(self, username, item):
+        items = self.load_items().setdefault(username, [])
+        if item not in items:
+            items.append(item)
+            self._save_items()
+
+    def remove_item(self, username, item):
+        items = self.load_items().get(username, [])
+        if item in items:
+            items.remove(item)
+            self._save_items()
+
+    def items_stamp(self):
+        return file_stamp(self.items_file)
+
+    # roles
+
+    def roles_stamp(self):
+        return file_stamp(self.roles_file)
+
+    def load_roles(self):
+        stamp = self.roles_stamp()
+        if self.roles is None or stamp != self.roles_seen:
+            try:
+                with open(self.roles_file, "r") as f:
+                    self.roles = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError) as e:
+                print(f"Failed to load admins: {e}")
+                self.roles = []
+            self.roles_seen = stamp
+        return self.roles
+
+    def _save_roles(self, entries):
+        write_atomic(self.roles_file, json.dumps(entries, indent=2))
+        self.roles = entries
+        self.roles_seen = self.roles_stamp()
+
+    def set_role(self, username, role):
+        entries = self.load_roles()
+        for entry in entries:
+            if entry.get("username") == username:
+                entry["role"] = role
+                break
+        else:
+            entries.append({"username": username, "role": role})
+        self._save_roles(entries)
+
+    def remove_role(self, username):
+        entries = self.load_roles()
+        kept = [entry for entry in entries if entry.get("username") != username]
+        if len(kept) == len(entries):
+            return False
+        self._save_roles(kept)
+        return True
+
+    # bans
+
+    def load_bans(self):
+        if not os.path.exists(self.bans_file):
+            return set()
+        with open(self.bans_file, "r") as f:
+            return set(line.strip() for line in f if line.strip())
+
+    def add_ban(self, username):
+        if username not in self.load_bans():
+            with open(self.bans_file, "a") as f:
+                f.write(f"{username}\n")
+
+    def remove_ban(self, username):
+        bans = self.load_bans()
+        bans.discard(username)
+        with open(self.bans_file, "w") as f:
+            for user in bans:
+                f.write(f"{user}\n")
+
+    def dump_bans(self):
+        if not os.path.exists(self.bans_file):
+            return None
+        with open(self.bans_file, "r") as f:
+            return f.read()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username   TEXT PRIMARY KEY,
+    password   TEXT NOT NULL,
+    email      TEXT NOT NULL,
+    joined     TEXT NOT NULL,
+    balance    REAL NOT NULL DEFAULT 0,
+    screenname TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_email ON users(email);
+CREATE INDEX IF NOT EXISTS users_screenname ON users(screenname);
+CREATE TABLE IF NOT EXISTS items (
+    username TEXT NOT NULL,
+    item     TEXT NOT NULL,
+    UNIQUE (username, item)
+);
+CREATE TABLE IF NOT EXISTS roles (
+    username TEXT PRIMARY KEY,
+    role     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS roles_role ON roles(role);
+CREATE TABLE IF NOT EXISTS bans (
+    username TEXT PRIMARY KEY
+);
+"""
+
+# Fixed SQL strings, so sqlite3's statement cache prepares each one once
+SQL_ADD_USER = "INSERT OR REPLACE INTO users (username, password, email, joined, balance, screenname) VALUES (?, ?, ?, ?, ?, ?)"
+SQL_SET_BALANCE = "UPDATE users SET balance = ? WHERE username = ?"
+SQL_SET_SCREENNAME = "UPDATE users SET screenname = ? WHERE username = ?"
+SQL_GET_ITEMS = "SELECT item FROM items WHERE username = ? ORDER BY rowid"
+SQL_ADD_ITEM = "INSERT OR IGNORE INTO items (username, item) VALUES (?, ?)"
+SQL_REMOVE_ITEM = "DELETE FROM items WHERE username = ? AND item = ?"
+SQL_SET_ROLE = "INSERT INTO roles (username, role) VALUES (?, ?) ON CONFLICT(username) DO UPDATE SET role = excluded.role"
+SQL_REMOVE_ROLE = "DELETE FROM roles WHERE username = ?"
+SQL_ADD_BAN = "INSERT OR IGNORE INTO bans (username) VALUES (?)"
+SQL_REMOVE_BAN = "DELETE FROM bans WHERE username = ?"
+
+
+class SQLiteBackend(StorageBackend):
+    # Single-file embedded database in WAL mode. User writes are queued in
+    # memory (UserStore already serves every read) and applied by flush() in
+    # one short transaction, the same group commit the flat-file journal gets
+    # from its batched fsync. Items, roles and bans are read back from the
+    # database, so those commit straight away. Either way the write lock is
+    # only held for the length of one commit, so another worker's write never
+    # waits on a transaction left open between flushes.
+
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, cached_statements=64)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        self.conn.commit()
+        self.pending = []  # (sql, params) for user writes not yet flushed
+
+    # users
+
+    def load_users(self):
+        users = {}
+        rows = self.conn.execute("SELECT username, password, email, joined, balance, screenname FROM users ORDER BY rowid")
+        for username, password, email, joined, balance, screenname in rows:
+            users[username] = {
+                "password": password,
+                "email": email,
+                "joined": joined,
+                "balance": balance,
+                "screenname": screenname
+            }
+        return users
+
+    def add_user(self, username, user):
+        self.pending.append((SQL_ADD_USER, (username, user["password"], user["email"], user["joined"],
+                                            user["balance"], user["screenname"])))
+
+    def update_user(self, username, field, value):
+        if field == "balance":
+            self.pending.append((SQL_SET_BALANCE, (value, username)))
+        elif field == "screenname":
+            self.pending.append((SQL_SET_SCREENNAME, (value, username)))
+        else:
+            raise ValueError(f"Unknown user field: {field}")
+
+    def flush(self, users):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        with self.conn:
+            for sql, params in pending:
+                self.conn.execute(sql, params)
+
+    def stamp(self):
+        # An empty WAL is what every fresh connection creates, so it doesn't count as a change
+        wal = file_stamp(self.path + "-wal")
+        return (file_stamp(self.path), wal if wal and wal[1] else None)
+
+    def close(self, users):
+        self.flush(users)
+        self.conn.close()
+
+    # items
+
+    def load_items(self):
+        items = {}
+        for username, item in self.conn.execute("SELECT username, item FROM items ORDER BY rowid"):
+            items.setdefault(username, []).append(item)
+        return items
+
+    def get_items(self, username):
+        return [row[0] for row in self.conn.execute(SQL_GET_ITEMS, (username,))]
+
+    def add_item(self, username, item):
+        with self.conn:
+            self.conn.execute(SQL_ADD_ITEM, (username, item))
+
+    def remove_item(self, username, item):
+        with self.conn:
+            self.conn.execute(SQL_REMOVE_ITEM, (username, item))
+
+    # roles
+
+    def load_roles(self):
+        rows = self.conn.execute("SELECT username, role FROM roles ORDER BY rowid")
+        return [{"username": username, "role": role} for username, role in rows]
+
+    def set_role(self, username, role):
+        with self.conn:
+            self.conn.execute(SQL_SET_ROLE, (username, role))
+
+    def remove_role(self, username):
+        with self.conn:
+            return self.conn.execute(SQL_REMOVE_ROLE, (username,)).rowcount > 0
+
+    # bans
+
+    def load_bans(self):
+        return {row[0] for row in self.conn.execute("SELECT username FROM bans")}
+
+    def add_ban(self, username):
+        with self.conn:
+            self.conn.execute(SQL_ADD_BAN, (username,))
+
+    def remove_ban(self, username):
+        with self.conn:
+            self.conn.execute(SQL_REMOVE_BAN, (username,))
+
+
+def open_backend(kind=None):
+    kind = kind or os.getenv("STORAGE_BACKEND", "files")
+    if kind == "sqlite":
+        return SQLiteBackend(os.getenv("SQLITE_PATH", SQLITE_FILE))
+    if kind == "files":
+        return FlatFileBackend()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {kind}")
+
+
+def migrate(source, target):
+    users = source.load_users()
+    for username, user in users.items():
+        target.add_user(username, user)
+    for username, items in source.load_items().items():
+        for item in items:
+            target.add_item(username, item)
+    for entry in source.load_roles():
+        target.set_role(entry["username"], entry.get("role", "admin"))
+    for username in source.load_bans():
+        target.add_ban(username)
+    target.close(users)
+    return len(users)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat storage tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_cmd = commands.add_parser("migrate", help="copy users, items, roles and bans from the flat files into SQLite")
+    migrate_cmd.add_argument("--db", default=os.getenv("SQLITE_PATH", SQLITE_FILE))
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        if os.path.exists(args.db):
+            parser.error(f"{args.db} already exists, refusing to migrate over it")
+        count = migrate(FlatFileBackend(), SQLiteBackend(args.db))
+        print(f"Migrated {count} users into {args.db}")
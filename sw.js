@@ -1,13 +1,29 @@
+// build_assets.py fills these in: a cache per build, holding every file of that build
+const CACHE_NAME = 'superchat-dev';
+const PRECACHE = [];
+
 self.addEventListener('install', (e) => {
     self.skipWaiting();
+    e.waitUntil(caches.open(CACHE_NAME).then((cache) => cache.addAll(PRECACHE)));
     console.log('Service Worker: Installed');
   });
-  
+
   self.addEventListener('activate', (e) => {
+    // Drop the caches of older builds and take over open pages straight away
+    e.waitUntil(
+      caches.keys()
+        .then((names) => Promise.all(names.filter((name) => name !== CACHE_NAME).map((name) => caches.delete(name))))
+        .then(() => self.clients.claim())
+    );
     console.log('Service Worker: Activated');
   });
-  
+
   self.addEventListener('fetch', (e) => {
-    // Optionally handle fetch requests
+    // Cache-first for this build's files; everything else (WebSocket, APIs,
+    // ranged audio requests) goes to the network as before
+    const request = e.request;
+    if (request.method !== 'GET' || request.headers.has('range')) return;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin || !PRECACHE.includes(url.pathname)) return;
+    e.respondWith(caches.match(request, { ignoreSearch: true }).then((cached) => cached || fetch(request)));
   });
-  
\ No newline at end of file
@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+from audit import AuditLog, AuditTap
+
+
+def test_nothing_is_kept_without_subscribers():
+    tap = AuditTap()
+    tap.tap({"message": "hi"})
+    assert tap.tapped == 0 and not tap.buffer
+
+
+def test_full_buffer_drops_the_oldest():
+    tap = AuditTap(maxsize=3)
+    tap.subscribe(lambda copies: None)
+    for i in range(5):
+        tap.tap({"n": i})
+    assert [copy["n"] for copy in tap.buffer] == [2, 3, 4]
+    assert tap.tapped == 5 and tap.dropped == 2
+
+
+def test_flush_delivers_in_batches_and_survives_a_failing_subscriber():
+    batches = []
+
+    async def collect(copies):
+        batches.append([copy["n"] for copy in copies])
+
+    async def broken(copies):
+        raise RuntimeError("monitor down")
+
+    async def run():
+        tap = AuditTap(batch=2)
+        tap.subscribe(broken)
+        tap.subscribe(collect)
+        for i in range(5):
+            tap.tap({"n": i})
+        await tap.flush()
+        return tap
+
+    tap = asyncio.run(run())
+    assert batches == [[0, 1], [2, 3], [4]]
+    assert tap.delivered == 5 and not tap.buffer
+
+
+def test_run_waits_for_a_batch_then_writes_the_log(tmp_path):
+    path = tmp_path / "audit.jsonl"
+
+    async def run():
+        tap = AuditTap(batch=10, interval=0.01)
+        tap.subscribe(AuditLog(str(path)))
+        task = asyncio.create_task(tap.run())
+        tap.tap({"sender": "a", "recipient": "b", "message": "one"})
+        tap.tap({"sender": "b", "recipient": "a", "message": "two"})
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if tap.delivered == 2:
+                break
+        task.cancel()
+        return tap
+
+    tap = asyncio.run(run())
+    assert tap.delivered == 2
+    assert [json.loads(line)["message"] for line in path.read_text().splitlines()] == ["one", "two"]
@@ -0,0 +1,70 @@
+import bans
+from bans import BanList
+
+
+def banned(*usernames, epoch="e1"):
+    ban_list = BanList(epoch)
+    ban_list.load(usernames)
+    return ban_list
+
+
+def test_apply_numbers_each_change_and_ignores_no_ops():
+    ban_list = banned("a")
+    assert ban_list.apply("a", True) is None
+    assert ban_list.apply("b", True) == {"type": "ban_added", "username": "b", "version": 1}
+    assert ban_list.apply("a", False) == {"type": "ban_removed", "username": "a", "version": 2}
+    assert ban_list.apply("a", False) is None
+    assert "b" in ban_list and "a" not in ban_list
+    assert ban_list.version == 2
+
+
+def test_since_sends_only_the_missing_deltas():
+    ban_list = banned("x", "y", "z")
+    for name in ("a", "b", "c"):
+        ban_list.apply(name, True)
+    assert ban_list.since({"epoch": "e1", "version": 3}) == []
+    assert [frame["username"] for frame in ban_list.since({"epoch": "e1", "version": 1})] == ["b", "c"]
+
+
+def test_since_falls_back_to_the_full_list():
+    ban_list = banned("x")
+    ban_list.apply("a", True)
+    full = ban_list.snapshot()
+    assert full == {"type": "banned_users_list", "epoch": "e1", "version": 1, "banned_users": ["a", "x"]}
+    assert ban_list.since(None) == [full]
+    assert ban_list.since({"epoch": "other", "version": 1}) == [full]  # another process or restart
+    assert ban_list.since({"epoch": "e1", "version": 5}) == [full]  # from the future
+    assert ban_list.since({"epoch": "e1", "version": "1"}) == [full]
+
+
+def test_since_prefers_the_full_list_when_it_is_smaller():
+    ban_list = banned()
+    ban_list.apply("a", True)
+    ban_list.apply("a", False)
+    ban_list.apply("a", True)
+    assert ban_list.since({"epoch": "e1", "version": 0}) == [ban_list.snapshot()]
+
+
+def test_since_beyond_the_change_log(monkeypatch):
+    monkeypatch.setattr(bans, "BAN_LOG_SIZE", 2)
+    ban_list = banned(*[f"old{i}" for i in range(10)])
+    for name in ("a", "b", "c", "d"):
+        ban_list.apply(name, True)
+    assert [frame["version"] for frame in ban_list.since({"epoch": "e1", "version": 2})] == [3, 4]
+    assert ban_list.since({"epoch": "e1", "version": 1}) == [ban_list.snapshot()]
+
+
+def test_snapshot_is_rebuilt_after_a_change():
+    ban_list = banned("a")
+    first = ban_list.snapshot()
+    assert ban_list.snapshot() is first
+    ban_list.apply("b", True)
+    assert ban_list.snapshot()["banned_users"] == ["a", "b"]
+
+
+def test_load_starts_the_versions_over():
+    ban_list = banned("a")
+    ban_list.apply("b", True)
+    ban_list.load(["c"])
+    assert ban_list.version == 0 and ban_list.users == {"c"}
+    assert ban_list.since({"epoch": "e1", "version": 0}) == []
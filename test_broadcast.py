@@ -0,0 +1,83 @@
+import asyncio
+
+from broadcast import Audiences, Outbox, broadcast
+
+
+class FakeSocket:
+    def __init__(self):
+        self.closed = False
+        self.sent = []
+        self.close_message = None
+
+    async def send_str(self, data):
+        self.sent.append(data)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, message=b""):
+        self.closed = True
+        self.close_message = message
+
+
+def test_drop_policy_drops_frames_past_the_high_water_mark():
+    async def run():
+        ws = FakeSocket()
+        outbox = Outbox(ws, maxsize=2, policy="drop")
+        results = [outbox.send_nowait({"type": "n", "i": i}) for i in range(4)]
+        outbox.start()
+        await outbox.flush()
+        await outbox.stop()
+        return ws, outbox, results
+
+    ws, outbox, results = asyncio.run(run())
+    assert results == [True, True, False, False]
+    assert outbox.dropped == 2 and not outbox.closed
+    assert ws.sent == ['{"type": "n", "i": 0}', '{"type": "n", "i": 1}']
+
+
+def test_disconnect_policy_evicts_and_closes_the_socket():
+    async def run():
+        ws = FakeSocket()
+        outbox = Outbox(ws, maxsize=1, policy="disconnect")
+        assert outbox.send_nowait({"type": "n"})
+        assert not outbox.send_nowait({"type": "n"})
+        assert outbox.evicted and outbox.closed
+        assert not outbox.send_nowait({"type": "n"})  # nothing more once evicted
+        await asyncio.sleep(0)  # let the close task run
+        return ws
+
+    ws = asyncio.run(run())
+    assert ws.closed and ws.close_message == b"slow consumer"
+
+
+def test_broadcast_skips_closed_outboxes():
+    async def run():
+        live, gone = Outbox(FakeSocket()), Outbox(FakeSocket())
+        gone.ws.closed = True
+        sent = broadcast([live, gone], {"type": "group_message", "message": "hi"})
+        return sent, live.queue.qsize(), gone.queue.qsize()
+
+    assert asyncio.run(run()) == (1, 1, 0)
+
+
+def test_audiences_move_keeps_one_key_per_kind():
+    audiences = Audiences()
+    a, b = Outbox(FakeSocket()), Outbox(FakeSocket())
+    audiences.move("room", "general", a)
+    audiences.move("room", "general", b)
+    audiences.join(("role", "admin"), a)
+    audiences.move("room", "help", a)
+    assert set(audiences.members(("room", "general"))) == {b}
+    assert set(audiences.members(("room", "help"))) == {a}
+    assert a.audiences == {("room", "help"), ("role", "admin")}
+
+
+def test_audiences_leave_all_forgets_empty_keys():
+    audiences = Audiences()
+    a = Outbox(FakeSocket())
+    audiences.move("room", "random", a)
+    audiences.join(("role", "moderator"), a)
+    audiences.leave_all(a)
+    assert audiences.members_by_key == {} and a.audiences == set()
+    assert audiences.count(("room", "random")) == 0 and audiences.members(("room", "random")) == ()
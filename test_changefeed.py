@@ -0,0 +1,54 @@
+from changefeed import ChangeFeed
+
+
+def test_since_lists_changes_after_a_revision_oldest_first():
+    feed = ChangeFeed("e1")
+    feed.record("users", "a")
+    feed.record("items", "b")
+    feed.record("roles", "c")
+    assert feed.since(0) == [(1, "users", "a"), (2, "items", "b"), (3, "roles", "c")]
+    assert feed.since(2) == [(3, "roles", "c")]
+    assert feed.since(3) == []
+
+
+def test_only_the_latest_change_per_record_is_kept():
+    feed = ChangeFeed("e1")
+    feed.record("users", "a")
+    feed.record("users", "b")
+    feed.record("users", "a")
+    assert feed.since(0) == [(2, "users", "b"), (3, "users", "a")]
+    assert feed.revision == 3
+
+
+def test_pages_follow_on_from_the_last_revision():
+    feed = ChangeFeed("e1")
+    for i in range(5):
+        feed.record("users", f"u{i}")
+    first = feed.since(0, limit=2)
+    assert [revision for revision, _, _ in first] == [1, 2]
+    second = feed.since(first[-1][0], limit=2)
+    assert [revision for revision, _, _ in second] == [3, 4]
+    assert feed.since(second[-1][0], limit=2) == [(5, "users", "u4")]
+
+
+def test_a_reader_too_far_behind_or_ahead_has_to_start_over():
+    feed = ChangeFeed("e1", size=2)
+    for name in ("a", "b", "c", "d"):
+        feed.record("users", name)
+    assert feed.floor == 2
+    assert feed.since(1) is None
+    assert feed.since(2) == [(3, "users", "c"), (4, "users", "d")]
+    assert feed.since(5) is None
+
+
+def test_export_and_restore_keep_the_epoch_and_revisions():
+    feed = ChangeFeed("e1", size=3)
+    for name in ("a", "b", "c", "d"):
+        feed.record("items", name)
+    restored = ChangeFeed("e2", size=3)
+    restored.restore(feed.export())
+    assert restored.epoch == "e1"
+    assert restored.since(1) == feed.since(1)
+    assert restored.since(0) is None
+    restored.record("items", "e")
+    assert restored.since(4) == [(5, "items", "e")]
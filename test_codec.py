@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+import codec
+from broadcast import Outbox, encode_failures
+from codec import CODECS, DEFAULT_CODEC, SUBPROTOCOLS, Frame, codec_for
+from test_broadcast import FakeSocket
+
+
+def test_unknown_or_missing_subprotocol_gets_json():
+    assert codec_for(None) is DEFAULT_CODEC
+    assert codec_for("xml") is DEFAULT_CODEC
+    assert codec_for("json").binary is False
+
+
+def test_only_installed_codecs_are_offered_best_first():
+    assert SUBPROTOCOLS[-1] == "json"
+    assert set(SUBPROTOCOLS) == set(CODECS)
+    assert list(SUBPROTOCOLS) == [name for name in ("msgpack", "orjson", "json") if name in CODECS]
+
+
+@pytest.mark.parametrize("name", ["json", "orjson", "msgpack"])
+def test_round_trip(name):
+    if name not in CODECS:
+        pytest.skip(f"{name} not installed")
+    payload = {"type": "group_message", "message": "héllo", "seq": 3}
+    assert CODECS[name].decode(CODECS[name].encode(payload)) == payload
+
+
+@pytest.mark.skipif(codec.msgpack is None, reason="msgpack not installed")
+def test_msgpack_clients_may_still_send_json_text():
+    assert CODECS["msgpack"].decode('{"type": "ping"}') == {"type": "ping"}
+
+
+def test_frame_encodes_once_per_codec():
+    calls = []
+
+    class Counting:
+        name = "counting"
+        binary = False
+
+        def encode(self, payload):
+            calls.append(payload)
+            return "x"
+
+    frame = Frame({"type": "n"})
+    counting = Counting()
+    assert frame.encode(counting) == frame.encode(counting) == "x"
+    frame.encode(DEFAULT_CODEC)
+    assert len(calls) == 1 and set(frame.encoded) == {"counting", "json"}
+
+
+class PickyCodec:
+    # Refuses some payloads, like orjson and msgpack with integers past 64 bits
+    name = "picky"
+    binary = True
+
+    def encode(self, payload):
+        if payload.get("balance", 0) > 2 ** 64:
+            raise OverflowError("int too big")
+        return payload["type"].encode()
+
+
+def test_outbox_skips_a_frame_its_codec_cannot_encode():
+    async def run():
+        ws = FakeSocket()
+        outbox = Outbox(ws, codec=PickyCodec())
+        outbox.start()
+        outbox.send_nowait({"type": "before"})
+        outbox.send_nowait({"type": "balance", "balance": 10 ** 39})
+        outbox.send_nowait({"type": "after"})
+        await outbox.flush()
+        await outbox.stop()
+        return ws, outbox
+
+    failures = encode_failures.values.get(("picky",), 0)
+    ws, outbox = asyncio.run(run())
+    assert ws.sent == [b"before", b"after"]
+    assert not outbox.closed
+    assert encode_failures.values[("picky",)] == failures + 1
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from dispatch import NUMBER, Dispatcher, check_fields
+from ratelimit import RateLimiter
+
+
+class FakeOutbox:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, payload):
+        self.sent.append(payload)
+
+
+class FakeConn:
+    def __init__(self, role="noob"):
+        self.out = FakeOutbox()
+        self.rate_key = "u"
+        self.role = role
+
+
+@pytest.mark.parametrize("value, expected", [(5, 5), (2.5, 2.5), ("12", 12.0), (" -3.5 ", -3.5)])
+def test_numbers_and_numeric_strings_are_coerced_in_place(value, expected):
+    data = {"amount": value}
+    assert check_fields({"amount": NUMBER}, data) is None
+    assert data["amount"] == expected
+
+
+@pytest.mark.parametrize("value", [True, None, [1], "abc", "nan", "inf", float("inf"), ""])
+def test_non_numbers_are_rejected(value):
+    assert check_fields({"amount": NUMBER}, {"amount": value}) == "'amount' must be a number"
+
+
+def test_missing_and_wrongly_typed_fields():
+    assert check_fields({"room": str}, {}) == "missing 'room'"
+    assert check_fields({"room": str}, {"room": 3}) == "'room' has the wrong type"
+    assert check_fields({"who": (str, type(None))}, {"who": None}) is None
+
+
+def test_dispatch_coerces_before_the_handler_runs():
+    dispatcher = Dispatcher()
+    seen = []
+
+    @dispatcher.handler("buy", item=str, cases=("item", {"gift": {"amount": NUMBER}}))
+    async def buy(conn, data):
+        seen.append(data)
+
+    async def run():
+        conn = FakeConn()
+        await dispatcher.dispatch(conn, {"type": "buy", "item": "gift", "amount": "7"})
+        await dispatcher.dispatch(conn, {"type": "buy", "item": "gift", "amount": "lots"})
+        await dispatcher.dispatch(conn, {"type": "buy", "item": "hat"})  # no extra fields for this one
+        return conn
+
+    conn = asyncio.run(run())
+    assert [data.get("amount") for data in seen] == [7.0, None]
+    assert conn.out.sent == [{"type": "error", "message": "Malformed buy message: 'amount' must be a number."}]
+    assert dispatcher.handlers["buy"].stats.rejected == 1 and dispatcher.handlers["buy"].stats.calls == 2
+
+
+def test_unknown_malformed_and_rate_limited_frames():
+    dispatcher = Dispatcher(RateLimiter({"prank": {"*": (1, 60)}}))
+    calls = []
+
+    @dispatcher.handler("prank", target=str)
+    async def prank(conn, data):
+        calls.append(data["target"])
+
+    async def run():
+        conn = FakeConn()
+        await dispatcher.dispatch(conn, ["not", "a", "dict"])
+        await dispatcher.dispatch(conn, {"type": "teleport"})
+        await dispatcher.dispatch(conn, {"type": "prank", "target": "a"})
+        await dispatcher.dispatch(conn, {"type": "prank", "target": "b"})
+        return conn
+
+    conn = asyncio.run(run())
+    assert calls == ["a"]
+    assert dispatcher.unknown == 2
+    assert [frame.get("code") for frame in conn.out.sent] == [None, "rate_limited"]
+    assert dispatcher.handlers["prank"].stats.limited == 1
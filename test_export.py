@@ -0,0 +1,86 @@
+import asyncio
+import json
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from export import Export, etag_for, stream_export
+
+USERS = {"carol": 3, "alice": 1, "bob": 2, "dave": 4, "erin": 5}
+state = {"version": 1}
+
+
+def users_export():
+    return Export("users", lambda: USERS, lambda name, users: {"username": name, "n": users[name]},
+                  lambda: state["version"], ordered=True)
+
+
+def test_pages_walk_the_sorted_keys():
+    export = users_export()
+    keys, cursor, total = export.page(1, limit=2)
+    assert (keys, cursor, total) == (["alice", "bob"], "bob", 5)
+    assert export.page(1, "bob", 2)[:2] == (["carol", "dave"], "dave")
+    assert export.page(1, "dave", 2)[:2] == (["erin"], None)
+    assert export.page(1)[:2] == (sorted(USERS), None)
+
+
+def test_keys_are_sorted_once_per_version():
+    calls = []
+    export = Export("users", lambda: calls.append(1) or USERS, lambda name, users: {}, lambda: 1)
+    export.page(1)
+    export.page(1, "bob", 1)
+    assert len(calls) == 1
+    export.page(2)
+    assert len(calls) == 2
+
+
+def test_etag_is_weak_and_tied_to_data_and_query():
+    export = users_export()
+    tag = etag_for(7, export, 1, "ndjson", None, None)
+    assert tag.startswith('W/"')
+    assert tag == etag_for(7, export, 1, "ndjson", None, None)
+    assert tag != etag_for(7, export, 2, "ndjson", None, None)
+    assert tag != etag_for(7, export, 1, "json", None, None)
+    assert tag != etag_for(8, export, 1, "ndjson", None, None)
+
+
+def test_stream_export_pages_and_revalidates():
+    export = users_export()
+
+    async def handle(request):
+        return await stream_export(request, export, 7, lambda response: response)
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/export", handle)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            first = await client.get("/export?limit=2")
+            records = [json.loads(line) for line in (await first.text()).splitlines()]
+            assert [r["username"] for r in records] == ["alice", "bob"]
+            assert records[0]["index"] == 1  # its place in the source dict
+            assert first.headers["X-Next-Cursor"] == "bob" and first.headers["X-Total-Count"] == "5"
+
+            rest = await client.get("/export?format=json&after=bob")
+            body = json.loads(await rest.text())
+            assert [r["username"] for r in body["records"]] == ["carol", "dave", "erin"] and body["next"] is None
+            assert "X-Next-Cursor" not in rest.headers
+
+            identity = {"Accept-Encoding": "identity"}
+            plain = await client.get("/export", headers=identity)
+            gzipped = await client.get("/export", headers={"Accept-Encoding": "gzip"})
+            assert gzipped.headers.get("Content-Encoding") == "gzip"
+            assert plain.headers["ETag"] == gzipped.headers["ETag"]  # weak: same data, different bytes
+            again = await client.get("/export", headers={**identity, "If-None-Match": plain.headers["ETag"]})
+            assert again.status == 304
+            state["version"] += 1
+            changed = await client.get("/export", headers={**identity, "If-None-Match": plain.headers["ETag"]})
+            assert changed.status == 200
+
+            for bad in ("limit=0", "limit=abc", "format=xml"):
+                assert (await client.get(f"/export?{bad}")).status == 400
+        finally:
+            await client.close()
+
+    asyncio.run(run())
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+
+import mail_service
+from mail_service import CircuitBreaker, MailService
+
+
+def test_opens_after_the_threshold(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.wait_time() == 0.0
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock[0] += 15
+    assert breaker.wait_time() == 45
+
+
+def test_half_open_after_the_cooldown_then_closes_on_success(clock):
+    breaker = CircuitBreaker(threshold=1, cooldown=60)
+    breaker.record_failure()
+    clock[0] += 60
+    assert breaker.state == "half-open" and breaker.wait_time() == 0.0
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_a_failed_trial_reopens_for_a_full_cooldown(clock):
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    clock[0] += 60
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.wait_time() == 60
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_stop_sends_what_is_queued_first(monkeypatch):
+    delivered = []
+    monkeypatch.setattr(mail_service.SMTPSession, "send", lambda session, message: delivered.append(message["To"]))
+
+    async def run():
+        service = MailService(config={"user": "chat@example.com"}, workers=1)
+        service.start()
+        for i in range(5):
+            service.send(f"user{i}@example.com", "code", "1234")
+        await service.stop()
+        return service
+
+    service = asyncio.run(run())
+    assert delivered == [f"user{i}@example.com" for i in range(5)]
+    assert service.sent == 5 and service.workers == []
+
+
+def test_stop_gives_up_after_the_timeout_and_says_how_many_were_dropped(monkeypatch, capsys):
+    release = threading.Event()
+    monkeypatch.setattr(mail_service.SMTPSession, "send", lambda session, message: release.wait(5))
+
+    async def run():
+        service = MailService(config={"user": "chat@example.com"}, workers=1)
+        service.start()
+        for i in range(3):
+            service.send(f"user{i}@example.com", "code", "1234")
+        await asyncio.sleep(0)
+        await service.stop(timeout=0.05)
+        release.set()
+
+    asyncio.run(run())
+    assert "dropping 3 emails" in capsys.readouterr().out
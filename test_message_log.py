@@ -0,0 +1,84 @@
+import os
+
+import message_log
+from message_log import MessageLog
+
+
+def fill(log, count, start=0):
+    return [log.append({"message": f"m{i}"}) for i in range(start, start + count)]
+
+
+def test_append_assigns_sequence_numbers_and_reads_back(tmp_path):
+    log = MessageLog(str(tmp_path))
+    assert fill(log, 5) == [0, 1, 2, 3, 4]
+    assert [m["message"] for m in log.tail(3)] == ["m2", "m3", "m4"]
+    assert [m["seq"] for m in log.read_before(3, 2)] == [1, 2]
+    assert log.read_before(0, 10) == []
+    assert [m["seq"] for m in log.read_range(-5, 100)] == [0, 1, 2, 3, 4]
+    log.close()
+
+
+def test_reads_span_rolled_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(message_log, "SEGMENT_BYTES", 200)
+    monkeypatch.setattr(message_log, "INDEX_INTERVAL", 4)
+    log = MessageLog(str(tmp_path))
+    fill(log, 50)
+    log.close()
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(".log")]) > 1
+
+    reopened = MessageLog(str(tmp_path))
+    assert reopened.next_seq == 50
+    assert [m["seq"] for m in reopened.read_range(5, 45)] == list(range(5, 45))
+    assert [m["message"] for m in reopened.read_before(30, 3)] == ["m27", "m28", "m29"]
+    reopened.close()
+
+
+def test_torn_tail_is_truncated_on_open(tmp_path):
+    log = MessageLog(str(tmp_path))
+    fill(log, 3)
+    active = log.segments[-1].path
+    log.close()
+    with open(active, "ab") as f:
+        f.write(message_log.RECORD_HEADER.pack(100, 3) + b'{"message":')  # crash mid-append
+
+    reopened = MessageLog(str(tmp_path))
+    assert reopened.next_seq == 3
+    assert reopened.append({"message": "after"}) == 3
+    reopened.close()
+
+    again = MessageLog(str(tmp_path))
+    assert [m["message"] for m in again.tail(10)] == ["m0", "m1", "m2", "after"]
+    again.close()
+
+
+def test_missing_index_is_rebuilt(tmp_path, monkeypatch):
+    monkeypatch.setattr(message_log, "SEGMENT_BYTES", 200)
+    monkeypatch.setattr(message_log, "INDEX_INTERVAL", 4)
+    log = MessageLog(str(tmp_path))
+    fill(log, 30)
+    first = log.segments[0]
+    log.close()
+    os.remove(first.index_path)
+
+    reopened = MessageLog(str(tmp_path))
+    assert os.path.exists(first.index_path)
+    assert [m["seq"] for m in reopened.read_range(0, 30)] == list(range(30))
+    reopened.close()
+
+
+def test_bus_numbered_appends_leave_gaps(tmp_path, monkeypatch):
+    monkeypatch.setattr(message_log, "SEGMENT_BYTES", 300)
+    monkeypatch.setattr(message_log, "INDEX_INTERVAL", 4)
+    log = MessageLog(str(tmp_path))
+    seqs = [seq for seq in range(0, 60) if seq % 3 != 1]  # every third message went to another worker's rooms
+    for seq in seqs:
+        assert log.append({"message": f"m{seq}"}, seq) == seq
+    assert log.append({"message": "stale"}, 5) == 60  # an older number never overwrites
+    assert log.next_seq == 61
+    log.close()
+
+    reopened = MessageLog(str(tmp_path))
+    assert [m["seq"] for m in reopened.read_range(0, 61)] == seqs + [60]
+    assert [m["seq"] for m in reopened.read_before(30, 5)] == [21, 23, 24, 26, 27, 29][-5:]
+    assert [m["seq"] for m in reopened.read_before(3, 10)] == [0, 2]
+    reopened.close()
@@ -0,0 +1,58 @@
+from presence import Presence
+
+
+def test_first_and_last_local_session():
+    presence = Presence(1)
+    tab1, tab2 = object(), object()
+    assert presence.connect("pizza", tab1)
+    assert not presence.connect("pizza", tab2)
+    assert set(presence.sessions_of("pizza")) == {tab1, tab2}
+    assert not presence.disconnect("pizza", tab1)
+    assert presence.disconnect("pizza", tab2)
+    assert not presence.disconnect("pizza", tab2)  # already gone
+    assert presence.sessions_of("pizza") == () and presence.local_usernames() == []
+
+
+def test_online_while_any_worker_holds_the_user():
+    presence = Presence(1)
+    presence.mark(1, "pizza", True)
+    presence.mark(2, "pizza", True)
+    assert presence.is_online("pizza") and presence.is_remote("pizza")
+    assert presence.take_changes() == {"type": "presence", "joined": ["pizza"], "left": []}
+    presence.mark(1, "pizza", False)
+    assert presence.is_online("pizza") and presence.take_changes() is None
+    presence.mark(2, "pizza", False)
+    assert not presence.is_online("pizza")
+    assert presence.take_changes() == {"type": "presence", "joined": [], "left": ["pizza"]}
+
+
+def test_join_and_leave_in_one_batch_cancel_out():
+    presence = Presence(1)
+    presence.mark(1, "a", True)
+    presence.take_changes()
+    presence.mark(1, "a", False)
+    presence.mark(1, "a", True)  # reconnected before the batch went out
+    presence.mark(2, "b", True)
+    presence.mark(2, "b", False)
+    assert presence.take_changes() is None
+
+
+def test_roster_replaces_what_a_worker_had():
+    presence = Presence(1)
+    presence.set_roster(2, ["a", "b"])
+    presence.mark(3, "b", True)
+    presence.take_changes()
+    presence.set_roster(2, ["c"])  # worker 2 restarted holding only c
+    assert presence.online == ["b", "c"]
+    assert not presence.is_remote("a") and presence.is_remote("b")
+    assert presence.take_changes() == {"type": "presence", "joined": ["c"], "left": ["a"]}
+
+
+def test_pages_follow_the_cursor():
+    presence = Presence(1)
+    presence.set_roster(2, ["d", "a", "c", "b", "e"])
+    first = presence.page(limit=2)
+    assert first == {"total": 5, "users": ["a", "b"], "next": "b"}
+    assert presence.page(first["next"], 2)["users"] == ["c", "d"]
+    assert presence.page("d", 2) == {"total": 5, "users": ["e"], "next": None}
+    assert presence.page(limit=0)["users"] == ["a"]  # clamped to at least one
@@ -0,0 +1,72 @@
+import json
+
+import ratelimit
+from ratelimit import RateLimiter, limits_from_env
+
+
+def test_burst_then_refused_until_refilled(clock):
+    limiter = RateLimiter({"prank": {"*": (3, 60)}})
+    assert [limiter.check("u", "prank", "noob") for _ in range(3)] == [None, None, None]
+    refusal = limiter.check("u", "prank", "noob")
+    assert refusal["code"] == "rate_limited" and refusal["for"] == "prank"
+    assert refusal["retry_after"] == 20.0
+    clock[0] += 20
+    assert limiter.check("u", "prank", "noob") is None
+    assert limiter.check("u", "prank", "noob") is not None
+    assert limiter.limited == 2
+
+
+def test_buckets_are_per_user_and_type(clock):
+    limiter = RateLimiter({"prank": {"*": (1, 60)}, "signup": {"*": (1, 60)}})
+    assert limiter.check("u", "prank", "noob") is None
+    assert limiter.check("v", "prank", "noob") is None
+    assert limiter.check("u", "signup", "noob") is None
+    assert limiter.check("u", "prank", "noob") is not None
+
+
+def test_roles_and_types_without_a_limit(clock):
+    limiter = RateLimiter({"alert": {"*": (1, 86400), "admin": None}})
+    assert all(limiter.check("boss", "alert", "admin") is None for _ in range(10))
+    assert limiter.check("u", "group_message", "noob") is None
+    assert limiter.buckets.keys() == set()
+
+
+def test_prune_forgets_full_buckets(clock):
+    limiter = RateLimiter({"prank": {"*": (2, 60)}})
+    limiter.check("u", "prank", "noob")
+    limiter.check("v", "prank", "noob")
+    limiter.check("v", "prank", "noob")
+    clock[0] += 30
+    limiter.prune()
+    assert set(limiter.buckets) == {("v", "prank")}
+    clock[0] += 30
+    limiter.prune()
+    assert limiter.buckets == {}
+
+
+def test_export_and_restore_carry_tokens_across_a_restart(clock):
+    limiter = RateLimiter({"prank": {"*": (1, 60)}})
+    limiter.check("u", "prank", "noob")
+    saved = limiter.export()
+    clock[0] = 5.0  # new process, new monotonic clock
+    restored = RateLimiter({"prank": {"*": (1, 60)}})
+    restored.restore(saved)
+    assert restored.check("u", "prank", "noob") is not None
+
+
+def test_limits_from_env_overrides_per_type(monkeypatch):
+    monkeypatch.setenv("RATE_LIMITS", json.dumps({"prank": {"*": None}, "group_message": {"*": [20, 10]}}))
+    limits = limits_from_env()
+    assert limits["prank"] == {"*": None}
+    assert limits["group_message"] == {"*": (20, 10)}
+    assert limits["signup"] == ratelimit.DEFAULT_LIMITS["signup"]
+
+
+def test_bucket_follows_a_changed_limit(clock):
+    limiter = RateLimiter({"prank": {"*": (10, 600), "pro": (2, 60)}})
+    limiter.check("u", "prank", "noob")
+    limiter.check("u", "prank", "pro")  # promoted since the bucket was made
+    assert limiter.buckets[("u", "prank")][2] == (2, 60)
+    clock[0] += 60
+    limiter.prune()  # full again under the new limit, though not under the old one
+    assert limiter.buckets == {}
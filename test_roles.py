@@ -0,0 +1,44 @@
+import json
+
+from roles import DEFAULT_ROLE, RoleIndex
+from storage import FlatFileBackend
+
+
+def make_index(tmp_path, entries):
+    roles_file = tmp_path / "admins.json"
+    roles_file.write_text(json.dumps(entries))
+    return RoleIndex(FlatFileBackend(users_file=str(tmp_path / "users.txt"), roles_file=str(roles_file))), roles_file
+
+
+def test_highest_role_wins_and_unknown_roles_are_skipped(tmp_path):
+    index, _ = make_index(tmp_path, [
+        {"username": "a", "role": "pro"},
+        {"username": "a", "role": "moderator"},
+        {"username": "b", "role": "wizard"},
+        {"role": "admin"},
+    ])
+    assert index.roles == {"a": "moderator"}
+    assert index.role_of("b") == DEFAULT_ROLE
+    assert index.is_staff("a") and not index.is_staff("b")
+
+
+def test_outside_edit_is_picked_up_and_reports_what_changed(tmp_path):
+    index, roles_file = make_index(tmp_path, [{"username": "a", "role": "pro"}, {"username": "b", "role": "admin"}])
+    version = index.version
+    assert index.reload_if_changed() == set()
+    roles_file.write_text(json.dumps([{"username": "a", "role": "admin"}, {"username": "c", "role": "middle"},
+                                      {"username": "d", "role": "plebe"}]))
+    assert index.reload_if_changed() == {"a", "b", "c", "d"}
+    assert index.role_of("b") == DEFAULT_ROLE and index.role_of("a") == "admin"
+    assert index.version == version + 1
+    assert index.reload_if_changed() == set()
+
+
+def test_own_writes_are_not_outside_edits(tmp_path):
+    index, roles_file = make_index(tmp_path, [{"username": "a", "role": "pro"}])
+    index.set("b", "moderator")
+    assert index.remove("a")
+    assert not index.remove("nobody")
+    assert index.reload_if_changed() == set()
+    assert index.roles == {"b": "moderator"}
+    assert json.loads(roles_file.read_text()) == [{"username": "b", "role": "moderator"}]
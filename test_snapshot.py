@@ -0,0 +1,43 @@
+import pytest
+
+from snapshot import HEADER, decode_snapshot, encode_snapshot, load_snapshot, write_snapshot
+
+STATE = {"users": {"a": {"balance": 1.0}}, "bans": ["b"], "rooms": {"general": {"next_seq": 3, "messages": []}}}
+
+
+def test_round_trip():
+    assert decode_snapshot(encode_snapshot(STATE)) == STATE
+
+
+@pytest.mark.parametrize("damage, error", [
+    (lambda data: data[:HEADER.size - 1], "truncated header"),
+    (lambda data: b"NOTSNAPS" + data[8:], "not a snapshot file"),
+    (lambda data: data[:8] + b"\xff\xff" + data[10:], "unsupported snapshot version"),
+    (lambda data: data[:-1], "truncated payload"),
+    (lambda data: data[:-1] + bytes([data[-1] ^ 1]), "checksum mismatch"),
+])
+def test_damaged_snapshots_are_refused(damage, error):
+    with pytest.raises(ValueError, match=error):
+        decode_snapshot(damage(encode_snapshot(STATE)))
+
+
+def test_write_keeps_the_previous_generation(tmp_path):
+    path = str(tmp_path / "state.snapshot")
+    write_snapshot(path, encode_snapshot({"n": 1}))
+    write_snapshot(path, encode_snapshot({"n": 2}))
+    with open(path + ".1", "rb") as f:
+        assert decode_snapshot(f.read()) == {"n": 1}
+    assert load_snapshot(path) == {"n": 2}
+
+
+def test_load_falls_back_to_an_older_generation(tmp_path):
+    path = str(tmp_path / "state.snapshot")
+    write_snapshot(path, encode_snapshot({"n": 1}))
+    write_snapshot(path, encode_snapshot({"n": 2}))
+    with open(path, "r+b") as f:
+        f.truncate(HEADER.size + 3)  # torn newest generation
+    assert load_snapshot(path) == {"n": 1}
+
+
+def test_load_without_any_snapshot(tmp_path):
+    assert load_snapshot(str(tmp_path / "state.snapshot")) is None
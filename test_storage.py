@@ -0,0 +1,97 @@
+import json
+
+from storage import FlatFileBackend, UserJournal, format_user_line
+
+USER = {"password": "cHc=", "email": "a@example.com", "joined": "2024-01-01", "balance": 5.0, "screenname": "a"}
+
+
+def test_journal_replays_appended_records(tmp_path):
+    journal = UserJournal(str(tmp_path / "users.txt.journal"))
+    journal.append({"op": "add", "username": "a", "user": USER})
+    journal.append({"op": "balance", "username": "a", "value": 7.0})
+    journal.close()
+
+    replayed = UserJournal(journal.path).replay()
+    assert [record["op"] for record in replayed] == ["add", "balance"]
+
+
+def test_journal_torn_tail_is_cut_before_the_next_append(tmp_path):
+    path = tmp_path / "users.txt.journal"
+    journal = UserJournal(str(path))
+    journal.append({"op": "balance", "username": "a", "value": 1.0})
+    journal.close()
+    with open(path, "a") as f:
+        f.write('{"op":"balance","userna')  # crash mid-write
+
+    journal = UserJournal(str(path))
+    assert len(journal.replay()) == 1
+    journal.append({"op": "balance", "username": "a", "value": 2.0})
+    journal.close()
+
+    values = [record["value"] for record in UserJournal(str(path)).replay()]
+    assert values == [1.0, 2.0]
+
+
+def test_journal_line_without_newline_counts_as_torn(tmp_path):
+    path = tmp_path / "users.txt.journal"
+    path.write_text('{"op":"balance","username":"a","value":1.0}\n{"op":"balance","username":"a","value":2.0}')
+
+    journal = UserJournal(str(path))
+    assert [record["value"] for record in journal.replay()] == [1.0]
+    assert path.read_text().endswith("1.0}\n")
+
+
+def test_backend_applies_journal_over_users_file(tmp_path):
+    users_file = tmp_path / "users.txt"
+    users_file.write_text(format_user_line("a", USER))
+    backend = FlatFileBackend(users_file=str(users_file), items_file=str(tmp_path / "items.json"),
+                              roles_file=str(tmp_path / "admins.json"), bans_file=str(tmp_path / "bans.txt"))
+    backend.update_user("a", "balance", 9.0)
+    backend.add_user("b", dict(USER, email="b@example.com", screenname="b"))
+    backend.journal.close()
+
+    users = FlatFileBackend(users_file=str(users_file)).load_users()
+    assert users["a"]["balance"] == 9.0
+    assert users["b"]["email"] == "b@example.com"
+
+
+def test_compact_folds_the_journal_into_users_file(tmp_path):
+    users_file = tmp_path / "users.txt"
+    backend = FlatFileBackend(users_file=str(users_file))
+    backend.add_user("a", USER)
+    users = backend.load_users()
+    backend.compact(users)
+
+    assert backend.journal.records == 0
+    assert (tmp_path / "users.txt.journal").read_text() == ""
+    assert FlatFileBackend(users_file=str(users_file)).load_users() == {"a": json.loads(json.dumps(USER))}
+
+
+def test_restoring_from_a_snapshot_still_compacts_the_journal(tmp_path):
+    users_file = tmp_path / "users.txt"
+    users_file.write_text(format_user_line("a", USER))
+    backend = FlatFileBackend(users_file=str(users_file))
+    backend.update_user("a", "balance", 9.0)
+    backend.journal.close()
+
+    restored = FlatFileBackend(users_file=str(users_file))
+    restored.restore({}, [])  # users come from the snapshot, load_users() never runs
+    assert restored.journal.records == 1
+    restored.close({"a": dict(USER, balance=9.0)})
+    assert (tmp_path / "users.txt.journal").read_text() == ""
+    assert FlatFileBackend(users_file=str(users_file)).load_users()["a"]["balance"] == 9.0
+
+
+def test_compaction_keeps_how_unchanged_balances_were_written(tmp_path):
+    users_file = tmp_path / "users.txt"
+    users_file.write_text("a:cHc=:a@example.com:2024-01-01:1000000:a\n"
+                          "b:cHc=:b@example.com:2024-01-01:1000000000000000000000000000000000000000:b\n"
+                          "c:cHc=:c@example.com:2024-01-01:5:c\n")
+    backend = FlatFileBackend(users_file=str(users_file))
+    users = backend.load_users()
+    users["c"]["balance"] = 7.5
+    backend.update_user("c", "balance", 7.5)
+    backend.close(users)
+
+    assert [line.split(":")[4] for line in users_file.read_text().splitlines()] == [
+        "1000000", "1000000000000000000000000000000000000000", "7.5"]
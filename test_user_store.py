@@ -0,0 +1,81 @@
+from user_store import UserStore
+
+
+class RecordingBackend:
+    def __init__(self, users=None):
+        self.users = users or {}
+        self.writes = []
+
+    def load_users(self):
+        return self.users
+
+    def add_user(self, username, user):
+        self.writes.append(("add", username))
+
+    def update_user(self, username, field, value):
+        self.writes.append((field, username, value))
+
+
+def user(email, screenname, balance=0.0):
+    return {"password": "cHc=", "email": email, "joined": "2024-01-01", "balance": balance, "screenname": screenname}
+
+
+def make_store():
+    return UserStore(RecordingBackend({
+        "alice": user("alice@example.com", "Al"),
+        "bob": user("bob@example.com", "Bobby"),
+        "carol": user("carol@example.com", "Al"),  # shared screenname, alice had it first
+    }))
+
+
+def test_load_indexes_email_and_screenname():
+    store = make_store()
+    assert store.email_exists("bob@example.com") and not store.email_exists("nobody@example.com")
+    assert store.by_screenname["Al"] == ["alice", "carol"]
+    assert store.username_for_screenname("Al") == "alice"
+    assert store.username_for_screenname("Bobby") == "bob"
+    assert store.username_for_screenname("nobody") is None
+
+
+def test_screenname_conflicts():
+    store = make_store()
+    assert not store.is_screenname_conflict("bob", "Bobby")  # your own
+    assert store.is_screenname_conflict("bob", "Al")         # someone else's screenname
+    assert store.is_screenname_conflict("bob", "alice")      # someone else's username
+    assert not store.is_screenname_conflict("alice", "alice")
+    assert not store.is_screenname_conflict("bob", "Fresh")
+
+
+def test_set_screenname_moves_the_index_entry():
+    store = make_store()
+    assert store.set_screenname("alice", "Ally")
+    assert store.by_screenname["Al"] == ["carol"]
+    assert store.username_for_screenname("Ally") == "alice"
+    assert store.email_exists("alice@example.com")
+    store.set_screenname("carol", "Ally")
+    assert "Al" not in store.by_screenname
+    assert store.by_screenname["Ally"] == ["alice", "carol"]
+    assert store.backend.writes == [("screenname", "alice", "Ally"), ("screenname", "carol", "Ally")]
+    assert not store.set_screenname("nobody", "x")
+
+
+def test_add_and_set_balance_write_through_unless_told_not_to():
+    store = make_store()
+    changed = []
+    store.on_change = changed.append
+    version = store.version
+    store.add("dave", "cHc=", "dave@example.com", "2024-02-02", screenname="D")
+    store.add("erin", "cHc=", "erin@example.com", "2024-02-02", persist=False)  # another worker wrote it
+    store.set_balance("dave", "12")
+    assert store.get("dave")["balance"] == 12.0
+    assert store.username_for_screenname("erin") == "erin"
+    assert store.backend.writes == [("add", "dave"), ("balance", "dave", 12.0)]
+    assert changed == ["dave", "erin", "dave"] and store.version == version + 3
+    assert len(store) == 5 and "erin" in store
+
+
+def test_snapshot_users_skip_the_backend():
+    backend = RecordingBackend()
+    backend.load_users = None  # would fail if called
+    store = UserStore(backend, {"zed": user("zed@example.com", "Z")})
+    assert store.username_for_screenname("Z") == "zed"
@@ -1,93 +1,224 @@
-from bs4 import BeautifulSoup
 import base64
+import hashlib
+import json
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-import json
+from requests.adapters import HTTPAdapter
+
+from storage import format_user_line
 
 OWNER = 'FancyOtter99'
 REPO = 'Chat'
 GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN')
+GITHUB_API = os.environ.get('GITHUB_API', 'https://api.github.com')  # e.g. http://127.0.0.1:8765 for github_standin.py
+CHAT_URL = os.environ.get('CHAT_URL', 'https://chat-le5h.onrender.com')
+CHAT_KEY = os.environ.get('CHAT_KEY', 'letmein')
+STATE_FILE = os.environ.get('SYNC_STATE', '.sync_state.json')  # server data as of the last run, plus the feed cursors
+TIMEOUT = 60
+MAX_CURSORS = 16  # feed cursors kept, newest first; one per server process we've synced from
+
+
+# The server's /changes feed says which users, roles and items changed since
+# the revision we got last time; only those records are fetched and folded
+# into the copy kept in STATE_FILE. Each server process (every worker, each
+# restart that couldn't resume from its snapshot) has its own feed, so a
+# cursor is kept per feed epoch and all of them are sent: whichever process
+# answers picks its own. Without a usable one (first run, a process we've
+# never seen, fell too far behind) it takes a full /export instead. Each file
+# is rendered from that copy in the server's own file order (every record
+# carries its "index" there), and its git blob SHA compared with the one
+# GitHub already has, so unchanged files cost no commit.
+
+def in_file_order(records, order):
+    return sorted(records, key=lambda username: (order.get(username, float('inf')), username))
+
+def render_users(users, order):
+    return "".join(format_user_line(username, users[username]) for username in in_file_order(users, order))
+
+def render_roles(roles, order):
+    return json.dumps([{"username": username, "role": roles[username]} for username in in_file_order(roles, order)], indent=2)
+
+def render_items(items, order):
+    return json.dumps({username: items[username] for username in in_file_order(items, order)}, indent=4)
 
 tasks = [
-    {'path': 'users.txt', 'url': 'https://chat-le5h.onrender.com/secret-users?key=letmein'},
-    {'path': 'admins.json', 'url': 'https://chat-le5h.onrender.com/secret-roles?key=letmein'},
-    {'path': 'user_items.json', 'url': 'https://chat-le5h.onrender.com/secret-items?key=letmein'},
+    {'path': 'users.txt', 'collection': 'users', 'render': render_users},
+    {'path': 'admins.json', 'collection': 'roles', 'render': render_roles},
+    {'path': 'user_items.json', 'collection': 'items', 'render': render_items},
 ]
 
-def get_pre_content(html):
-    print("Parsing HTML to extract <pre> content...")
-    soup = BeautifulSoup(html, 'html.parser')
-    pres = soup.find_all('pre')
-    if not pres:
-        print("⚠️ No <pre> tags found in HTML!")
-    else:
-        print(f"✅ Found {len(pres)} <pre> tags.")
-    extracted = '\n\n'.join(pre.get_text() for pre in pres).strip()
-    print(f"Extracted content length: {len(extracted)} characters.")
-    return extracted
-
-def get_file_sha(path):
-    url = f'https://api.github.com/repos/{OWNER}/{REPO}/contents/{path}'
-    headers = {'Authorization': f'token {GITHUB_TOKEN}'}
-    print(f"Getting SHA for {path} from GitHub...")
-    r = requests.get(url, headers=headers)
-    print(f"GitHub SHA response status: {r.status_code}")
-    if r.status_code == 200:
-        sha = r.json().get('sha')
-        print(f"Current SHA for {path}: {sha}")
-        return sha
-    else:
-        print(f"⚠️ Could not get SHA for {path}. Response: {r.text}")
-        return None
-
-def update_github_file(content, path, sha=None):
-    url = f'https://api.github.com/repos/{OWNER}/{REPO}/contents/{path}'
-    headers = {
-        'Authorization': f'token {GITHUB_TOKEN}',
-        'Accept': 'application/vnd.github+json'
-    }
-    message = f'Update {path} with extracted <pre> content'
-    encoded_content = base64.b64encode(content.encode('utf-8')).decode('utf-8')
+# What we keep per username, from an export/feed record
+VALUES = {
+    'users': lambda record: {field: value for field, value in record.items() if field not in ('username', 'index')},
+    'roles': lambda record: record['role'],
+    'items': lambda record: record['items'],
+}
+
+
+def open_session():
+    # One pooled session for everything: connections are reused across requests and threads
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=len(tasks) + 1)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def git_blob_sha(content):
+    # What GitHub reports as a file's sha, computed without asking it
+    data = content.encode('utf-8')
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+def load_state():
+    try:
+        with open(STATE_FILE, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'cursors': {}, 'data': {}, 'order': {}}
+
+def save_state(state):
+    tmp_path = STATE_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, STATE_FILE)
+
+
+def fetch_export(session, collection):
+    url = f'{CHAT_URL}/export/{collection}'
+    print(f"🔗 Exporting {collection} from {url}")
+    with session.get(url, params={'key': CHAT_KEY}, stream=True, timeout=TIMEOUT) as r:
+        r.raise_for_status()
+        data = {}
+        order = {}
+        for line in r.iter_lines():
+            if line:
+                record = json.loads(line)
+                data[record['username']] = VALUES[collection](record)
+                if record.get('index') is not None:
+                    order[record['username']] = record['index']
+    print(f"✅ {collection}: {len(data)} records")
+    return data, order
+
+def fetch_changes(session, cursors):
+    params = {'key': CHAT_KEY, 'epoch': list(cursors), 'since': list(cursors.values())}
+    r = session.get(f'{CHAT_URL}/changes', params=params, timeout=TIMEOUT)
+    r.raise_for_status()
+    return r.json()
+
+def with_cursor(cursors, epoch, revision):
+    # Most recently used first, oldest dropped
+    cursors = {epoch: revision, **{e: rev for e, rev in cursors.items() if e != epoch}}
+    return dict(list(cursors.items())[:MAX_CURSORS])
+
+def fetch_exports(session, collections):
+    with ThreadPoolExecutor(len(collections)) as pool:
+        return dict(zip(collections, pool.map(lambda collection: fetch_export(session, collection), collections)))
+
+def sync_from_server(session, state):
+    cursors = state.get('cursors', {})
+    feed = fetch_changes(session, cursors)
+    if feed['reset']:
+        # Anything that changes during the export shows up again in the feed after feed['revision'].
+        # The other cursors stay good: the data is now newer than any of them.
+        print(f"🔄 No usable change cursor for {feed['epoch']}, taking a full export (server revision {feed['revision']})")
+        exported = fetch_exports(session, [task['collection'] for task in tasks])
+        return {'cursors': with_cursor(cursors, feed['epoch'], feed['revision']),
+                'data': {collection: data for collection, (data, order) in exported.items()},
+                'order': {collection: order for collection, (data, order) in exported.items()}}
+
+    data = state['data']
+    order = state.get('order', {})
+    since = cursors[feed['epoch']]
+    applied = 0
+    shifted = set()  # collections with a removal: every later record moved up, so fetch them whole
+    while True:
+        for change in feed['changes']:
+            collection, username, record = change['collection'], change['username'], change['record']
+            if record is None:
+                data.setdefault(collection, {}).pop(username, None)
+                shifted.add(collection)
+            else:
+                data.setdefault(collection, {})[username] = VALUES[collection](record)
+                if record.get('index') is not None:
+                    order.setdefault(collection, {})[username] = record['index']
+            applied += 1
+        if not feed['more']:
+            break
+        cursors = with_cursor(cursors, feed['epoch'], feed['revision'])
+        feed = fetch_changes(session, cursors)
+        if feed['reset']:
+            # The process we were paging through went away mid-way; start over
+            return sync_from_server(session, {'cursors': cursors, 'data': data, 'order': order})
+    print(f"📥 Applied {applied} changes from {feed['epoch']} (revision {since} -> {feed['revision']})")
+    if shifted:
+        for collection, (records, positions) in fetch_exports(session, sorted(shifted)).items():
+            data[collection], order[collection] = records, positions
+    return {'cursors': with_cursor(cursors, feed['epoch'], feed['revision']), 'data': data, 'order': order}
+
+
+def github_headers():
+    headers = {'Accept': 'application/vnd.github+json'}
+    if GITHUB_TOKEN:
+        headers['Authorization'] = f'token {GITHUB_TOKEN}'
+    return headers
+
+def get_remote_shas(session, paths):
+    # One directory listing per directory instead of one lookup per file
+    shas = {}
+    for directory in sorted({os.path.dirname(path) for path in paths}):
+        url = f'{GITHUB_API}/repos/{OWNER}/{REPO}/contents/{directory}'.rstrip('/')
+        r = session.get(url, headers=github_headers(), timeout=TIMEOUT)
+        r.raise_for_status()
+        shas.update({entry['path']: entry['sha'] for entry in r.json() if entry.get('type') == 'file'})
+    return shas
+
+def update_github_file(session, content, path, sha=None):
+    url = f'{GITHUB_API}/repos/{OWNER}/{REPO}/contents/{path}'
     data = {
-        'message': message,
-        'content': encoded_content
+        'message': f'Update {path} from the chat server',
+        'content': base64.b64encode(content.encode('utf-8')).decode('utf-8')
     }
     if sha:
         data['sha'] = sha
 
     print(f"Updating {path} on GitHub...")
-    r = requests.put(url, headers=headers, json=data)
-    print(f"GitHub PUT response status: {r.status_code}")
-    try:
-        print("GitHub response JSON:")
-        print(json.dumps(r.json(), indent=2))
-    except Exception as e:
-        print("⚠️ Could not parse GitHub response as JSON:", e)
+    r = session.put(url, headers=github_headers(), json=data, timeout=TIMEOUT)
     if r.status_code in (200, 201):
         print(f"✅ {path} updated successfully on GitHub!")
-    else:
-        print(f"❌ Failed to update {path} on GitHub. Response: {r.text}")
+        return True
+    print(f"❌ Failed to update {path} on GitHub ({r.status_code}): {r.text}")
+    return False
+
+
+def main():
+    session = open_session()
+    with ThreadPoolExecutor(2) as pool:
+        remote = pool.submit(get_remote_shas, session, [task['path'] for task in tasks])
+        state = sync_from_server(session, load_state())
+        remote = remote.result()
+    save_state(state)
+
+    ok = True
+    # One commit per PUT, so these go one at a time: parallel PUTs to one branch race for its head
+    for task in tasks:
+        records = state['data'].get(task['collection'])
+        if not records:
+            # An empty export is far likelier a broken server than a real wipe; never commit it
+            print(f"⚠️ No {task['collection']} from the server. Skipping update for {task['path']}.")
+            continue
+        content = task['render'](records, state.get('order', {}).get(task['collection'], {}))
+        sha = remote.get(task['path'])
+        if sha == git_blob_sha(content):
+            print(f"⏭️  {task['path']} unchanged, skipping")
+            continue
+        ok = update_github_file(session, content, task['path'], sha) and ok
+    return ok
 
-def update_task(url, path):
-    try:
-        print(f"\n🔗 Fetching data from: {url}")
-        r = requests.get(url)
-        r.raise_for_status()
-        print(f"✅ HTTP {r.status_code} OK for {url}")
-        print("---- Raw HTML preview (first 300 characters) ----")
-        print(r.text[:300] + '...' if len(r.text) > 300 else r.text)
-        print("--------------------------------------------------")
-        pre_content = get_pre_content(r.text)
-        if not pre_content:
-            print(f"⚠️ No content extracted from {url}. Skipping update for {path}.")
-            return
-        sha = get_file_sha(path)
-        update_github_file(pre_content, path, sha)
-    except Exception as e:
-        print(f"❌ Error during update for {path}: {e}")
-
-print("🚀 Starting update tasks with extra debugging...\n")
-for task in tasks:
-    update_task(task['url'], task['path'])
-print("\n🎉 All tasks completed.")
 
+if __name__ == '__main__':
+    print("🚀 Syncing server data to GitHub...\n")
+    if not main():
+        sys.exit(1)
+    print("\n🎉 All tasks completed.")
@@ -0,0 +1,131 @@
+import asyncio
+
+FLUSH_INTERVAL = 0.05  # seconds between group commits of pending user writes
+
+
+class UserStore:
+    # Users loaded once from the storage backend, then kept in memory with
+    # lookups by username, email and screenname so nothing has to rescan
+    # the whole user list. Writes go through to the backend.
+
+    def __init__(self, backend, users=None):
+        self.backend = backend
+        self.users = {}          # username -> {"password", "email", ...}
+        self.by_email = {}       # email -> username
+        self.by_screenname = {}  # screenname -> [usernames], oldest first
+        self.version = 0         # bumped on every change, for export ETags
+        self.on_change = None    # called with the username after every change
+        self.load(users)
+
+    def load(self, users=None):
+        # users: already-loaded records (from a snapshot) instead of asking the backend
+        if users is None:
+            users = self.backend.load_users()
+        # Bulk build: same result as _put() per user, without the per-user unindex checks
+        self.version += 1
+        self.users = users
+        self.by_email = {user["email"]: username for username, user in users.items()}
+        self.by_screenname = {}
+        for username, user in users.items():
+            owners = self.by_screenname.get(user["screenname"])
+            if owners is None:
+                self.by_screenname[user["screenname"]] = [username]
+            else:
+                owners.append(username)
+
+    def _put(self, username, user):
+        self.version += 1
+        if username in self.users:
+            self._unindex(username)
+        self.users[username] = user
+        self.by_email[user["email"]] = username
+        self.by_screenname.setdefault(user["screenname"], []).append(username)
+        if self.on_change:
+            self.on_change(username)
+
+    def _unindex(self, username):
+        user = self.users[username]
+        if self.by_email.get(user["email"]) == username:
+            del self.by_email[user["email"]]
+        owners = self.by_screenname.get(user["screenname"], [])
+        if username in owners:
+            owners.remove(username)
+            if not owners:
+                del self.by_screenname[user["screenname"]]
+
+    async def maintain(self):
+        # Background task: group-commit pending writes (and let the backend compact)
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                self.backend.flush(self.users)
+            except Exception as e:
+                print(f"Failed to flush user writes: {e}")
+
+    def close(self):
+        self.backend.close(self.users)
+
+    def __contains__(self, username):
+        return username in self.users
+
+    def __len__(self):
+        return len(self.users)
+
+    def get(self, username):
+        return self.users.get(username)
+
+    def email_exists(self, email):
+        return email in self.by_email
+
+    def username_for_screenname(self, screenname):
+        owners = self.by_screenname.get(screenname)
+        return owners[0] if owners else None
+
+    def is_screenname_conflict(self, username, screenname):
+        # Taken if it is someone else's username or someone else's screenname
+        if screenname in self.users and screenname != username:
+            return True
+        return any(owner != username for owner in self.by_screenname.get(screenname, []))
+
+    # persist=False only updates this process's cache, for changes another
+    # worker has already written to the backend.
+
+    def add(self, username, encoded_pw, email, joined, balance=0.0, screenname=None, persist=True):
+        user = {
+            "password": encoded_pw,
+            "email": email,
+            "joined": joined,
+            "balance": float(balance),
+            "screenname": screenname or username
+        }
+        self._put(username, user)
+        if persist:
+            self.backend.add_user(username, user)
+        return user
+
+    def set_balance(self, username, balance, persist=True):
+        user = self.users.get(username)
+        if not user:
+            return False
+        user["balance"] = float(balance)
+        self.version += 1
+        if self.on_change:
+            self.on_change(username)
+        if persist:
+            self.backend.update_user(username, "balance", user["balance"])
+        return True
+
+    def set_screenname(self, username, screenname, persist=True):
+        user = self.users.get(username)
+        if not user:
+            return False
+        self._unindex(username)
+        user["screenname"] = screenname
+        self.version += 1
+        self.by_email[user["email"]] = username
+        self.by_screenname.setdefault(screenname, []).append(username)
+        if self.on_change:
+            self.on_change(username)
+        if persist:
+            self.backend.update_user(username, "screenname", screenname)
+        return True
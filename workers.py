@@ -0,0 +1,88 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from bus import run_broker
+
+# Pre-fork launcher: N copies of chat_server.py all listening on the same
+# port with SO_REUSEPORT (the kernel spreads connections across them), plus
+# a broker process that relays bus events between them.
+
+PORT = int(os.getenv("PORT", "10000"))
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "files")
+# One worker per core only when the storage can be shared; the flat files can't
+WORKERS = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1) if STORAGE_BACKEND == "sqlite" else "1"))
+BUS_SOCKET = os.getenv("BUS_SOCKET", "/tmp/chat-bus.sock")
+RESTART_DELAY = 1.0
+
+
+def broker_main(path):
+    try:
+        asyncio.run(run_broker(path))
+    except KeyboardInterrupt:
+        pass
+
+
+def worker_main(worker_id, port, bus_path):
+    os.environ["WORKER_ID"] = str(worker_id)
+    os.environ["BUS_SOCKET"] = bus_path
+    # Imported here, after the fork, so every worker opens its own files and database connection
+    import chat_server
+    from aiohttp import web
+    print(f"Worker {worker_id} (pid {os.getpid()}) serving on port {port}")
+    web.run_app(chat_server.app, port=port, reuse_port=True, print=None)
+
+
+def main():
+    if WORKERS > 1 and STORAGE_BACKEND != "sqlite":
+        sys.exit("Multiple workers need STORAGE_BACKEND=sqlite (run 'python storage.py migrate' first); "
+                 "the flat files can't be shared between processes. Set WEB_CONCURRENCY=1 to run one worker.")
+
+    broker = multiprocessing.Process(target=broker_main, args=(BUS_SOCKET,), name="bus-broker")
+    broker.start()
+    while not os.path.exists(BUS_SOCKET) and broker.is_alive():
+        time.sleep(0.05)
+
+    workers = {}
+    stopping = False
+
+    def spawn(worker_id):
+        process = multiprocessing.Process(target=worker_main, args=(worker_id, PORT, BUS_SOCKET), name=f"worker-{worker_id}")
+        process.start()
+        workers[worker_id] = process
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in list(workers.values()) + [broker]:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for worker_id in range(WORKERS):
+        spawn(worker_id)
+    print(f"Started {WORKERS} workers on port {PORT}")
+
+    # Restart anything that dies until we're told to stop
+    while not stopping:
+        time.sleep(RESTART_DELAY)
+        if not broker.is_alive() and not stopping:
+            print("Bus broker died, restarting it")
+            broker = multiprocessing.Process(target=broker_main, args=(BUS_SOCKET,), name="bus-broker")
+            broker.start()
+        for worker_id, process in list(workers.items()):
+            if not process.is_alive() and not stopping:
+                print(f"Worker {worker_id} exited with {process.exitcode}, restarting it")
+                spawn(worker_id)
+
+    for process in list(workers.values()) + [broker]:
+        process.join(timeout=10)
+
+
+if __name__ == "__main__":
+    main()